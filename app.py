@@ -1,15 +1,17 @@
-from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, send_file
 import asyncio
 import json
 import os
 from datetime import datetime
 from dotenv import load_dotenv
-from llama_index.llms.openai_like import OpenAILike
 import queue
 import threading
 import sys
-import io
-from contextlib import redirect_stdout, redirect_stderr
+import time
+from cancellation import StopSignal
+from budget import global_budget
+from run_executor import EXECUTION_BACKEND, get_run_executor
+from utils import get_data_dir, is_valid_run_id, new_run_id
 
 load_dotenv()
 
@@ -20,10 +22,24 @@ app.config['SECRET_KEY'] = 'droidrun-ux-tester-secret'
 progress_queue = queue.Queue()
 logs_queue = queue.Queue()
 
+# Log events arriving within this many seconds are sent as one SSE frame (max LOG_BATCH_MAX events)
+LOG_BATCH_INTERVAL = float(os.getenv("LOG_BATCH_INTERVAL", "0.25"))
+LOG_BATCH_MAX = int(os.getenv("LOG_BATCH_MAX", "500"))
+
+# Full log of the current run, kept in data/runs/<run_id>/run.log for download
+run_log = {'run_id': None, 'file': None}
+run_log_lock = threading.Lock()
+
 # Global flag to signal agent stop
-agent_stop_flag = threading.Event()
+agent_stop_flag = StopSignal()
 current_exploration_thread = None
 
+# Pre-flight check results behind /readyz - the slow device check runs in the
+# background so the server accepts traffic before it finishes
+readiness = {'status': 'starting', 'checks': [], 'checked_at': None}
+readiness_lock = threading.Lock()
+readiness_thread = None
+
 class LogCapture:
     """Captures stdout/stderr and sends to SSE"""
     def __init__(self, log_callback, log_type='info'):
@@ -49,11 +65,29 @@ class LogCapture:
 
 def send_log(message, log_type='info'):
     """Send log message to SSE queue"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
     logs_queue.put({
         'message': message,
         'type': log_type,
-        'timestamp': datetime.now().strftime("%H:%M:%S")
+        'timestamp': timestamp
     })
+    with run_log_lock:
+        if run_log['file'] is not None:
+            run_log['file'].write(f"[{timestamp}] [{log_type.upper()}] {message}\n")
+
+def open_run_log(run_id):
+    """Start writing every log message to the run's artifacts"""
+    with run_log_lock:
+        if run_log['file'] is not None:
+            run_log['file'].close()
+        run_log['file'] = open(get_data_dir('runs', run_id) / 'run.log', 'a', encoding='utf-8')
+        run_log['run_id'] = run_id
+
+def close_run_log(run_id):
+    with run_log_lock:
+        if run_log['run_id'] == run_id and run_log['file'] is not None:
+            run_log['file'].close()
+            run_log['file'] = None
 
 def send_progress(message, percentage=0):
     """Send progress update to SSE queue"""
@@ -70,6 +104,52 @@ def index():
     return render_template('index.html')
 
 
+def refresh_readiness():
+    """Run all pre-flight checks (cached results are reused) and update readiness"""
+    # Import here to keep server startup fast
+    from verify_setup import run_checks
+    results = run_checks()
+    with readiness_lock:
+        readiness.update(
+            status='ready' if all(result['passed'] for result in results) else 'not_ready',
+            checks=[{key: result[key] for key in ('name', 'passed', 'cached', 'duration')} for result in results],
+            checked_at=time.time()
+        )
+    if readiness['status'] == 'ready':
+        print("✅ Pre-flight checks passed - server is ready")
+    else:
+        failed = [result['name'] for result in results if not result['passed']]
+        print(f"❌ Pre-flight checks failed: {', '.join(failed)}")
+
+
+def start_readiness_check():
+    """Refresh readiness in the background unless a refresh is already running"""
+    global readiness_thread
+    with readiness_lock:
+        if readiness_thread is not None and readiness_thread.is_alive():
+            return
+        readiness_thread = threading.Thread(target=refresh_readiness, daemon=True)
+        readiness_thread.start()
+
+
+@app.route('/healthz')
+def healthz():
+    """Liveness probe - the server process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe - all pre-flight checks (including the device) passed"""
+    from verify_setup import PREFLIGHT_CACHE_TTL
+    with readiness_lock:
+        state = dict(readiness)
+    stale = state['checked_at'] is None or time.time() - state['checked_at'] > PREFLIGHT_CACHE_TTL
+    if state['status'] != 'ready' or stale:
+        start_readiness_check()
+    return jsonify(state), 200 if state['status'] == 'ready' else 503
+
+
 @app.route('/api/run-test', methods=['POST'])
 def run_test():
     """Start UX exploration test"""
@@ -79,6 +159,17 @@ def run_test():
     app_name = data.get('app_name', 'Unknown App')
     category = data.get('category', 'General')
     max_depth = int(data.get('max_depth', 6))
+    analysis_mode = data.get('analysis_mode', os.getenv('ANALYSIS_MODE', 'standard'))
+    # Per-run profiling opt-in; None falls back to PROFILE_RUNS
+    profile = data.get('profile')
+    
+    # Refuse new runs once the global budget is spent
+    exhausted = global_budget.exhausted_reason()
+    if exhausted:
+        return jsonify({
+            'status': 'rejected',
+            'error': exhausted
+        }), 429
     
     # Clear previous queues
     while not progress_queue.empty():
@@ -88,11 +179,14 @@ def run_test():
     
     # Clear stop flag
     agent_stop_flag.clear()
+    run_id = new_run_id()
+    open_run_log(run_id)
     
-    # Start async test in background thread
+    # Start async test in background thread (with the process backend this
+    # thread only relays the worker's events)
     thread = threading.Thread(
         target=run_exploration_async,
-        args=(app_name, category, max_depth)
+        args=(app_name, category, max_depth, analysis_mode, run_id, profile)
     )
     thread.daemon = True
     thread.start()
@@ -102,9 +196,12 @@ def run_test():
     
     return jsonify({
         'status': 'started',
+        'run_id': run_id,
         'app_name': app_name,
         'category': category,
-        'max_depth': max_depth
+        'max_depth': max_depth,
+        'analysis_mode': analysis_mode,
+        'profile': profile
     })
 
 
@@ -137,18 +234,30 @@ def progress():
 
 @app.route('/api/logs')
 def logs():
-    """SSE endpoint for execution logs"""
+    """SSE endpoint for execution logs - events are coalesced into {"batch": [...]} frames"""
     def generate():
         while True:
             try:
-                log = logs_queue.get(timeout=30)
-                yield f"data: {json.dumps(log)}\n\n"
-                
-                # Stop if we see completion message
-                if 'complete' in log.get('message', '').lower() and log.get('type') == 'success':
-                    break
+                batch = [logs_queue.get(timeout=30)]
             except queue.Empty:
                 yield f"data: {json.dumps({'keepalive': True})}\n\n"
+                continue
+            
+            # Collect whatever else arrives within the batch window
+            deadline = time.monotonic() + LOG_BATCH_INTERVAL
+            while len(batch) < LOG_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(logs_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            yield f"data: {json.dumps({'batch': batch})}\n\n"
+            
+            # Stop if we see completion message
+            if any('complete' in log.get('message', '').lower() and log.get('type') == 'success' for log in batch):
+                break
     
     return Response(
         stream_with_context(generate()),
@@ -163,10 +272,13 @@ def logs():
 
 @app.route('/api/results')
 def get_results():
-    """Get analysis results"""
+    """Get analysis results of a run (?run_id=, defaults to the latest run)"""
+    run_id = request.args.get('run_id') or run_log['run_id']
+    if not run_id or not is_valid_run_id(run_id):
+        return jsonify({'error': 'No results available yet'}), 404
     try:
         # Read analysis results
-        with open('ux_analysis_blocks.json', 'r', encoding='utf-8') as f:
+        with open(get_data_dir('runs') / run_id / 'ux_analysis_blocks.json', 'r', encoding='utf-8') as f:
             data = json.load(f)
         return jsonify(data)
     except FileNotFoundError:
@@ -175,6 +287,111 @@ def get_results():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/runs/<run_id>/evidence')
+def get_evidence_index(run_id):
+    """List the deduplicated screenshots and UI trees recorded for a run"""
+    # Import here to keep server startup fast
+    from evidence_store import load_evidence_store
+    store = load_evidence_store(run_id) if is_valid_run_id(run_id) else None
+    if store is None:
+        return jsonify({'error': 'No evidence for this run'}), 404
+    items = [{key: value for key, value in item.items() if key != 'texts'} for item in store.items.values()]
+    return jsonify({'run_id': run_id, 'items': items, 'stats': store.stats})
+
+
+@app.route('/api/runs/<run_id>/evidence/<evidence_id>')
+def get_evidence(run_id, evidence_id):
+    """Serve one evidence blob - screenshots support range requests and are cached forever"""
+    from evidence_store import EVIDENCE_ID, load_evidence_store
+    if not is_valid_run_id(run_id) or not EVIDENCE_ID.fullmatch(evidence_id):
+        return jsonify({'error': 'Invalid evidence reference'}), 400
+    store = load_evidence_store(run_id)
+    blob = store.blob(evidence_id) if store is not None else None
+    if blob is None or not blob[0].exists():
+        return jsonify({'error': 'Evidence not found'}), 404
+    
+    path, mimetype = blob
+    if path.suffix == '.gz':
+        # UI trees are stored gzipped; they are small, so serve them decoded
+        import gzip
+        response = Response(gzip.decompress(path.read_bytes()), mimetype=mimetype)
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=31536000)
+    # Blobs are content-addressed, so a given ID never changes
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.route('/api/runs/<run_id>/log')
+def get_run_log(run_id):
+    """Download the full execution log of a run"""
+    if not is_valid_run_id(run_id):
+        return jsonify({'error': 'Invalid run ID'}), 400
+    path = get_data_dir('runs') / run_id / 'run.log'
+    if not path.exists():
+        return jsonify({'error': 'No log for this run'}), 404
+    with run_log_lock:
+        if run_log['run_id'] == run_id and run_log['file'] is not None:
+            run_log['file'].flush()
+    return send_file(path, mimetype='text/plain', as_attachment=True, download_name=f"{run_id}.log")
+
+
+@app.route('/api/runs/<run_id>/profile')
+def get_profile(run_id):
+    """Download a run's profile (?format=folded for the sampled stacks)"""
+    if not is_valid_run_id(run_id):
+        return jsonify({'error': 'Invalid run ID'}), 400
+    folded = request.args.get('format') == 'folded'
+    path = get_data_dir('runs') / run_id / ('profile.folded' if folded else 'profile.json')
+    if not path.exists():
+        return jsonify({'error': 'No profile for this run'}), 404
+    return send_file(path, mimetype='text/plain' if folded else 'application/json',
+                     as_attachment=True, download_name=f"{run_id}-{path.name}")
+
+
+@app.route('/api/issues/clusters')
+def get_issue_clusters():
+    """Top recurring issue clusters across stored runs (?category=, ?app=, ?app_category=, ?limit=, ?refresh=1)"""
+    # Import here to keep server startup fast
+    from issue_clusters import get_issue_index
+    index = get_issue_index()
+    # Look for newly completed runs at most every CLUSTER_REFRESH_SECONDS (?refresh=1 forces it)
+    if request.args.get('refresh') == '1':
+        index.update()
+    else:
+        index.refresh()
+    limit = request.args.get('limit', 10, type=int)
+    clusters = index.top(
+        limit=max(1, min(limit, 100)),
+        category=request.args.get('category'),
+        app=request.args.get('app'),
+        app_category=request.args.get('app_category')
+    )
+    return jsonify({'clusters': clusters, 'stats': index.stats()})
+
+
+@app.route('/api/budget')
+def get_budget():
+    """Get global LLM usage against the configured budget"""
+    return jsonify(global_budget.snapshot())
+
+
+@app.route('/api/llm/stats')
+def get_llm_stats():
+    """Get per-stage model routes and per-model latency/error statistics"""
+    # Import here so the HTTP/LLM client stack is not loaded at startup
+    from model_router import ModelRouter
+    return jsonify(ModelRouter().snapshot())
+
+
+@app.route('/api/workers')
+def get_workers():
+    """Get the run worker pool: live workers, their memory and run counters"""
+    if EXECUTION_BACKEND != 'process':
+        return jsonify({'backend': EXECUTION_BACKEND})
+    return jsonify(get_run_executor().snapshot())
+
+
 @app.route('/api/stop-agent', methods=['POST'])
 def stop_agent():
     """Stop the currently running agent"""
@@ -203,38 +420,65 @@ def stop_agent():
         }), 500
 
 
-def run_exploration_async(app_name, category, max_depth):
-    """Run the exploration and analysis asynchronously"""
+def run_exploration_async(app_name, category, max_depth, analysis_mode='standard', run_id=None, profile=None):
+    """Run the exploration and analysis asynchronously
+    
+    With EXECUTION_BACKEND=process the run executes in a pooled worker process
+    and this thread relays its logs and progress; otherwise it runs here.
+    """
     global agent_stop_flag
     
     try:
-        # Import here to avoid circular imports
-        from exploration_runner import run_exploration_with_category
-        
         send_log(f"🚀 Starting UX exploration for {app_name}...", 'info')
         send_progress(f"Initializing test for {app_name}...", 5)
         
-        # Run the exploration with stop flag
-        asyncio.run(run_exploration_with_category(
-            app_name=app_name,
-            category=category,
-            max_depth=max_depth,
-            progress_callback=send_progress,
-            log_callback=send_log,
-            stop_flag=agent_stop_flag
-        ))
+        if EXECUTION_BACKEND == 'process':
+            get_run_executor().run(
+                run_id,
+                dict(app_name=app_name, category=category, max_depth=max_depth,
+                     analysis_mode=analysis_mode, run_id=run_id, profile=profile),
+                stop_flag=agent_stop_flag,
+                log_callback=send_log,
+                progress_callback=send_progress,
+                # The server's global budget is the authoritative one; its warnings go to the run's log
+                usage_callback=lambda prompt_tokens, completion_tokens: global_budget.record(
+                    prompt_tokens, completion_tokens, send_log),
+                budget_status=global_budget
+            )
+        else:
+            # Import here to avoid circular imports
+            from exploration_runner import run_exploration_with_category
+            
+            # Run the exploration with stop flag
+            asyncio.run(run_exploration_with_category(
+                app_name=app_name,
+                category=category,
+                max_depth=max_depth,
+                progress_callback=send_progress,
+                log_callback=send_log,
+                stop_flag=agent_stop_flag,
+                analysis_mode=analysis_mode,
+                run_id=run_id,
+                profile=profile
+            ))
         
         send_log("✅ Test completed successfully!", 'success')
         send_progress("Test completed successfully!", 100)
     
     except KeyboardInterrupt:
-        send_log("⚠️ Agent execution stopped by user", 'warning')
+        elapsed = agent_stop_flag.seconds_since_request()
+        if elapsed is not None:
+            send_log(f"⚠️ Agent execution stopped by user ({elapsed:.2f}s after stop request)", 'warning')
+        else:
+            send_log("⚠️ Agent execution stopped by user", 'warning')
         send_progress("Agent stopped by user", -1)
     except Exception as e:
         error_msg = f"❌ Error: {str(e)}"
         send_log(error_msg, 'error')
         send_progress(error_msg, -1)
         print(f"Exploration error: {e}")
+    finally:
+        close_run_log(run_id)
 
 
 if __name__ == '__main__':
@@ -242,16 +486,17 @@ if __name__ == '__main__':
     os.makedirs('templates', exist_ok=True)
     os.makedirs('static', exist_ok=True)
     
-    # Run verification before starting server (only in main process, not reloader)
+    # Run the fast local checks before starting server (only in main process, not reloader)
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
-        # This is the reloader process, skip verification
-        pass
+        # This is the reloader process that serves requests: check the device in
+        # the background, /readyz reports when all checks passed
+        start_readiness_check()
     else:
         # This is the main process, run verification once
         print("Running pre-flight checks...")
         try:
-            from verify_setup import main as verify_main
-            verify_main()
+            from verify_setup import LOCAL_CHECKS, main as verify_main
+            verify_main(LOCAL_CHECKS)
         except SystemExit as e:
             if e.code != 0:
                 print("\n❌ Verification failed. Please fix the issues above.")
@@ -0,0 +1,358 @@
+"""
+Token, call, wall-clock and cost budgets for exploration and analysis runs
+
+Usage is counted from llama-index instrumentation events, so every LLM call made
+by the DroidAgent or the UXAnalyzer is charged to the budget of the run that made
+it (tracked with a context variable) and to the process-wide global budget.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Fractions of a limit at which a warning is logged (each fires once per budget)
+WARN_THRESHOLDS = (0.5, 0.8, 0.95)
+
+# Global budget window - limits apply to usage within the last day
+GLOBAL_WINDOW_SECONDS = 24 * 60 * 60
+
+_current_budget = contextvars.ContextVar('droidscope_run_budget', default=None)
+# Pipeline stage (e.g. 'agent') that LLM calls in the current context are attributed to
+_current_stage = contextvars.ContextVar('droidscope_usage_stage', default=None)
+_tracking_installed = False
+_install_lock = threading.Lock()
+# Callables(prompt_tokens, completion_tokens) told about every recorded LLM call
+_usage_listeners = []
+# Set in run worker processes, where the server process holds the global budget
+_global_delegate = None
+
+
+def _env_number(name, cast=float):
+    """Read an optional numeric limit from the environment (empty/0 means unlimited)"""
+    value = os.getenv(name, '').strip()
+    if not value:
+        return None
+    try:
+        number = cast(value)
+    except ValueError:
+        print(f"Warning: ignoring invalid value for {name}: {value}")
+        return None
+    return number if number > 0 else None
+
+
+class BudgetLimits:
+    """Upper bounds for a budget. None means unlimited."""
+
+    def __init__(self, max_tokens=None, max_llm_calls=None, max_seconds=None, max_cost=None):
+        self.max_tokens = max_tokens
+        self.max_llm_calls = max_llm_calls
+        self.max_seconds = max_seconds
+        self.max_cost = max_cost
+
+    @classmethod
+    def from_env(cls, prefix):
+        """Load limits from <prefix>_MAX_TOKENS, _MAX_LLM_CALLS, _MAX_SECONDS and _MAX_COST"""
+        return cls(
+            max_tokens=_env_number(f"{prefix}_MAX_TOKENS", int),
+            max_llm_calls=_env_number(f"{prefix}_MAX_LLM_CALLS", int),
+            max_seconds=_env_number(f"{prefix}_MAX_SECONDS"),
+            max_cost=_env_number(f"{prefix}_MAX_COST"),
+        )
+
+
+def estimate_cost(prompt_tokens, completion_tokens):
+    """Estimate spend in USD from per-1K token prices configured in the environment"""
+    prompt_price = _env_number("LLM_PRICE_PER_1K_PROMPT") or 0.0
+    completion_price = _env_number("LLM_PRICE_PER_1K_COMPLETION") or 0.0
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000.0
+
+
+class UsageBudget:
+    """Tracks LLM usage against a set of limits
+
+    Args:
+        name: Label used in warnings ('run' or 'global')
+        limits: BudgetLimits instance
+        log_callback: Optional callable(message, log_type) for threshold warnings
+        window_seconds: If set, usage resets after this many seconds
+    """
+
+    def __init__(self, name, limits, log_callback=None, window_seconds=None):
+        self.name = name
+        self.limits = limits
+        self.log_callback = log_callback
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started_at = time.monotonic()
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.cost = 0.0
+        # Tokens per usage stage, for calls made inside usage_stage()
+        self.stage_tokens = {}
+        self._warned = set()
+
+    @property
+    def tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def record(self, prompt_tokens, completion_tokens, log_callback=None, stage=None):
+        """Charge one LLM call to the budget and emit any threshold warnings"""
+        with self._lock:
+            self._roll_window()
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if stage is not None:
+                self.stage_tokens[stage] = self.stage_tokens.get(stage, 0) + prompt_tokens + completion_tokens
+            self.llm_calls += 1
+            self.cost += estimate_cost(prompt_tokens, completion_tokens)
+        self.check_thresholds(log_callback)
+
+    def _roll_window(self):
+        if self.window_seconds and self.elapsed() >= self.window_seconds:
+            self._reset()
+
+    def usage_fractions(self):
+        """Fraction of each configured limit that has been used"""
+        self._roll_window()
+        fractions = {}
+        if self.limits.max_tokens:
+            fractions['tokens'] = self.tokens / self.limits.max_tokens
+        if self.limits.max_llm_calls:
+            fractions['llm_calls'] = self.llm_calls / self.limits.max_llm_calls
+        if self.limits.max_seconds and not self.window_seconds:
+            fractions['wall_time'] = self.elapsed() / self.limits.max_seconds
+        if self.limits.max_cost:
+            fractions['cost'] = self.cost / self.limits.max_cost
+        return fractions
+
+    def exhausted_reason(self):
+        """Return a description of the first exhausted limit, or None"""
+        for dimension, fraction in self.usage_fractions().items():
+            if fraction >= 1.0:
+                return f"{self.name} {dimension} budget exhausted ({self.describe(dimension)})"
+        return None
+
+    def would_exceed(self, prompt_tokens, llm_calls=1):
+        """Description of the first limit that the given extra usage would exceed, or None
+
+        Used before fanning out several calls at once; completion tokens are not
+        known in advance, so only the prompt side is checked.
+        """
+        self._roll_window()
+        limits = self.limits
+        if limits.max_tokens and self.tokens + prompt_tokens > limits.max_tokens:
+            return f"{self.name} token budget ({self.tokens}+{prompt_tokens}/{limits.max_tokens} tokens)"
+        if limits.max_llm_calls and self.llm_calls + llm_calls > limits.max_llm_calls:
+            return f"{self.name} LLM call budget ({self.llm_calls}+{llm_calls}/{limits.max_llm_calls} calls)"
+        extra_cost = estimate_cost(prompt_tokens, 0)
+        if limits.max_cost and self.cost + extra_cost > limits.max_cost:
+            return f"{self.name} cost budget (${self.cost + extra_cost:.4f}/${limits.max_cost:.2f})"
+        return None
+
+    def check_thresholds(self, log_callback=None):
+        """Log a warning the first time each limit crosses a threshold"""
+        for dimension, fraction in self.usage_fractions().items():
+            for threshold in WARN_THRESHOLDS:
+                key = (dimension, threshold)
+                if fraction >= threshold and key not in self._warned:
+                    self._warned.add(key)
+                    self._log(
+                        f"💰 {self.name.capitalize()} budget: {int(threshold * 100)}% of {dimension} "
+                        f"used ({self.describe(dimension)})",
+                        'warning',
+                        log_callback
+                    )
+
+    def describe(self, dimension):
+        if dimension == 'tokens':
+            return f"{self.tokens}/{self.limits.max_tokens} tokens"
+        if dimension == 'llm_calls':
+            return f"{self.llm_calls}/{self.limits.max_llm_calls} calls"
+        if dimension == 'wall_time':
+            return f"{self.elapsed():.0f}/{self.limits.max_seconds:.0f}s"
+        if dimension == 'cost':
+            return f"${self.cost:.4f}/${self.limits.max_cost:.2f}"
+        return dimension
+
+    def summary(self):
+        """One-line usage summary for logs"""
+        return (f"{self.tokens} tokens ({self.prompt_tokens} prompt / {self.completion_tokens} completion), "
+                f"{self.llm_calls} LLM calls, {self.elapsed():.0f}s, ~${self.cost:.4f}")
+
+    def snapshot(self):
+        """Usage and limits as a JSON-serializable dict"""
+        return {
+            'name': self.name,
+            'tokens': self.tokens,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'llm_calls': self.llm_calls,
+            'elapsed_seconds': round(self.elapsed(), 1),
+            'estimated_cost': round(self.cost, 6),
+            'stage_tokens': dict(self.stage_tokens),
+            'limits': {
+                'max_tokens': self.limits.max_tokens,
+                'max_llm_calls': self.limits.max_llm_calls,
+                'max_seconds': self.limits.max_seconds,
+                'max_cost': self.limits.max_cost,
+            },
+            'exhausted': self.exhausted_reason(),
+        }
+
+    def _log(self, message, log_type='info', log_callback=None):
+        log_callback = log_callback or self.log_callback
+        if log_callback:
+            log_callback(message, log_type)
+        else:
+            print(f"[{log_type.upper()}] {message}")
+
+
+global_budget = UsageBudget('global', BudgetLimits.from_env('GLOBAL_BUDGET'), window_seconds=GLOBAL_WINDOW_SECONDS)
+
+
+def create_run_budget(log_callback=None):
+    """Create a per-run budget from RUN_BUDGET_* environment variables"""
+    return UsageBudget('run', BudgetLimits.from_env('RUN_BUDGET'), log_callback=log_callback)
+
+
+def activate_budget(budget):
+    """Charge LLM usage in the current context (and tasks it spawns) to this budget"""
+    _current_budget.set(budget)
+
+
+def current_budget():
+    return _current_budget.get()
+
+
+@contextmanager
+def usage_stage(name):
+    """Attribute LLM calls made in this context (and tasks started in it) to a stage"""
+    token = _current_stage.set(name)
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+
+
+def add_usage_listener(listener):
+    """Also report every LLM call to listener(prompt_tokens, completion_tokens)"""
+    _usage_listeners.append(listener)
+
+
+def delegate_global_budget(listener, status):
+    """Forward usage to another process's global budget instead of charging this one
+
+    Run worker processes use this so the server keeps the one authoritative
+    global budget (a worker's own copy would start from zero).
+
+    Args:
+        listener: Callable(prompt_tokens, completion_tokens) that forwards usage
+        status: Object whose exhausted_reason() reflects the authoritative budget
+    """
+    global _global_delegate
+    _global_delegate = status
+    add_usage_listener(listener)
+
+
+def global_budget_status():
+    """The global budget a running exploration should watch for exhaustion"""
+    return _global_delegate or global_budget
+
+
+def record_usage(prompt_tokens, completion_tokens):
+    """Charge an LLM call to the active run budget and the global budget"""
+    budget = _current_budget.get()
+    log_callback = None
+    if budget is not None:
+        budget.record(prompt_tokens, completion_tokens, stage=_current_stage.get())
+        # Route global warnings to the run's log so they show up in the UI
+        log_callback = budget.log_callback
+    if _global_delegate is None:
+        global_budget.record(prompt_tokens, completion_tokens, log_callback)
+    for listener in _usage_listeners:
+        listener(prompt_tokens, completion_tokens)
+
+
+def estimate_tokens(text):
+    """Rough token count of a text (4 characters per token)"""
+    return len(text or '') // 4
+
+
+def _prompt_text(event):
+    """Text sent to the model in an LLM end event (chat messages or completion prompt)"""
+    messages = getattr(event, 'messages', None)
+    if messages:
+        return '\n'.join(str(getattr(message, 'content', '') or '') for message in messages)
+    return getattr(event, 'prompt', None) or ''
+
+
+def _token_counts(response, prompt_text=''):
+    """Pull prompt/completion token counts out of a llama-index LLM response
+
+    Counts the provider did not report are estimated from the prompt and
+    response text, so budgets are not undercounted.
+    """
+    if response is None:
+        return estimate_tokens(prompt_text), 0
+
+    raw = getattr(response, 'raw', None)
+    usage = raw.get('usage') if isinstance(raw, dict) else getattr(raw, 'usage', None)
+    if usage is not None:
+        if not isinstance(usage, dict):
+            usage = {
+                'prompt_tokens': getattr(usage, 'prompt_tokens', 0),
+                'completion_tokens': getattr(usage, 'completion_tokens', 0),
+            }
+        return int(usage.get('prompt_tokens') or 0) or estimate_tokens(prompt_text), int(usage.get('completion_tokens') or 0)
+
+    extra = getattr(response, 'additional_kwargs', None) or {}
+    if 'prompt_tokens' in extra or 'completion_tokens' in extra:
+        return int(extra.get('prompt_tokens') or 0) or estimate_tokens(prompt_text), int(extra.get('completion_tokens') or 0)
+
+    # Provider did not report usage - fall back to a rough 4 chars/token estimate
+    text = getattr(response, 'text', None)
+    if text is None:
+        message = getattr(response, 'message', None)
+        text = getattr(message, 'content', None) or ''
+    return estimate_tokens(prompt_text), estimate_tokens(text)
+
+
+def install_usage_tracking():
+    """Register the llama-index instrumentation handler that feeds the budgets (idempotent)"""
+    global _tracking_installed
+
+    with _install_lock:
+        if _tracking_installed:
+            return True
+        try:
+            from llama_index.core.instrumentation import get_dispatcher
+            from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+            from llama_index.core.instrumentation.events.llm import LLMChatEndEvent, LLMCompletionEndEvent
+        except ImportError:
+            print("Warning: llama-index instrumentation unavailable, LLM usage will not be budgeted")
+            return False
+
+        class UsageEventHandler(BaseEventHandler):
+            @classmethod
+            def class_name(cls):
+                return "DroidScopeUsageEventHandler"
+
+            def handle(self, event, **kwargs):
+                if isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+                    prompt_tokens, completion_tokens = _token_counts(event.response, _prompt_text(event))
+                    record_usage(prompt_tokens, completion_tokens)
+
+        get_dispatcher().add_event_handler(UsageEventHandler())
+        _tracking_installed = True
+        return True
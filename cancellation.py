@@ -0,0 +1,105 @@
+"""
+Cooperative cancellation for exploration runs
+"""
+import asyncio
+import threading
+import time
+
+
+# How often the watcher checks the stop signal while the agent is running
+STOP_POLL_INTERVAL = 0.1
+
+# How long to wait for the agent workflow to tear itself down after cancelling
+CANCEL_GRACE_PERIOD = 5.0
+
+
+class StopSignal(threading.Event):
+    """Thread-safe stop flag that remembers when and why it was set"""
+
+    def __init__(self):
+        super().__init__()
+        self.requested_at = None
+        self.reason = None
+
+    def set(self, reason='user'):
+        if not self.is_set():
+            self.requested_at = time.monotonic()
+            self.reason = reason
+        super().set()
+
+    def clear(self):
+        self.requested_at = None
+        self.reason = None
+        super().clear()
+
+    def seconds_since_request(self):
+        """Seconds elapsed since the stop was requested, or None if not requested"""
+        if self.requested_at is None:
+            return None
+        return time.monotonic() - self.requested_at
+
+
+async def run_until_stopped(handler, stop_flag, budget=None, poll_interval=STOP_POLL_INTERVAL, budgets=()):
+    """Await an agent run, cancelling it as soon as the stop flag is set
+
+    Args:
+        handler: Awaitable returned by ``agent.run()`` (workflow handler or coroutine)
+        stop_flag: threading.Event (ideally a StopSignal) checked by the watcher
+        budget: Optional UsageBudget; the run is wound down once it is exhausted
+        poll_interval: Seconds between stop flag checks
+        budgets: Further budgets to watch the same way (anything with exhausted_reason(),
+                 e.g. the global budget)
+
+    Returns:
+        tuple: (result, stop_reason, time_to_stop) where stop_reason is None if the
+               agent finished on its own, 'user' for a stop request or the budget's
+               exhaustion message, and time_to_stop is the seconds from the stop
+               request until the agent task was torn down
+    """
+    agent_task = asyncio.ensure_future(handler)
+    watched = [watched_budget for watched_budget in (budget, *budgets) if watched_budget is not None]
+
+    if stop_flag is None and not watched:
+        return await agent_task, None, None
+
+    stop_reason = None
+
+    async def watch():
+        nonlocal stop_reason
+        while True:
+            if stop_flag is not None and stop_flag.is_set():
+                stop_reason = 'user'
+                return
+            for watched_budget in watched:
+                exhausted = watched_budget.exhausted_reason()
+                if exhausted:
+                    stop_reason = exhausted
+                    return
+            await asyncio.sleep(poll_interval)
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        done, _ = await asyncio.wait({agent_task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if agent_task in done:
+            return agent_task.result(), None, None
+
+        # Stop requested: cancel the workflow so in-flight LLM requests are aborted
+        detected_at = time.monotonic()
+        cancel_run = getattr(handler, 'cancel_run', None)
+        if cancel_run is not None:
+            try:
+                await asyncio.wait_for(cancel_run(), timeout=CANCEL_GRACE_PERIOD)
+            except Exception:
+                pass
+        agent_task.cancel()
+        try:
+            await asyncio.wait_for(agent_task, timeout=CANCEL_GRACE_PERIOD)
+        except (asyncio.CancelledError, Exception):
+            pass
+
+        requested_at = detected_at
+        if stop_reason == 'user':
+            requested_at = getattr(stop_flag, 'requested_at', None) or detected_at
+        return None, stop_reason, time.monotonic() - requested_at
+    finally:
+        watcher.cancel()
@@ -0,0 +1,225 @@
+"""
+Device sessions shared across exploration runs
+
+The device serial and the device's health state are kept per device and
+process. Every run connects its own droidrun tools on its own event loop: the
+tools are bound to the loop that created them and droidrun has no public way
+to clear the per-run agent state a run leaves on them, so they are never
+shared between runs and setup is a cold connect each time. Before a run the
+device is reset: the app the previous run left in the foreground is
+force-stopped (so the next run relaunches it cold) and the device goes back to
+the home screen. Idle devices are health-checked in the background with
+`adb get-state`, which shares nothing with a run.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# Track devices across runs and reset them before each run (set DEVICE_SESSIONS=0 to let droidrun pick the device)
+DEVICE_SESSIONS = os.getenv("DEVICE_SESSIONS", "1") != "0"
+# Device to use; empty picks the first connected adb device
+DEVICE_SERIAL = os.getenv("DEVICE_SERIAL", "").strip() or None
+# Talk to the Portal app over TCP instead of the content provider
+DEVICE_USE_TCP = os.getenv("DEVICE_USE_TCP", "0") == "1"
+# Seconds between background health checks of idle devices (0 = off)
+DEVICE_HEALTH_INTERVAL = _env_float("DEVICE_HEALTH_INTERVAL", 30)
+
+HOME_KEYCODE = 3
+
+# Foreground packages that are never force-stopped during a reset
+PROTECTED_PACKAGES = re.compile(r'launcher|systemui|com\.droidrun\.portal|^android$', re.IGNORECASE)
+FOCUSED_PACKAGE = re.compile(r'(?:mCurrentFocus|mFocusedApp|mResumedActivity)[^\n]*?\s([a-zA-Z][\w.]+)/')
+
+
+async def _default_serial():
+    """Serial of the first connected Android device"""
+    from async_adbutils import adb
+    devices = await adb.list()
+    if not devices:
+        raise ValueError("No connected Android devices found.")
+    return devices[0].serial
+
+
+class DeviceSession:
+    """A device's serial and health state, and the tools of the run using it"""
+
+    def __init__(self, serial, use_tcp=DEVICE_USE_TCP):
+        self.serial = serial
+        self.use_tcp = use_tcp
+        # Only set while a run holds the session; created on that run's event loop
+        self.tools = None
+        self.state = 'new'
+        self.runs = 0
+        self.created_at = time.time()
+        self.last_used = None
+        self.last_health_check = None
+        self.last_error = None
+
+    async def connect(self):
+        """Create the run's tools and connect to the device and Portal"""
+        # Import here to avoid loading the agent stack until a run needs it
+        from droidrun.tools import AdbTools
+        tools = AdbTools(serial=self.serial, use_tcp=self.use_tcp)
+        await tools.connect()
+        self.tools = tools
+
+    async def foreground_package(self):
+        """Package of the focused app, or None if it cannot be determined"""
+        try:
+            output = await self.tools.device.shell("dumpsys window | grep -E 'mCurrentFocus|mFocusedApp'")
+        except Exception:
+            return None
+        match = FOCUSED_PACKAGE.search(output or '')
+        return match.group(1) if match else None
+
+    async def reset(self):
+        """Return the device to a clean starting point: close the foreground app and go home"""
+        package = await self.foreground_package()
+        if package and not PROTECTED_PACKAGES.search(package):
+            await self.tools.device.shell(f"am force-stop {package}")
+        await self.tools.device.keyevent(HOME_KEYCODE)
+        return package
+
+    def check_health(self):
+        """True if adb still sees the device online (blocking, no event loop needed)"""
+        try:
+            result = subprocess.run(
+                ['adb', '-s', self.serial, 'get-state'],
+                capture_output=True,
+                text=True,
+                timeout=10
+            )
+            healthy = result.returncode == 0 and result.stdout.strip() == 'device'
+            self.last_error = None if healthy else (result.stderr or result.stdout).strip() or 'device offline'
+        except Exception as e:
+            healthy = False
+            self.last_error = str(e)
+        self.last_health_check = time.time()
+        return healthy
+
+    def snapshot(self):
+        return {
+            'serial': self.serial,
+            'state': self.state,
+            'runs': self.runs,
+            'created_at': self.created_at,
+            'last_used': self.last_used,
+            'last_health_check': self.last_health_check,
+            'last_error': self.last_error,
+        }
+
+
+class DeviceSessionManager:
+    """Keeps one session per device for the lifetime of the process"""
+
+    def __init__(self):
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    async def acquire(self, serial=None, log=None):
+        """Connect a run to its device and reset the device to the home screen
+
+        Args:
+            serial: Device serial (default: DEVICE_SERIAL or the first adb device)
+            log: Optional callable(message, log_type)
+
+        Returns:
+            tuple: (session, setup_seconds) - setup is always a cold connect
+        """
+        log = log or (lambda message, log_type='info': print(message))
+        started = time.monotonic()
+        serial = serial or DEVICE_SERIAL or await _default_serial()
+
+        with self._lock:
+            session = self.sessions.get(serial)
+            if session is not None and session.state == 'busy':
+                raise RuntimeError(f"Device {serial} is already in use by another run")
+            if session is None:
+                session = self.sessions[serial] = DeviceSession(serial)
+            previous_state = session.state
+            session.state = 'busy'
+
+        if previous_state == 'unhealthy':
+            log(f"Device {serial} was unhealthy ({session.last_error or 'previous run failed'}), connecting anyway", 'warning')
+        try:
+            await session.connect()
+            package = await session.reset()
+        except Exception as e:
+            session.tools = None
+            with self._lock:
+                session.state = 'unhealthy'
+                session.last_error = str(e)
+            raise
+        if package:
+            log(f"Device reset: closed {package} and returned to home screen", 'info')
+
+        session.runs += 1
+        session.last_used = time.time()
+        self._ensure_health_checks()
+        return session, time.monotonic() - started
+
+    def release(self, session, healthy=True):
+        """Hand a session back after a run and drop the run's tools"""
+        with self._lock:
+            session.tools = None
+            session.state = 'idle' if healthy else 'unhealthy'
+            session.last_used = time.time()
+
+    def _ensure_health_checks(self):
+        with self._lock:
+            if DEVICE_HEALTH_INTERVAL <= 0 or (self._health_thread and self._health_thread.is_alive()):
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        """Health-check devices that no run is using
+
+        The check goes through the adb CLI, so it never touches a run's tools or
+        event loop; a device that comes back online is marked idle again.
+        """
+        while True:
+            time.sleep(DEVICE_HEALTH_INTERVAL)
+            with self._lock:
+                waiting = [session for session in self.sessions.values() if session.state in ('idle', 'unhealthy')]
+            for session in waiting:
+                healthy = session.check_health()
+                with self._lock:
+                    if session.state == 'busy':
+                        # Acquired for a run while the check was running
+                        continue
+                    if session.state == 'idle' and not healthy:
+                        print(f"⚠️ Device {session.serial} failed its health check: {session.last_error}")
+                    session.state = 'idle' if healthy else 'unhealthy'
+
+    def snapshot(self):
+        """Sessions as a JSON-serializable list"""
+        with self._lock:
+            return [session.snapshot() for session in self.sessions.values()]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """Process-wide DeviceSessionManager, created on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = DeviceSessionManager()
+        return _manager
@@ -0,0 +1,361 @@
+"""
+Run-scoped evidence store for screenshots and UI trees
+
+Every UI state the agent reads is recorded once: UI trees are deduplicated by a
+hash of their content, screenshots by a perceptual hash (so revisited tabs and
+near-identical scroll positions collapse into one image). Blobs are written to a
+content-addressed directory under data/runs/<run_id>/evidence/ - UI trees
+gzipped, screenshots re-encoded as WebP - and described by an index.json
+manifest. Issues in the analysis reference evidence by ID.
+"""
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from dotenv import load_dotenv
+from utils import get_data_dir
+
+load_dotenv()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Record UI trees and screenshots of the states the agent visits (0 = off)
+EVIDENCE_CAPTURE = os.getenv("EVIDENCE_CAPTURE", "1") != "0"
+# Take a screenshot whenever the agent reaches a UI tree not seen before in the run
+EVIDENCE_SCREENSHOTS = os.getenv("EVIDENCE_SCREENSHOTS", "1") != "0"
+# Screenshots whose perceptual hashes differ in at most this many bits are duplicates
+EVIDENCE_PHASH_DISTANCE = _env_int("EVIDENCE_PHASH_DISTANCE", 6)
+# WebP quality for stored screenshots
+EVIDENCE_WEBP_QUALITY = _env_int("EVIDENCE_WEBP_QUALITY", 80)
+
+# Element texts kept per UI tree for linking issues to evidence
+MAX_TREE_TEXTS = 200
+EVIDENCE_ID = re.compile(r'(ui|img)-[0-9a-f]{12}')
+WORD = re.compile(r'[a-z0-9]{3,}')
+
+MIMETYPES = {'webp': 'image/webp', 'png': 'image/png', 'json.gz': 'application/json'}
+
+_pillow_warned = False
+
+
+def _import_image():
+    """PIL.Image, or None (with a one-time warning) if Pillow is not installed"""
+    global _pillow_warned
+    try:
+        from PIL import Image
+        return Image
+    except ImportError:
+        if not _pillow_warned:
+            _pillow_warned = True
+            print("⚠️ Pillow is not installed: screenshots are stored as PNG without perceptual "
+                  "deduplication (pip install Pillow)")
+        return None
+
+
+def perceptual_hash(image_bytes):
+    """64-bit difference hash of an image, or None if Pillow cannot decode it"""
+    Image = _import_image()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def _encode_screenshot(image_bytes):
+    """Re-encode a screenshot as WebP when Pillow supports it, else keep the PNG"""
+    Image = _import_image()
+    if Image is None:
+        return image_bytes, 'png'
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            output = io.BytesIO()
+            image.convert('RGB').save(output, 'WEBP', quality=EVIDENCE_WEBP_QUALITY, method=4)
+        return output.getvalue(), 'webp'
+    except Exception:
+        return image_bytes, 'png'
+
+
+def _tree_texts(tree):
+    """Visible texts, content descriptions and resource names found in a UI tree"""
+    texts = []
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key in ('text', 'contentDescription', 'content_desc', 'resourceId', 'resource_id', 'className'):
+                value = node.get(key)
+                if isinstance(value, str) and value.strip():
+                    texts.append(value.strip()[:100])
+            for value in node.values():
+                if isinstance(value, (dict, list)):
+                    walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(tree)
+    return list(dict.fromkeys(texts))[:MAX_TREE_TEXTS]
+
+
+def _screen_label(phone_state):
+    """Short description of where the device was (app / activity)"""
+    if not isinstance(phone_state, dict):
+        return None
+    for key in ('activity', 'activityName', 'currentActivity', 'currentApp', 'packageName'):
+        value = phone_state.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return None
+
+
+class EvidenceStore:
+    """Deduplicated, compressed evidence of one run
+
+    Args:
+        run_id: Run the evidence belongs to (directory data/runs/<run_id>/evidence)
+    """
+
+    def __init__(self, run_id):
+        self.run_id = run_id
+        self.root = get_data_dir('runs', run_id, 'evidence')
+        self.manifest_path = self.root / 'index.json'
+        self._lock = threading.Lock()
+        self.items = {}
+        self.stats = {'captured': 0, 'deduplicated': 0, 'bytes_captured': 0, 'bytes_stored': 0}
+        self._phashes = []
+        self._step = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self.items = manifest.get('items', {})
+        self.stats.update(manifest.get('stats', {}))
+        self._phashes = [(int(item['phash'], 16), item.get('screen'), evidence_id)
+                         for evidence_id, item in self.items.items() if item.get('phash')]
+
+    def _blob_path(self, digest, extension):
+        return self.root / 'blobs' / digest[:2] / f"{digest}.{extension}"
+
+    def _write_blob(self, digest, data, extension):
+        """Write a blob once under its content hash; returns the stored size"""
+        path = self._blob_path(digest, extension)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(path.name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return len(data)
+
+    def _seen(self, evidence_id, step):
+        item = self.items[evidence_id]
+        item['seen_count'] += 1
+        item['last_seen_step'] = step
+        self.stats['deduplicated'] += 1
+
+    def next_step(self):
+        self._step += 1
+        return self._step
+
+    def add_ui_tree(self, tree, phone_state=None, step=None):
+        """Record a UI tree
+
+        Returns:
+            tuple: (evidence_id, is_new)
+        """
+        data = json.dumps(tree, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        evidence_id = f"ui-{digest[:12]}"
+        with self._lock:
+            self.stats['captured'] += 1
+            self.stats['bytes_captured'] += len(data)
+            if evidence_id in self.items:
+                self._seen(evidence_id, step)
+                return evidence_id, False
+            stored = self._write_blob(digest, gzip.compress(data), 'json.gz')
+            self.stats['bytes_stored'] += stored
+            self.items[evidence_id] = {
+                'id': evidence_id, 'kind': 'ui_tree', 'sha256': digest, 'format': 'json.gz',
+                'size': len(data), 'stored_size': stored, 'screen': _screen_label(phone_state),
+                'first_seen_step': step, 'last_seen_step': step, 'seen_count': 1,
+                'captured_at': time.time(), 'texts': _tree_texts(tree), 'screenshot': None,
+            }
+            return evidence_id, True
+
+    def add_screenshot(self, image_bytes, phone_state=None, ui_tree_id=None, step=None):
+        """Record a screenshot, collapsing near-identical images by perceptual hash
+
+        Returns:
+            tuple: (evidence_id, is_new)
+        """
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        phash = perceptual_hash(image_bytes)
+        screen = _screen_label(phone_state)
+        with self._lock:
+            self.stats['captured'] += 1
+            self.stats['bytes_captured'] += len(image_bytes)
+            evidence_id = f"img-{digest[:12]}"
+            if evidence_id not in self.items and phash is not None:
+                for known_hash, known_screen, known_id in self._phashes:
+                    # Only collapse images of the same screen, so similar layouts stay apart
+                    if known_screen == screen and bin(known_hash ^ phash).count('1') <= EVIDENCE_PHASH_DISTANCE:
+                        evidence_id = known_id
+                        break
+            if evidence_id in self.items:
+                self._seen(evidence_id, step)
+                self._link_tree(ui_tree_id, evidence_id)
+                return evidence_id, False
+
+        # Re-encoding is the slow part - do it outside the lock
+        encoded, extension = _encode_screenshot(image_bytes)
+        with self._lock:
+            stored = self._write_blob(digest, encoded, extension)
+            self.stats['bytes_stored'] += stored
+            self.items[evidence_id] = {
+                'id': evidence_id, 'kind': 'screenshot', 'sha256': digest, 'format': extension,
+                'phash': f"{phash:016x}" if phash is not None else None,
+                'size': len(image_bytes), 'stored_size': stored, 'screen': screen,
+                'first_seen_step': step, 'last_seen_step': step, 'seen_count': 1,
+                'captured_at': time.time(), 'ui_tree': ui_tree_id,
+            }
+            if phash is not None:
+                self._phashes.append((phash, screen, evidence_id))
+            self._link_tree(ui_tree_id, evidence_id)
+            return evidence_id, True
+
+    def _link_tree(self, ui_tree_id, screenshot_id):
+        tree = self.items.get(ui_tree_id)
+        if tree is not None and not tree.get('screenshot'):
+            tree['screenshot'] = screenshot_id
+
+    def blob(self, evidence_id):
+        """(path, mimetype) of an evidence blob, or None if unknown"""
+        item = self.items.get(evidence_id)
+        if item is None:
+            return None
+        return self._blob_path(item['sha256'], item['format']), MIMETYPES[item['format']]
+
+    def save(self):
+        """Write the index.json manifest"""
+        with self._lock:
+            manifest = {'run_id': self.run_id, 'items': self.items, 'stats': self.stats}
+            data = json.dumps(manifest, indent=2)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.manifest_path)
+
+    def summary(self):
+        """One-line summary for logs"""
+        kinds = [item['kind'] for item in self.items.values()]
+        saved = self.stats['bytes_captured'] - self.stats['bytes_stored']
+        return (f"{kinds.count('screenshot')} screenshots and {kinds.count('ui_tree')} UI trees stored "
+                f"({self.stats['deduplicated']} duplicates skipped, "
+                f"{self.stats['bytes_stored'] / 1024:.0f} KB stored, {max(saved, 0) / 1024:.0f} KB saved)")
+
+    def attach(self, tools):
+        """Record the states read through a tools instance until the returned detach() is called
+
+        Wraps get_state (UI trees, plus a screenshot for every new tree) and
+        take_screenshot (screenshots the agent takes itself).
+        """
+        original_get_state = tools.get_state
+        original_take_screenshot = tools.take_screenshot
+        store = self
+
+        async def get_state(*args, **kwargs):
+            state = await original_get_state(*args, **kwargs)
+            try:
+                if isinstance(state, dict) and 'a11y_tree' in state:
+                    step = store.next_step()
+                    tree_id, is_new = store.add_ui_tree(state['a11y_tree'], state.get('phone_state'), step)
+                    if is_new and EVIDENCE_SCREENSHOTS:
+                        _, image_bytes = await original_take_screenshot()
+                        await asyncio.to_thread(store.add_screenshot, image_bytes,
+                                                state.get('phone_state'), tree_id, step)
+            except Exception as e:
+                print(f"Warning: evidence capture failed: {str(e)}")
+            return state
+
+        async def take_screenshot(*args, **kwargs):
+            result = await original_take_screenshot(*args, **kwargs)
+            try:
+                await asyncio.to_thread(store.add_screenshot, result[1], None, None, store._step)
+            except Exception as e:
+                print(f"Warning: evidence capture failed: {str(e)}")
+            return result
+
+        tools.get_state = get_state
+        tools.take_screenshot = take_screenshot
+
+        def detach():
+            # Drop the instance overrides so the class methods are used again
+            for name in ('get_state', 'take_screenshot'):
+                tools.__dict__.pop(name, None)
+
+        return detach
+
+
+def load_evidence_store(run_id):
+    """Open the evidence store of a finished run, or None if it has none"""
+    if not (get_data_dir('runs', run_id) / 'evidence' / 'index.json').exists():
+        return None
+    return EvidenceStore(run_id)
+
+
+def link_findings_to_evidence(analysis, store, max_links=2):
+    """Attach evidence IDs to issues and positive patterns by matching their text to UI trees
+
+    Each finding's location/description words are matched against the element
+    texts and screen name of every recorded UI tree; the best trees (and their
+    screenshots) are added as finding['evidence'].
+
+    Returns:
+        int: Number of findings that received evidence
+    """
+    trees = [item for item in store.items.values() if item['kind'] == 'ui_tree']
+    tree_words = {
+        item['id']: set(WORD.findall(' '.join(item.get('texts', []) + [item.get('screen') or '']).lower()))
+        for item in trees
+    }
+    linked = 0
+    for key in ('issues', 'positive'):
+        for finding in analysis.get(key) or []:
+            if not isinstance(finding, dict):
+                continue
+            words = set(WORD.findall(f"{finding.get('location', '')} {finding.get('description', '')}".lower()))
+            scored = sorted(
+                ((len(words & tree_words[item['id']]), item) for item in trees),
+                key=lambda pair: (-pair[0], pair[1]['first_seen_step'] or 0)
+            )
+            evidence = []
+            for score, item in scored[:max_links]:
+                if score < 2:
+                    break
+                evidence.extend(ref for ref in (item.get('screenshot'), item['id']) if ref)
+            if evidence:
+                finding['evidence'] = list(dict.fromkeys(evidence))
+                linked += 1
+    return linked
@@ -4,25 +4,103 @@ Exploration runner with category-aware agent and progress tracking
 import asyncio
 import json
 import os
+import time
 from datetime import datetime
 from dotenv import load_dotenv
-from llama_index.llms.openai_like import OpenAILike
 from droidrun import DroidAgent
 from droidrun.config_manager import DroidrunConfig
-from utils import load_prompt, format_prompt
+from budget import activate_budget, create_run_budget, global_budget_status, install_usage_tracking, usage_stage
+from cancellation import run_until_stopped
+from device_sessions import DEVICE_SESSIONS, get_session_manager
+from evidence_store import EVIDENCE_CAPTURE, EvidenceStore
+from llm_client import close_async_http_client
+from model_router import ModelRouter
+from pipelined_analysis import PipelinedAnalyzer
+from run_profiler import PROFILE_RUNS, RunProfiler, activate_profiler, profile_stage
+from screen_map import WARM_START, ScreenMapStore, build_warm_start_goal
+from utils import format_prompt, get_data_dir, is_runner_output, load_prompt, new_run_id, runner_print
 from ux_analyzer import UXAnalyzer
 
 load_dotenv()
+install_usage_tracking()
 
 
-async def run_exploration_with_category(app_name, category, max_depth, progress_callback, log_callback=None, stop_flag=None):
-    """Run exploration with category context and stop capability"""
+class AgentStepCounter:
+    """Counts agent steps from the workflow's event stream
+
+    Every agent step reads the device UI once and streams a RecordUIStateEvent
+    (nested manager/executor/fast agents forward theirs to the top-level stream),
+    so a step is one such event. Once the agent streams its FinalizeEvent it
+    only records the final screen, which is not a step, so counting stops there.
+    steps stays None if the handler has no event stream.
+    """
+
+    def __init__(self):
+        self.steps = None
+        self._task = None
+
+    def start(self, handler):
+        stream_events = getattr(handler, 'stream_events', None)
+        if stream_events is None:
+            return
+        self.steps = 0
+
+        async def consume():
+            try:
+                async for event in stream_events():
+                    # Matched by name: the events' modules moved between droidrun versions
+                    name = type(event).__name__
+                    if name == 'FinalizeEvent':
+                        return
+                    if name == 'RecordUIStateEvent':
+                        self.steps += 1
+            except Exception:
+                # The run failed or was cancelled; the steps counted so far stand
+                pass
+
+        self._task = asyncio.ensure_future(consume())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def save_partial_results(run_id, app_name, category, max_depth, partial_output, reason):
+    """Write whatever the agent produced before it was stopped to the run's agent_result.txt"""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    output_lines = [
+        f"Timestamp: {timestamp}",
+        f"Run ID: {run_id}",
+        f"App: {app_name}",
+        f"Category: {category}",
+        f"Max Depth: {max_depth}",
+        "Success: False",
+        "-" * 50,
+        f"Reason: {reason}",
+        "-" * 50,
+        f"Partial Agent Output:\n{partial_output.strip()}",
+    ]
+    with open(get_data_dir('runs', run_id) / "agent_result.txt", "w", encoding="utf-8") as txt_file:
+        txt_file.write("\n".join(output_lines))
+
+
+async def run_exploration_with_category(app_name, category, max_depth, progress_callback, log_callback=None, stop_flag=None, analysis_mode='standard', run_id=None, profile=None):
+    """Run exploration with category context and stop capability
+    
+    analysis_mode 'pipelined' analyzes the agent output while exploration runs
+    and only merges the partial findings once the agent stops; 'parallel' fans
+    the final analysis out into concurrent per-dimension prompts; 'incremental'
+    re-analyzes only the screens that changed since the app's previous run.
+    The report (agent_result.txt) and the analysis are written to
+    data/runs/<run_id>/, as is the memory/CPU profile with profile=True (or
+    PROFILE_RUNS=1).
+    """
     
     def log(message, log_type='info'):
         """Helper to send log if callback provided"""
         if log_callback:
             log_callback(message, log_type)
-        print(f"[{log_type.upper()}] {message}")
+        runner_print(f"[{log_type.upper()}] {message}")
     
     def check_stop():
         """Check if stop was requested"""
@@ -30,6 +108,26 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
             log("Agent execution stopped by user", 'warning')
             raise KeyboardInterrupt("Agent stopped by user request")
     
+    # Charge every LLM call made by this run (agent and analyzer) to its budget
+    budget = create_run_budget(log_callback=log)
+    activate_budget(budget)
+    pipeline = None
+    session = None
+    step_counter = AgentStepCounter()
+    session_healthy = True
+    run_id = run_id or new_run_id()
+    # Per-run output files, so concurrent runs never share a path
+    run_dir = get_data_dir('runs', run_id)
+    evidence_store = None
+    detach_evidence = None
+    setup_started = time.monotonic()
+    profiler = None
+    if PROFILE_RUNS if profile is None else profile:
+        # Samples this thread (the run's event loop) and snapshots memory per stage
+        profiler = RunProfiler(run_id).start()
+        activate_profiler(profiler)
+        log(f"🔬 Profiling run {run_id}", 'info')
+    
     try:
         check_stop()
         log(f"Initializing exploration for {app_name}", 'info')
@@ -48,6 +146,14 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
 - Document both positive UX patterns and issues
 - Be specific with screen names, tap counts, and locations"""
         
+        # Warm start: seed the agent with the screen map from previous runs
+        screen_map_store = ScreenMapStore(app_name)
+        known_map = screen_map_store.load() if WARM_START else None
+        warm_start = bool(known_map and known_map.get('screens'))
+        if warm_start:
+            enhanced_goal = f"{enhanced_goal}\n\n{build_warm_start_goal(known_map, max_depth)}"
+            log(f"♻️ Warm start: {len(known_map['screens'])} known screens from {known_map['runs']} previous run(s)", 'info')
+        
         log(f"Agent goal configured for {category} app with depth={max_depth}", 'success')
         progress_callback(f"Initializing DroidRun agent for {app_name}...", 20)
         
@@ -56,15 +162,11 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
         # Setup LLM and config
         log("Setting up LLM configuration", 'info')
         api_key = os.getenv("API_KEY")
-        model = os.getenv("LLM_MODEL", "mistralai/devstral-2512:free")
-        api_base = os.getenv("LLM_API_BASE", "https://openrouter.ai/api/v1")
-        llm = OpenAILike(
-            model=model,
-            api_base=api_base,
-            api_key=api_key,
-            temperature=0.2
-        )
-        log(f"LLM initialized: {model}", 'success')
+        # Agent steps use the low-latency model routed for the 'agent' stage; every
+        # call re-checks model health so a model degrading mid-run is failed over
+        router = ModelRouter(api_key=api_key)
+        llm = router.get_routed_llm('agent', temperature=0.2)
+        log(f"LLM initialized: {', '.join(repr(c) for c in router.candidates('agent'))}", 'success')
         
         check_stop()
         
@@ -76,6 +178,23 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
         
         check_stop()
         
+        if DEVICE_SESSIONS:
+            # Connect this run's tools and reset the device to the home screen
+            session, session_seconds = await get_session_manager().acquire(log=log)
+            log(f"📱 Device connected and reset in {session_seconds:.2f}s on {session.serial} "
+                f"(cold connect, run #{session.runs} on this device)", 'success')
+        
+        if EVIDENCE_CAPTURE:
+            if session is not None:
+                # Screenshots and UI trees of visited states, deduplicated per run
+                evidence_store = EvidenceStore(run_id)
+                detach_evidence = evidence_store.attach(session.tools)
+                log(f"Capturing evidence for run {run_id}", 'info')
+            else:
+                log("Evidence capture needs device sessions (DEVICE_SESSIONS=1) - skipped", 'warning')
+        
+        check_stop()
+        
         progress_callback("Creating exploration agent...", 25)
         log("Creating DroidAgent instance", 'info')
         
@@ -84,8 +203,10 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
             goal=enhanced_goal,
             config=config,
             llms=llm,
+            tools=session.tools if session is not None else None,
         )
         log("DroidAgent created successfully", 'success')
+        log(f"⏱️ Run setup took {time.monotonic() - setup_started:.2f}s", 'info')
         
         check_stop()
         
@@ -116,8 +237,10 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
                 
                 # Always write to original
                 self.original.write(data)
-                # Store in buffer
-                self.buffer.write(data)
+                # Only the agent's output goes into the transcript; DroidScope's own
+                # logs, retries and pipeline progress are shown but kept out of it
+                if not is_runner_output():
+                    self.buffer.write(data)
                 self.output_buffer.append(data)
                 self.total_chars += len(data)
                 
@@ -151,6 +274,7 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
                 self._flush_buffer()
             
             def getvalue(self):
+                """Agent output captured so far (without DroidScope's own output)"""
                 return self.buffer.getvalue()
         
         original_stdout = sys.stdout
@@ -163,31 +287,89 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
         sys.stdout = tee_stdout
         sys.stderr = tee_stderr
         
+        analyzer = UXAnalyzer(api_key=api_key)
+        if analysis_mode == 'pipelined':
+            log("📈 Pipelined analysis enabled - analyzing agent output during exploration", 'info')
+            pipeline = PipelinedAnalyzer(analyzer, category, log)
+            pipeline.start(tee_stdout.getvalue)
+        
         try:
-            # Run exploration - logs will stream in larger batches
+            # Run exploration - logs will stream in larger batches. A watcher task
+            # cancels the agent as soon as the stop flag is set.
             log("⏳ Agent analyzing app structure...", 'info')
-            result = await agent.run()
+            # Tokens of calls made by the agent (not the pipelined analysis running
+            # alongside it) are tracked separately for the screen map
+            with profile_stage('exploration'), usage_stage('agent'):
+                handler = agent.run()
+                step_counter.start(handler)
+                result, stop_reason, time_to_stop = await run_until_stopped(
+                    handler, stop_flag, budget=budget, budgets=(global_budget_status(),))
             
-            # Flush any remaining output
+        except Exception as agent_error:
+            log(f"Agent error: {str(agent_error)}", 'error')
+            raise agent_error
+        finally:
+            step_counter.stop()
+            # Flush any remaining output and restore stdout/stderr
             sys.stdout.flush()
             sys.stderr.flush()
-            
-            # Restore stdout/stderr
-            sys.stdout = original_stdout
-            sys.stderr = original_stderr
-            
-            log("=" * 60, 'success')
-            log("✅ AGENT EXECUTION COMPLETE", 'success')
-            log("=" * 60, 'success')
-            log("Agent.run() completed", 'success')
-            
-        except Exception as agent_error:
-            # Restore stdout/stderr on error
             sys.stdout = original_stdout
             sys.stderr = original_stderr
+        
+        agent_stopped_at = time.monotonic()
+        exploration_tokens = budget.stage_tokens.get('agent', 0)
+        if evidence_store is not None:
+            detach_evidence()
+            detach_evidence = None
+            evidence_store.save()
+            log(f"📸 Evidence: {evidence_store.summary()}", 'info')
+        
+        async def analyze_results():
+            """Run UX analysis on agent_result.txt, merging pipelined findings if enabled"""
+            if pipeline is not None:
+                await pipeline.drain()
+            analyzer.run_analysis_for_web(
+                report_path=run_dir / "agent_result.txt",
+                category=category,
+                progress_callback=progress_callback,
+                log_callback=log,
+                pipeline=pipeline,
+                analysis_mode=analysis_mode,
+                app_name=app_name,
+                evidence_store=evidence_store,
+                run_id=run_id
+            )
+            log(f"⏱️ Analysis finished {time.monotonic() - agent_stopped_at:.1f}s after the agent stopped", 'info')
+            log(f"💰 Run usage: {budget.summary()}", 'info')
+        
+        if stop_reason == 'user':
+            log(f"🛑 Agent cancelled {time_to_stop:.2f}s after stop request", 'warning')
+            save_partial_results(
+                run_id, app_name, category, max_depth,
+                partial_output=tee_stdout.getvalue(),
+                reason=f"Stopped by user (time to stop: {time_to_stop:.2f}s)"
+            )
+            log(f"Partial results saved: {run_dir / 'agent_result.txt'}", 'success')
+            raise KeyboardInterrupt("Agent stopped by user request")
+        
+        if stop_reason:
+            # Budget exhausted: wind down gracefully and analyze what was explored
+            log(f"💰 {stop_reason} - winding down exploration", 'warning')
+            progress_callback("Budget exhausted. Analyzing partial exploration...", 60)
+            save_partial_results(
+                run_id, app_name, category, max_depth,
+                partial_output=tee_stdout.getvalue(),
+                reason=f"Exploration wound down: {stop_reason}"
+            )
+            log(f"Partial results saved: {run_dir / 'agent_result.txt'}", 'success')
             
-            log(f"Agent error: {str(agent_error)}", 'error')
-            raise agent_error
+            await analyze_results()
+            return
+        
+        log("=" * 60, 'success')
+        log("✅ AGENT EXECUTION COMPLETE", 'success')
+        log("=" * 60, 'success')
+        log("Agent.run() completed", 'success')
         
         progress_callback("Exploration complete. Processing results...", 60)
         log("Processing exploration results", 'info')
@@ -200,6 +382,7 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
         log(f"Exploration success status: {success_status}", 'success' if success_status else 'warning')
         
         output_lines.append(f"Timestamp: {timestamp}")
+        output_lines.append(f"Run ID: {run_id}")
         output_lines.append(f"App: {app_name}")
         output_lines.append(f"Category: {category}")
         output_lines.append(f"Max Depth: {max_depth}")
@@ -217,11 +400,11 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
                 structured_json = result.structured_output.model_dump_json(indent=2)
                 output_lines.append(f"Structured Output:\n{structured_json}")
                 
-                with open("exploration_output.json", "w", encoding="utf-8") as json_file:
+                with open(run_dir / "exploration_output.json", "w", encoding="utf-8") as json_file:
                     json_file.write(structured_json)
-                log("Structured output saved: exploration_output.json", 'success')
+                log(f"Structured output saved: {run_dir / 'exploration_output.json'}", 'success')
                 output_lines.append("-" * 50)
-                output_lines.append("Structured output saved to: exploration_output.json")
+                output_lines.append(f"Structured output saved to: {run_dir / 'exploration_output.json'}")
             except Exception as e:
                 log(f"Error serializing structured output: {str(e)}", 'error')
                 output_lines.append(f"Error serializing structured output: {str(e)}")
@@ -230,28 +413,60 @@ async def run_exploration_with_category(app_name, category, max_depth, progress_
             output_lines.append(f"Reason: {result.reason}")
         
         output_text = "\n".join(output_lines)
-        with open("agent_result.txt", "w", encoding="utf-8") as txt_file:
+        with open(run_dir / "agent_result.txt", "w", encoding="utf-8") as txt_file:
             txt_file.write(output_text)
-        log("Results saved: agent_result.txt", 'success')
+        log(f"Results saved: {run_dir / 'agent_result.txt'}", 'success')
+        
+        if success_status:
+            try:
+                run_record = screen_map_store.update(
+                    output_text, category,
+                    steps=step_counter.steps,
+                    tokens=exploration_tokens,
+                    warm=warm_start
+                )
+                log(f"Screen map updated: {run_record['screens']} screens "
+                    f"({run_record['new_screens']} new, {run_record['changed_screens']} changed)", 'success')
+                if 'steps_saved' in run_record or 'tokens_saved' in run_record:
+                    log(f"♻️ Warm start vs cold run: {run_record.get('steps_saved', 'n/a')} steps and "
+                        f"{run_record.get('tokens_saved', 'n/a')} tokens saved", 'success')
+            except Exception as e:
+                log(f"Could not update screen map: {str(e)}", 'warning')
         
         progress_callback("Results saved. Starting UX analysis...", 70)
         
+        check_stop()
+        
         # Run UX analysis
         if success_status:
             log("Starting UX analysis pipeline", 'info')
-            analyzer = UXAnalyzer(api_key=api_key)
-            analyzer.run_analysis_for_web(
-                report_path="agent_result.txt",
-                category=category,
-                progress_callback=progress_callback,
-                log_callback=log
-            )
+            await analyze_results()
         else:
             error_reason = result.reason if hasattr(result, 'reason') else 'Unknown error'
             log(f"Exploration failed: {error_reason}", 'error')
             progress_callback(f"Exploration failed: {error_reason}", -1)
             
     except Exception as e:
+        # Flag the device so the next run and the health check look at it
+        session_healthy = False
         log(f"Critical error: {str(e)}", 'error')
         progress_callback(f"Error during exploration: {str(e)}", -1)
         raise
+    finally:
+        if detach_evidence is not None:
+            detach_evidence()
+            evidence_store.save()
+        if session is not None:
+            get_session_manager().release(session, healthy=session_healthy)
+        if pipeline is not None:
+            pipeline.cancel()
+        if profiler is not None:
+            try:
+                profile_data = profiler.stop()
+                log(f"🔬 Profile saved: RSS delta {profile_data['rss']['delta_mb']} MB over the run, "
+                    f"{profile_data['sampling']['samples']} samples "
+                    f"({profile_data['overhead_pct']}% profiler overhead)", 'info')
+            except Exception as e:
+                log(f"Could not save run profile: {str(e)}", 'warning')
+        # Pooled async connections belong to this run's event loop
+        await close_async_http_client()
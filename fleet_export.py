@@ -0,0 +1,444 @@
+"""
+Bulk columnar export of UX metrics across stored runs
+
+Flattens every run's analysis (data/runs/<run_id>/ux_analysis_blocks.json)
+into three typed tables and writes them to data/exports/<format>/:
+
+- runs            - one row per run: metadata, scores and every nested metric
+- issues          - one row per issue
+- recommendations - one row per recommendation
+
+Runs are read one at a time and rows are written in batches of
+EXPORT_BATCH_ROWS, so memory stays flat however many runs are stored. Each
+export adds one part file per table (<table>/part-<timestamp>.<ext>) and
+export_state.json remembers which runs were exported, so later exports only
+add runs completed since. Each table directory loads as one dataset in
+pandas, pyarrow or DuckDB.
+
+    python fleet_export.py [--format parquet|arrow|csv] [--full]
+
+Parquet and Arrow need pyarrow; without it the export falls back to CSV.
+"""
+import argparse
+import csv
+import json
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from utils import get_data_dir, new_run_id
+
+load_dotenv()
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return int(default)
+
+
+# Default output format: parquet, arrow or csv
+EXPORT_FORMAT = os.getenv("EXPORT_FORMAT", "parquet").lower()
+# Rows buffered per table before a batch (Parquet row group) is written
+EXPORT_BATCH_ROWS = _env_int("EXPORT_BATCH_ROWS", 5000)
+
+FORMATS = ('parquet', 'arrow', 'csv')
+# Separator for list columns in CSV output
+CSV_LIST_SEPARATOR = '; '
+
+# (column, path in the run record, type). The run record is the analysis with
+# the run metadata (run.json) under "run".
+RUN_COLUMNS = [
+    ('run_id', ('run', 'run_id'), 'string'),
+    ('app_name', ('run', 'app_name'), 'string'),
+    ('category', ('run', 'category'), 'string'),
+    ('analysis_mode', ('run', 'analysis_mode'), 'string'),
+    ('completed_at', ('run', 'completed_at'), 'timestamp'),
+    ('summary', ('summary',), 'string'),
+    ('complexity_score', ('complexity_score',), 'float'),
+    ('screens_discovered', ('app_metadata', 'screens_discovered'), 'int'),
+    ('total_interactions', ('app_metadata', 'total_interactions'), 'int'),
+    ('core_flows', ('app_metadata', 'core_flows'), 'list'),
+    ('coverage_screens_discovered', ('exploration_coverage', 'screens_discovered'), 'int'),
+    ('coverage_clickable_elements_found', ('exploration_coverage', 'clickable_elements_found'), 'int'),
+    ('coverage_successful_actions_pct', ('exploration_coverage', 'successful_actions_pct'), 'float'),
+    ('coverage_dead_elements_pct', ('exploration_coverage', 'dead_elements_pct'), 'float'),
+    ('coverage_navigation_loops_detected', ('exploration_coverage', 'navigation_loops_detected'), 'bool'),
+    ('navigation_avg_depth', ('navigation_metrics', 'avg_depth'), 'float'),
+    ('navigation_max_depth', ('navigation_metrics', 'max_depth'), 'int'),
+    ('navigation_backtracking_frequency', ('navigation_metrics', 'backtracking_frequency'), 'string'),
+    ('navigation_orphan_screens', ('navigation_metrics', 'orphan_screens'), 'int'),
+    ('navigation_label_action_match_score', ('navigation_metrics', 'label_action_match_score'), 'float'),
+    ('navigation_hub_screen_count', ('navigation_metrics', 'hub_screen_count'), 'int'),
+    ('navigation_architecture_quality', ('navigation_metrics', 'architecture_quality'), 'string'),
+    ('feedback_visible_feedback_rate_pct', ('interaction_feedback', 'visible_feedback_rate_pct'), 'float'),
+    ('feedback_loading_state_presence_pct', ('interaction_feedback', 'loading_state_presence_pct'), 'float'),
+    ('feedback_error_message_clarity', ('interaction_feedback', 'error_message_clarity'), 'float'),
+    ('feedback_silent_failures', ('interaction_feedback', 'silent_failures'), 'int'),
+    ('feedback_quality', ('interaction_feedback', 'feedback_quality'), 'string'),
+    ('visual_cta_visibility', ('visual_hierarchy', 'cta_visibility'), 'float'),
+    ('visual_tap_target_compliance_pct', ('visual_hierarchy', 'tap_target_compliance_pct'), 'float'),
+    ('visual_icon_label_clarity', ('visual_hierarchy', 'icon_label_clarity'), 'float'),
+    ('visual_hierarchy_issues', ('visual_hierarchy', 'hierarchy_issues'), 'int'),
+    ('visual_clarity_rating', ('visual_hierarchy', 'clarity_rating'), 'string'),
+    ('consistency_reused_patterns', ('consistency', 'reused_patterns'), 'list'),
+    ('consistency_inconsistent_labels', ('consistency', 'inconsistent_labels'), 'int'),
+    ('consistency_action_placement_variance', ('consistency', 'action_placement_variance'), 'string'),
+    ('consistency_pattern_violations', ('consistency', 'pattern_violations'), 'int'),
+    ('errors_preventable_errors', ('error_handling', 'preventable_errors'), 'int'),
+    ('errors_recovery_paths_available', ('error_handling', 'recovery_paths_available'), 'bool'),
+    ('errors_error_explanation_quality', ('error_handling', 'error_explanation_quality'), 'float'),
+    ('errors_handling_rating', ('error_handling', 'handling_rating'), 'string'),
+    ('ux_confidence_score', ('ux_confidence_score', 'score'), 'float'),
+    ('confidence_exploration_coverage', ('ux_confidence_score', 'factors', 'exploration_coverage'), 'float'),
+    ('confidence_interaction_consistency', ('ux_confidence_score', 'factors', 'interaction_consistency'), 'float'),
+    ('confidence_feedback_reliability', ('ux_confidence_score', 'factors', 'feedback_reliability'), 'float'),
+    ('confidence_recovery_robustness', ('ux_confidence_score', 'factors', 'recovery_robustness'), 'float'),
+    ('positive_count', ('positive',), 'count'),
+    ('issues_count', ('issues',), 'count'),
+    ('recommendations_count', ('recommendations',), 'count'),
+]
+
+# Columns copied from the run onto every issue/recommendation row
+RUN_KEY_COLUMNS = [
+    ('run_id', ('run', 'run_id'), 'string'),
+    ('app_name', ('run', 'app_name'), 'string'),
+    ('app_category', ('run', 'category'), 'string'),
+    ('completed_at', ('run', 'completed_at'), 'timestamp'),
+]
+
+ISSUE_COLUMNS = RUN_KEY_COLUMNS + [
+    ('issue_index', ('index',), 'int'),
+    ('category', ('category',), 'string'),
+    ('severity', ('severity',), 'string'),
+    ('location', ('location',), 'string'),
+    ('description', ('description',), 'string'),
+    ('impact', ('impact',), 'string'),
+    ('effort', ('effort',), 'string'),
+    ('evidence', ('evidence',), 'list'),
+]
+
+RECOMMENDATION_COLUMNS = RUN_KEY_COLUMNS + [
+    ('recommendation_index', ('index',), 'int'),
+    ('priority', ('priority',), 'string'),
+    ('recommendation', ('recommendation',), 'string'),
+    ('rationale', ('rationale',), 'string'),
+    ('expected_task_success_increase_pct', ('expected_impact', 'task_success_increase_pct'), 'float'),
+    ('expected_time_reduction_pct', ('expected_impact', 'time_reduction_pct'), 'float'),
+    ('expected_error_reduction_pct', ('expected_impact', 'error_reduction_pct'), 'float'),
+    ('effort', ('effort',), 'string'),
+]
+
+TABLES = {
+    'runs': RUN_COLUMNS,
+    'issues': ISSUE_COLUMNS,
+    'recommendations': RECOMMENDATION_COLUMNS,
+}
+
+
+def _lookup(record, path):
+    for key in path:
+        if not isinstance(record, dict):
+            return None
+        record = record.get(key)
+    return record
+
+
+def _to_float(value):
+    """Numbers from LLM output: accepts 42, "42", "42%" and "~42"; anything else is None"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip().lstrip('~').rstrip('%').strip())
+    except ValueError:
+        return None
+
+
+def _to_bool(value):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ('true', 'yes', '1'):
+            return True
+        if lowered in ('false', 'no', '0'):
+            return False
+        return None
+    return bool(value)
+
+
+def _to_timestamp(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def coerce(value, column_type):
+    """Convert a JSON value to the column's type (None when it does not fit)"""
+    if column_type == 'string':
+        return None if value is None else str(value)
+    if column_type == 'float':
+        return _to_float(value)
+    if column_type == 'int':
+        number = _to_float(value)
+        return int(round(number)) if number is not None else None
+    if column_type == 'bool':
+        return _to_bool(value)
+    if column_type == 'timestamp':
+        return _to_timestamp(value)
+    if column_type == 'list':
+        if value is None:
+            return []
+        return [str(item) for item in value] if isinstance(value, list) else [str(value)]
+    if column_type == 'count':
+        return len(value) if isinstance(value, list) else 0
+    raise ValueError(f"Unknown column type: {column_type}")
+
+
+def flatten_row(record, columns):
+    return {name: coerce(_lookup(record, path), column_type) for name, path, column_type in columns}
+
+
+def flatten_run(analysis, metadata):
+    """Flatten one run into its runs row and its issue and recommendation rows
+
+    Args:
+        analysis: The run's ux_analysis_blocks.json content
+        metadata: The run's run.json content
+
+    Returns:
+        dict: {table name: list of rows}
+    """
+    record = dict(analysis, run=metadata)
+    run_keys = {'run': metadata}
+    tables = {'runs': [flatten_row(record, RUN_COLUMNS)]}
+    for table, key, columns in (('issues', 'issues', ISSUE_COLUMNS),
+                                ('recommendations', 'recommendations', RECOMMENDATION_COLUMNS)):
+        items = analysis.get(key) if isinstance(analysis.get(key), list) else []
+        tables[table] = [
+            flatten_row(dict(item, index=index, **run_keys), columns)
+            for index, item in enumerate(items) if isinstance(item, dict)
+        ]
+    return tables
+
+
+def _load_metadata(run_dir):
+    """A run's run.json, or None while the run is still being written"""
+    try:
+        with open(run_dir / 'run.json', encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return metadata if isinstance(metadata, dict) and metadata.get('completed_at') else None
+
+
+def iter_stored_runs(skip=()):
+    """Yield (run_id, analysis, metadata) for completed runs, oldest first
+
+    A run counts as completed once its run.json (written after the analysis)
+    is complete; runs still being written are left out and picked up by a
+    later call, so callers can safely remember every run ID they were given.
+
+    Args:
+        skip: Run IDs to leave out (already exported)
+    """
+    runs_dir = get_data_dir('runs')
+    for run_dir in sorted(runs_dir.iterdir()):
+        if run_dir.name in skip or not (run_dir / 'ux_analysis_blocks.json').is_file():
+            continue
+        metadata = _load_metadata(run_dir)
+        if metadata is None:
+            continue
+        try:
+            with open(run_dir / 'ux_analysis_blocks.json', encoding='utf-8') as f:
+                analysis = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Skipping run {run_dir.name}: {str(e)}")
+            continue
+        metadata.setdefault('run_id', run_dir.name)
+        yield run_dir.name, analysis, metadata
+
+
+def _arrow_schema(columns):
+    # Import here so CSV exports work without pyarrow
+    import pyarrow as pa
+    types = {
+        'string': pa.string(),
+        'float': pa.float64(),
+        'int': pa.int64(),
+        'count': pa.int64(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('s'),
+        'list': pa.list_(pa.string()),
+    }
+    return pa.schema([(name, types[column_type]) for name, _, column_type in columns])
+
+
+class TableWriter:
+    """Buffers rows of one table and writes them to a part file in batches"""
+
+    def __init__(self, path, columns, export_format, batch_rows=EXPORT_BATCH_ROWS):
+        self.path = path
+        self.tmp_path = path.with_name(path.name + '.tmp')
+        self.columns = columns
+        self.format = export_format
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.written = 0
+        self._writer = None
+        self._file = None
+
+    def add(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def _open(self):
+        if self.format == 'csv':
+            self._file = open(self.tmp_path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.DictWriter(self._file, fieldnames=[name for name, _, _ in self.columns])
+            self._writer.writeheader()
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.schema = _arrow_schema(self.columns)
+        if self.format == 'parquet':
+            self._writer = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+        else:
+            self._file = pa.OSFile(str(self.tmp_path), 'wb')
+            self._writer = pa.ipc.new_file(self._file, self.schema)
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self._writer is None:
+            self._open()
+        if self.format == 'csv':
+            for row in self.rows:
+                self._writer.writerow({
+                    key: CSV_LIST_SEPARATOR.join(value) if isinstance(value, list)
+                    else value.isoformat() if isinstance(value, datetime) else value
+                    for key, value in row.items()
+                })
+        else:
+            import pyarrow as pa
+            self._writer.write_batch(pa.RecordBatch.from_pylist(self.rows, schema=self.schema))
+        self.written += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        """Write the remaining rows and move the part file into place (nothing is written for 0 rows)"""
+        self.flush()
+        if self._writer is None:
+            return
+        if self.format != 'csv':
+            self._writer.close()
+        if self._file is not None:
+            self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        try:
+            if self._writer is not None and self.format != 'csv':
+                self._writer.close()
+            if self._file is not None:
+                self._file.close()
+        finally:
+            if self.tmp_path.exists():
+                self.tmp_path.unlink()
+
+
+def resolve_format(export_format):
+    """Requested format, or csv when pyarrow is not installed"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Unknown export format (use one of: {', '.join(FORMATS)})")
+    if export_format != 'csv':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            print("⚠️ pyarrow is not installed - exporting CSV instead (pip install pyarrow)")
+            return 'csv'
+    return export_format
+
+
+def export_runs(export_format=EXPORT_FORMAT, full=False, batch_rows=EXPORT_BATCH_ROWS):
+    """Export stored runs to data/exports/<format>/<table>/part-<timestamp>.<ext>
+
+    Args:
+        export_format: parquet, arrow or csv
+        full: Re-export every run, replacing earlier part files
+        batch_rows: Rows buffered per table before writing
+
+    Returns:
+        dict: Runs and rows exported per table, format and part file paths
+    """
+    export_format = resolve_format(export_format)
+    export_dir = get_data_dir('exports', export_format)
+    state_path = export_dir / 'export_state.json'
+    state = {'exported_run_ids': []}
+    if state_path.exists() and not full:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+
+    if full:
+        for table in TABLES:
+            for part in get_data_dir('exports', export_format, table).glob('part-*'):
+                part.unlink()
+
+    exported = set(state['exported_run_ids'])
+    part_name = f"part-{new_run_id()}.{export_format}"
+    writers = {
+        table: TableWriter(get_data_dir('exports', export_format, table) / part_name, columns, export_format,
+                           batch_rows)
+        for table, columns in TABLES.items()
+    }
+    new_runs = []
+    try:
+        for run_id, analysis, metadata in iter_stored_runs(skip=exported):
+            for table, rows in flatten_run(analysis, metadata).items():
+                writers[table].add(rows)
+            new_runs.append(run_id)
+        for writer in writers.values():
+            writer.close()
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+
+    # Only remember runs once their part files are in place
+    state = {
+        'exported_run_ids': sorted(exported | set(new_runs)),
+        'last_export': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(state_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+    return {
+        'format': export_format,
+        'runs': len(new_runs),
+        'rows': {table: writer.written for table, writer in writers.items()},
+        'files': [str(writer.path) for writer in writers.values() if writer.written],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export UX metrics of all stored runs to columnar files")
+    parser.add_argument('--format', default=EXPORT_FORMAT, choices=sorted(FORMATS), help="Output format")
+    parser.add_argument('--full', action='store_true', help="Re-export all runs instead of only new ones")
+    args = parser.parse_args()
+
+    result = export_runs(args.format, full=args.full)
+    if not result['runs']:
+        print("✓ No new runs to export")
+        return
+    print(f"✓ Exported {result['runs']} run(s) as {result['format']}: "
+          + ", ".join(f"{count} {table}" for table, count in result['rows'].items()))
+    for path in result['files']:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
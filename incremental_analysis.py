@@ -0,0 +1,265 @@
+"""
+Incremental UX re-analysis between builds of the same app
+
+The report is split into screens and each screen's description is fingerprinted.
+Screens whose fingerprint matches the previous run of the app reuse their cached
+findings; only added or changed screens are sent to the analysis model. The
+per-screen findings are then merged into the full analysis, and a "what changed"
+delta (screens, issues, positives, scores) is produced alongside it.
+"""
+import json
+import os
+import re
+from datetime import datetime
+from pipelined_analysis import COUNTERS, merge_partial_findings
+from screen_map import fingerprint, split_screens
+from utils import get_data_dir, load_and_format_prompt, slugify
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Maximum screen description characters sent in one analysis call
+INCREMENTAL_BATCH_CHARS = _env_int("INCREMENTAL_BATCH_CHARS", 8000)
+
+# Bump when the cached per-screen findings format changes
+CACHE_VERSION = 1
+
+
+def _finding_key(item):
+    """Identity of an issue/positive pattern, insensitive to whitespace and case"""
+    text = item.get('description') or item.get('aspect') or json.dumps(item, sort_keys=True)
+    return re.sub(r'\s+', ' ', f"{item.get('location', '')}|{text}").strip().lower()
+
+
+def _findings(entries, key):
+    """All issues or positives of the given per-screen cache entries, keyed by identity"""
+    items = {}
+    for entry in entries:
+        for item in entry['findings'].get(key, []):
+            items.setdefault(_finding_key(item), item)
+    return items
+
+
+def _batches(screens):
+    """Group screens into prompts of at most INCREMENTAL_BATCH_CHARS characters"""
+    batch, size = [], 0
+    for screen in screens:
+        if batch and size + len(screen['body']) > INCREMENTAL_BATCH_CHARS:
+            yield batch
+            batch, size = [], 0
+        batch.append(screen)
+        size += len(screen['body'])
+    if batch:
+        yield batch
+
+
+def _score(analysis, *path):
+    value = analysis
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value if isinstance(value, (int, float)) else None
+
+
+class ScreenFindingsCache:
+    """Per-screen findings and the last full analysis for one app"""
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.path = get_data_dir('apps', slugify(app_name)) / 'analysis_cache.json'
+
+    def load(self, category):
+        """Return the cache, or None if missing, outdated or for another category"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: could not read analysis cache {self.path}: {str(e)}")
+            return None
+        if cache.get('version') != CACHE_VERSION or cache.get('category') != category:
+            return None
+        return cache
+
+    def save(self, cache):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def analyze_screens(analyzer, screens, category):
+    """Analyze a batch of screens and return their findings keyed by screen name
+
+    Screens the model did not report on are left out, so they are retried on
+    the next run instead of being cached as empty.
+    """
+    prompt = load_and_format_prompt(
+        'analysis_screens_prompt',
+        category=category,
+        screens='\n\n'.join(f"### {screen['name']}\n{screen['body']}" for screen in screens)
+    )
+    result = analyzer.parse_json_response(analyzer.complete('analysis', prompt))
+    requested = {screen['name'].lower(): screen['name'] for screen in screens}
+
+    findings = {}
+    for item in result.get('screens', []):
+        name = requested.get(str(item.get('name', '')).strip().lower())
+        if name is None and len(screens) == 1:
+            name = screens[0]['name']
+        if name is not None:
+            findings[name] = item
+    return findings
+
+
+def build_delta(previous, current, screen_changes, previous_analysis, analysis):
+    """Describe what changed since the previous analysis
+
+    Args:
+        previous: Previous per-screen cache entries keyed by screen name
+        current: Current per-screen cache entries keyed by screen name
+        screen_changes: Dict with added, changed, removed and unchanged screen names
+        previous_analysis: Previous full analysis (may be None)
+        analysis: New full analysis
+
+    Returns:
+        dict: Screen changes, new/resolved issues, new/lost positives and score changes
+    """
+    old_issues = _findings(previous.values(), 'issues')
+    new_issues = _findings(current.values(), 'issues')
+    old_positive = _findings(previous.values(), 'positive')
+    new_positive = _findings(current.values(), 'positive')
+
+    scores = {}
+    for label, path in (('ux_confidence_score', ('ux_confidence_score', 'score')),
+                        ('complexity_score', ('complexity_score',)),
+                        ('screens_discovered', ('app_metadata', 'screens_discovered'))):
+        before = _score(previous_analysis or {}, *path)
+        after = _score(analysis, *path)
+        if before is not None and after is not None and before != after:
+            scores[label] = {'before': before, 'after': after}
+
+    return {
+        'previous_analysis_at': (previous_analysis or {}).get('analyzed_at'),
+        'added_screens': screen_changes['added'],
+        'changed_screens': screen_changes['changed'],
+        'removed_screens': screen_changes['removed'],
+        'unchanged_screens': len(screen_changes['unchanged']),
+        'new_issues': [item for key, item in new_issues.items() if key not in old_issues],
+        'resolved_issues': [item for key, item in old_issues.items() if key not in new_issues],
+        'new_positive': [item for key, item in new_positive.items() if key not in old_positive],
+        'lost_positive': [item for key, item in old_positive.items() if key not in new_positive],
+        'score_changes': scores,
+    }
+
+
+def analyze_incrementally(analyzer, report_content, app_name, category, log=None):
+    """Re-analyze only added/changed screens and merge them with cached findings
+
+    Args:
+        analyzer: UXAnalyzer used for routed LLM calls and JSON parsing
+        report_content: Raw exploration report (screens are fingerprinted on it)
+        app_name: App whose previous run is compared against
+        category: App category; a category change invalidates the cache
+        log: Optional callable(message, log_type)
+
+    Returns:
+        tuple: (analysis, delta), or (None, None) if the report has no
+               recognizable screens or the merge failed
+    """
+    log = log or (lambda message, log_type='info': print(message))
+    screens = split_screens(report_content)
+    if not screens:
+        log("No screens recognized in the report - incremental analysis not possible", 'warning')
+        return None, None
+
+    store = ScreenFindingsCache(app_name)
+    cache = store.load(category) or {'screens': {}, 'analysis': None}
+    previous = cache['screens']
+
+    current = {}
+    pending = []
+    screen_changes = {'added': [], 'changed': [], 'removed': [], 'unchanged': []}
+    for screen in screens:
+        digest = fingerprint(screen['body'])
+        cached = previous.get(screen['name'])
+        if cached is not None and cached['fingerprint'] == digest:
+            current[screen['name']] = cached
+            screen_changes['unchanged'].append(screen['name'])
+        else:
+            pending.append((screen, digest))
+            screen_changes['changed' if cached is not None else 'added'].append(screen['name'])
+    screen_changes['removed'] = [name for name in previous if name not in current and
+                                 name not in screen_changes['changed']]
+
+    log(f"♻️ Incremental analysis: {len(screen_changes['unchanged'])} unchanged, "
+        f"{len(screen_changes['changed'])} changed, {len(screen_changes['added'])} added, "
+        f"{len(screen_changes['removed'])} removed screen(s)", 'info')
+
+    failed = []
+    digests = {screen['name']: digest for screen, digest in pending}
+    for batch in _batches([screen for screen, _ in pending]):
+        try:
+            findings = analyze_screens(analyzer, batch, category)
+        except Exception as e:
+            log(f"Screen batch failed ({', '.join(s['name'] for s in batch)}): {str(e)}", 'warning')
+            findings = {}
+        for screen in batch:
+            if screen['name'] in findings:
+                current[screen['name']] = {'fingerprint': digests[screen['name']],
+                                           'findings': findings[screen['name']]}
+            else:
+                failed.append(screen['name'])
+    if failed:
+        log(f"No findings for {len(failed)} screen(s), keeping previous findings where available: "
+            f"{', '.join(failed)}", 'warning')
+        for name in failed:
+            if name in previous:
+                # Stale findings beat none; the old fingerprint makes the next run retry it
+                current[name] = previous[name]
+
+    if not pending and not screen_changes['removed'] and cache['analysis']:
+        log("No screen changes since the previous run - reusing the cached analysis", 'success')
+        analysis = dict(cache['analysis'])
+    else:
+        partial = {
+            'screens': [], 'positive': [], 'issues': [],
+            'counters': {name: 0 for name in COUNTERS}, 'max_depth': 0,
+        }
+        for name, entry in current.items():
+            item = entry['findings']
+            partial['screens'].append({key: value for key, value in item.items()
+                                       if key not in ('positive', 'issues', 'counters')})
+            partial['positive'].extend(item.get('positive', []))
+            partial['issues'].extend(item.get('issues', []))
+            for counter, value in (item.get('counters') or {}).items():
+                if counter in partial['counters'] and isinstance(value, (int, float)):
+                    partial['counters'][counter] += value
+            if isinstance(item.get('depth'), (int, float)):
+                partial['max_depth'] = max(partial['max_depth'], item['depth'])
+
+        analysis = merge_partial_findings(analyzer, category, partial, report_content)
+        if analysis is None:
+            return None, None
+
+    analysis['analyzed_at'] = datetime.now().isoformat(timespec='seconds')
+    delta = build_delta(previous, current, screen_changes, cache['analysis'], analysis)
+    log(f"What changed: {len(delta['new_issues'])} new and {len(delta['resolved_issues'])} resolved issue(s), "
+        f"{len(delta['new_positive'])} new positive pattern(s)", 'info')
+
+    store.save({
+        'version': CACHE_VERSION,
+        'app': app_name,
+        'category': category,
+        'updated_at': analysis['analyzed_at'],
+        'screens': current,
+        'analysis': analysis,
+    })
+    return analysis, delta
@@ -0,0 +1,337 @@
+"""
+Cross-run issue clustering
+
+Groups the free-text issues of all stored runs into clusters of the same
+recurring problem ("deep navigation path" / "navigation path is too deep").
+Each issue description is reduced to a set of normalized words and a MinHash
+signature of CLUSTER_PERMUTATIONS hash functions, computed with NumPy: words are
+hashed to 64 bits with BLAKE2b and each hash function is a universal hash
+(a*x + b) mod 2^61-1. Signatures are split into LSH bands, so a new issue is only
+compared against the clusters that share a band with it - assignment stays
+near-constant time as the index grows. The band size is chosen so that issues at
+CLUSTER_SIMILARITY become candidates with CLUSTER_RECALL probability. An issue
+joins the most similar candidate cluster if their estimated Jaccard similarity
+is at least CLUSTER_SIMILARITY, otherwise it starts a new cluster.
+
+The index lives in data/clusters/ and is updated incrementally: only runs
+that are not indexed yet are read.
+
+    python issue_clusters.py [--rebuild] [--top 10] [--category Navigation] [--app "My App"]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+import numpy as np
+from dotenv import load_dotenv
+from fleet_export import iter_stored_runs
+from utils import get_data_dir
+
+load_dotenv()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# Minimum estimated Jaccard similarity (of normalized words) for an issue to join a cluster
+CLUSTER_SIMILARITY = _env_float("CLUSTER_SIMILARITY", 0.5)
+# Seconds /api/issues/clusters reuses the index before looking for new runs
+CLUSTER_REFRESH_SECONDS = _env_float("CLUSTER_REFRESH_SECONDS", 60)
+# MinHash functions per signature
+CLUSTER_PERMUTATIONS = 64
+# Probability that an issue at CLUSTER_SIMILARITY shares an LSH band with its cluster
+CLUSTER_RECALL = 0.99
+# Example descriptions kept per cluster
+CLUSTER_EXAMPLES = 3
+INDEX_VERSION = 2
+
+
+def _band_rows(similarity, permutations=CLUSTER_PERMUTATIONS, recall=CLUSTER_RECALL):
+    """Most rows per band (fewest false candidates) that still reach the recall at the similarity
+
+    A pair with Jaccard similarity s shares at least one of b bands of r rows
+    with probability 1 - (1 - s^r)^b.
+    """
+    for rows in range(permutations, 0, -1):
+        bands = permutations // rows
+        if 1 - (1 - similarity ** rows) ** bands >= recall:
+            return rows
+    return 1
+
+
+# Rows per LSH band and number of bands (64 permutations at similarity 0.5: 32 bands of 2 rows)
+CLUSTER_BAND_ROWS = _band_rows(CLUSTER_SIMILARITY)
+CLUSTER_BANDS = CLUSTER_PERMUTATIONS // CLUSTER_BAND_ROWS
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_P = np.uint64(_MERSENNE_PRIME)
+_LOW32 = np.uint64(0xFFFFFFFF)
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(1, _MERSENNE_PRIME, size=CLUSTER_PERMUTATIONS, dtype=np.uint64)
+_PERM_B = _rng.integers(0, _MERSENNE_PRIME, size=CLUSTER_PERMUTATIONS, dtype=np.uint64)
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an the and or but if of to in on at by for with from into onto over under is are was were be been being
+it its this that these those there their they them he she we you your our his her not no nor so too very
+can could should would will may might must do does did done has have had having than then when where which
+while who whom what why how all any each some such only own same other more most few both just also
+user users app screen page after before during without within upon via
+""".split())
+
+
+def _stem(word):
+    """Crude suffix stripping so 'buttons'/'button' and 'loading'/'load' match"""
+    if len(word) > 5 and word.endswith('ing'):
+        return word[:-3]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def normalize(text):
+    """Set of normalized content words of an issue text"""
+    return {_stem(word) for word in WORD.findall((text or '').lower())
+            if word not in STOPWORDS and len(word) > 1}
+
+
+def _reduce(value):
+    """Partially reduce uint64 values mod 2^61-1 (2^61 = 1 mod p), result < 2^61 + 8"""
+    return (value & _P) + (value >> np.uint64(61))
+
+
+def _mulmod(a, x):
+    """(a * x) mod 2^61-1 for uint64 arrays of values below 2^61, without overflowing 64 bits
+
+    With a = a1*2^32 + a0 and x = x1*2^32 + x0:
+    a*x = a1*x1*2^64 + (a1*x0 + a0*x1)*2^32 + a0*x0, and 2^64 = 8 (mod p).
+    """
+    a1, a0 = a >> np.uint64(32), a & _LOW32
+    x1, x0 = x >> np.uint64(32), x & _LOW32
+    high = a1 * x1 * np.uint64(8)
+    middle = a1 * x0 + a0 * x1
+    # middle * 2^32 = (middle >> 29) * 2^61 + (middle mod 2^29) * 2^32
+    middle = (middle >> np.uint64(29)) + ((middle & np.uint64((1 << 29) - 1)) << np.uint64(32))
+    value = _reduce(high) + _reduce(middle) + _reduce(a0 * x0)
+    value = _reduce(_reduce(value))
+    return np.where(value >= _P, value - _P, value)
+
+
+def _word_hash(word):
+    return int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest(), 'little') % _MERSENNE_PRIME
+
+
+def minhash(words):
+    """MinHash signature (uint64 array of CLUSTER_PERMUTATIONS values) of a word set"""
+    hashes = np.fromiter((_word_hash(word) for word in words), dtype=np.uint64, count=len(words))
+    values = _mulmod(_PERM_A[:, None], hashes[None, :]) + _PERM_B[:, None]
+    values = np.where(values >= _P, values - _P, values)
+    return values.min(axis=1)
+
+
+def _band_keys(signature):
+    rows = CLUSTER_BAND_ROWS
+    return [(band, signature[band * rows:(band + 1) * rows].tobytes())
+            for band in range(CLUSTER_BANDS)]
+
+
+class IssueClusterIndex:
+    """Incremental MinHash/LSH index of issue clusters across stored runs"""
+
+    def __init__(self):
+        self.directory = get_data_dir('clusters')
+        self.clusters = []
+        self.indexed_runs = set()
+        # One MinHash signature per cluster (of the issue that started it)
+        self.signatures = []
+        self.buckets = {}
+        self.updated_at = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        index_path = self.directory / 'index.json'
+        signatures_path = self.directory / 'signatures.npy'
+        if not index_path.exists() or not signatures_path.exists():
+            return
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                data = json.load(f)
+            signatures = np.load(signatures_path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load issue cluster index, rebuilding: {str(e)}")
+            return
+        if data.get('version') != INDEX_VERSION or len(signatures) != len(data['clusters']):
+            return
+        self.clusters = data['clusters']
+        self.indexed_runs = set(data['indexed_runs'])
+        self.signatures = list(signatures)
+        for cluster_id, signature in enumerate(signatures):
+            for key in _band_keys(signature):
+                self.buckets.setdefault(key, []).append(cluster_id)
+
+    def save(self):
+        index_tmp = self.directory / 'index.json.tmp'
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'indexed_runs': sorted(self.indexed_runs),
+                       'clusters': self.clusters}, f)
+        signatures_tmp = self.directory / 'signatures.tmp.npy'
+        np.save(signatures_tmp, np.array(self.signatures, dtype=np.uint64).reshape(-1, CLUSTER_PERMUTATIONS))
+        os.replace(signatures_tmp, self.directory / 'signatures.npy')
+        os.replace(index_tmp, self.directory / 'index.json')
+
+    def assign(self, words):
+        """Cluster ID for an issue's word set, creating a cluster if none is similar enough"""
+        signature = minhash(words)
+        keys = _band_keys(signature)
+        candidates = sorted({cluster_id for key in keys for cluster_id in self.buckets.get(key, ())})
+        if candidates:
+            # Fraction of equal MinHash values estimates the Jaccard similarity
+            similarity = (np.stack([self.signatures[cluster_id] for cluster_id in candidates]) == signature).mean(axis=1)
+            best = int(similarity.argmax())
+            if similarity[best] >= CLUSTER_SIMILARITY:
+                return candidates[best]
+
+        cluster_id = len(self.clusters)
+        self.signatures.append(signature)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(cluster_id)
+        self.clusters.append({'id': cluster_id, 'label': None, 'examples': [], 'members': []})
+        return cluster_id
+
+    def add_issue(self, issue, run_id, index, metadata):
+        """Add one issue of a run; returns its cluster ID (None if it has no usable text)"""
+        description = issue.get('description') or ''
+        words = normalize(description) or normalize(issue.get('impact'))
+        if not words:
+            return None
+        cluster_id = self.assign(words)
+        cluster = self.clusters[cluster_id]
+        cluster['label'] = cluster['label'] or description
+        if description and description not in cluster['examples'] and len(cluster['examples']) < CLUSTER_EXAMPLES:
+            cluster['examples'].append(description)
+        cluster['members'].append({
+            'run_id': run_id,
+            'index': index,
+            'app': metadata.get('app_name'),
+            'app_category': metadata.get('category'),
+            'category': issue.get('category'),
+            'severity': issue.get('severity'),
+            'location': issue.get('location'),
+        })
+        return cluster_id
+
+    def update(self, rebuild=False):
+        """Index the issues of stored runs that are not indexed yet
+
+        Returns:
+            int: Number of newly indexed runs
+        """
+        with self._lock:
+            if rebuild:
+                self.clusters, self.signatures, self.indexed_runs, self.buckets = [], [], set(), {}
+            new_runs = 0
+            for run_id, analysis, metadata in iter_stored_runs(skip=self.indexed_runs):
+                issues = analysis.get('issues') if isinstance(analysis.get('issues'), list) else []
+                for index, issue in enumerate(issues):
+                    if isinstance(issue, dict):
+                        self.add_issue(issue, run_id, index, metadata)
+                self.indexed_runs.add(run_id)
+                new_runs += 1
+            if new_runs or rebuild:
+                self.save()
+            self.updated_at = time.monotonic()
+            return new_runs
+
+    def refresh(self, max_age=CLUSTER_REFRESH_SECONDS):
+        """Index new runs unless the index was updated within the last max_age seconds
+
+        Returns:
+            int: Number of newly indexed runs (0 if the index was fresh enough)
+        """
+        if self.updated_at is not None and time.monotonic() - self.updated_at < max_age:
+            return 0
+        return self.update()
+
+    def top(self, limit=10, category=None, app=None, app_category=None):
+        """Most recurring clusters, optionally counting only issues of one issue category, app or app category
+
+        Returns:
+            list: Clusters with occurrence, run and app counts, sorted by occurrences
+        """
+        def matches(member):
+            return ((category is None or (member['category'] or '').lower() == category.lower())
+                    and (app is None or (member['app'] or '').lower() == app.lower())
+                    and (app_category is None or (member['app_category'] or '').lower() == app_category.lower()))
+
+        with self._lock:
+            results = []
+            for cluster in self.clusters:
+                members = [member for member in cluster['members'] if matches(member)]
+                if not members:
+                    continue
+                results.append({
+                    'id': cluster['id'],
+                    'label': cluster['label'],
+                    'examples': cluster['examples'],
+                    'occurrences': len(members),
+                    'runs': len({member['run_id'] for member in members}),
+                    'apps': dict(Counter(member['app'] for member in members).most_common()),
+                    'categories': dict(Counter(member['category'] for member in members).most_common()),
+                    'severity': dict(Counter(member['severity'] for member in members).most_common()),
+                    'last_run_id': max(member['run_id'] for member in members),
+                })
+        results.sort(key=lambda cluster: (-cluster['occurrences'], -len(cluster['apps']), cluster['id']))
+        return results[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clusters': len(self.clusters),
+                'issues': sum(len(cluster['members']) for cluster in self.clusters),
+                'indexed_runs': len(self.indexed_runs),
+            }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_issue_index():
+    """Process-wide IssueClusterIndex, loaded on first use"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = IssueClusterIndex()
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster recurring UX issues across stored runs")
+    parser.add_argument('--rebuild', action='store_true', help="Re-cluster all runs from scratch")
+    parser.add_argument('--top', type=int, default=10, help="Clusters to list")
+    parser.add_argument('--category', help="Only count issues of this issue category (e.g. Navigation)")
+    parser.add_argument('--app', help="Only count issues of this app")
+    args = parser.parse_args()
+
+    index = get_issue_index()
+    new_runs = index.update(rebuild=args.rebuild)
+    stats = index.stats()
+    print(f"✓ Indexed {new_runs} new run(s): {stats['issues']} issues in {stats['clusters']} clusters "
+          f"from {stats['indexed_runs']} runs")
+    for cluster in index.top(args.top, category=args.category, app=args.app):
+        print(f"\n[{cluster['occurrences']}x in {cluster['runs']} run(s), {len(cluster['apps'])} app(s)] {cluster['label']}")
+        for example in cluster['examples'][1:]:
+            print(f"    ~ {example}")
+
+
+if __name__ == "__main__":
+    main()
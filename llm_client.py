@@ -0,0 +1,403 @@
+"""
+Shared, rate-limit-aware LLM client layer
+
+All LLMs are built through get_llm() so every run in the process shares one
+keep-alive connection pool, a token-bucket rate limiter per (API base, model),
+a concurrency cap per API base, and a retry policy with jittered exponential
+backoff that honors Retry-After. Concurrent runs therefore share provider
+capacity instead of stampeding it.
+"""
+import asyncio
+import collections
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+import weakref
+import httpx
+from dotenv import load_dotenv
+from utils import runner_print
+
+load_dotenv()
+
+
+DEFAULT_MODEL = "mistralai/devstral-2512:free"
+DEFAULT_API_BASE = "https://openrouter.ai/api/v1"
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+MAX_CONNECTIONS = int(_env_float("LLM_MAX_CONNECTIONS", 20))
+MAX_CONCURRENCY = int(_env_float("LLM_MAX_CONCURRENCY", 4))
+RATE_LIMIT_RPM = _env_float("LLM_RATE_LIMIT_RPM", 20)
+RATE_LIMIT_BURST = _env_float("LLM_RATE_LIMIT_BURST", 5)
+MAX_RETRIES = int(_env_float("LLM_MAX_RETRIES", 5))
+BACKOFF_BASE = _env_float("LLM_BACKOFF_BASE", 1.0)
+BACKOFF_MAX = _env_float("LLM_BACKOFF_MAX", 60.0)
+REQUEST_TIMEOUT = _env_float("LLM_TIMEOUT", 120.0)
+# Number of recent calls kept per model for latency / error-rate statistics
+STATS_WINDOW = int(_env_float("LLM_STATS_WINDOW", 50))
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by sync and async callers
+
+    Callers reserve a token and get back how long they must wait before using it,
+    so the same bucket works with time.sleep() and asyncio.sleep().
+    """
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the seconds to wait before it may be used"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after the provider returned 429"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class ConcurrencyLimiter:
+    """Caps in-flight requests per API base across threads and event loops"""
+
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(max(1, limit))
+
+    def acquire(self):
+        self._semaphore.acquire()
+
+    async def acquire_async(self):
+        # Event loops live on different threads, so poll instead of blocking the loop
+        while not self._semaphore.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        self._semaphore.release()
+
+
+_buckets = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+class CallStats:
+    """Rolling latency and error statistics for one (API base, model)
+
+    Latency is measured per HTTP attempt, up to the response headers, which for
+    non-streaming completions is when the provider has finished generating.
+    """
+
+    def __init__(self, window=STATS_WINDOW):
+        self._calls = collections.deque(maxlen=window)
+        self.total_calls = 0
+        self.total_errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency, ok):
+        with self._lock:
+            self._calls.append((latency, ok))
+            self.total_calls += 1
+            if not ok:
+                self.total_errors += 1
+
+    def reset_window(self):
+        with self._lock:
+            self._calls.clear()
+
+    @property
+    def samples(self):
+        return len(self._calls)
+
+    def percentile(self, pct):
+        with self._lock:
+            latencies = sorted(latency for latency, _ in self._calls)
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(round(pct / 100.0 * (len(latencies) - 1))))
+        return latencies[index]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def snapshot(self):
+        p50 = self.percentile(50)
+        p95 = self.percentile(95)
+        return {
+            'samples': self.samples,
+            'p50_latency': round(p50, 3) if p50 is not None else None,
+            'p95_latency': round(p95, 3) if p95 is not None else None,
+            'error_rate': round(self.error_rate(), 3),
+            'total_calls': self.total_calls,
+            'total_errors': self.total_errors,
+        }
+
+
+_call_stats = {}
+_stats_lock = threading.Lock()
+
+
+def endpoint_key(api_base):
+    """Normalize an API base URL to the scheme://host form used for stats and limits"""
+    url = httpx.URL(api_base)
+    return f"{url.scheme}://{url.host}"
+
+
+def call_stats(api_base, model):
+    """CallStats for an API base (URL or scheme://host) and model"""
+    key = (endpoint_key(api_base), model)
+    with _stats_lock:
+        stats = _call_stats.get(key)
+        if stats is None:
+            stats = _call_stats[key] = CallStats()
+        return stats
+
+
+def stats_snapshot():
+    """Per-model latency/error statistics as a JSON-serializable list"""
+    with _stats_lock:
+        items = list(_call_stats.items())
+    return [
+        dict(api_base=api_base, model=model, **stats.snapshot())
+        for (api_base, model), stats in items
+    ]
+
+
+def _request_key(request):
+    """(API base, model) for an outgoing OpenAI-compatible request"""
+    api_base = endpoint_key(request.url)
+    model = None
+    try:
+        model = json.loads(request.content).get('model')
+    except Exception:
+        pass
+    return api_base, model
+
+
+def _limits_for(api_base, model):
+    with _registry_lock:
+        bucket = _buckets.get((api_base, model))
+        if bucket is None:
+            bucket = _buckets[(api_base, model)] = TokenBucket(RATE_LIMIT_RPM, RATE_LIMIT_BURST)
+        limiter = _limiters.get(api_base)
+        if limiter is None:
+            limiter = _limiters[api_base] = ConcurrencyLimiter(MAX_CONCURRENCY)
+    return bucket, limiter
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header (seconds or HTTP date), or None"""
+    value = response.headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    """Seconds to wait before retry number ``attempt`` (0-based)"""
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    # Full jitter keeps concurrent runs from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+class RateLimitedTransport(httpx.BaseTransport):
+    """Sync transport adding rate limiting, concurrency caps and retries"""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    def handle_request(self, request):
+        api_base, model = _request_key(request)
+        bucket, limiter = _limits_for(api_base, model)
+        stats = call_stats(api_base, model)
+
+        for attempt in range(MAX_RETRIES + 1):
+            wait = bucket.reserve()
+            if wait > 0:
+                time.sleep(wait)
+
+            limiter.acquire()
+            started_at = time.monotonic()
+            try:
+                response = self._transport.handle_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                stats.record(time.monotonic() - started_at, ok=False)
+                if attempt == MAX_RETRIES:
+                    raise
+                response = None
+            finally:
+                limiter.release()
+
+            if response is not None:
+                stats.record(time.monotonic() - started_at, ok=response.status_code < 400)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                    return response
+                delay = backoff_delay(attempt, retry_after_seconds(response))
+                if response.status_code == 429:
+                    bucket.pause(delay)
+                response.close()
+            else:
+                delay = backoff_delay(attempt)
+
+            runner_print(f"LLM request to {model or api_base} failed, retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1}/{MAX_RETRIES})")
+            time.sleep(delay)
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncRateLimitedTransport(httpx.AsyncBaseTransport):
+    """Async transport adding rate limiting, concurrency caps and retries"""
+
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        api_base, model = _request_key(request)
+        bucket, limiter = _limits_for(api_base, model)
+        stats = call_stats(api_base, model)
+
+        for attempt in range(MAX_RETRIES + 1):
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            await limiter.acquire_async()
+            started_at = time.monotonic()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except (httpx.TimeoutException, httpx.NetworkError):
+                stats.record(time.monotonic() - started_at, ok=False)
+                if attempt == MAX_RETRIES:
+                    raise
+                response = None
+            finally:
+                limiter.release()
+
+            if response is not None:
+                stats.record(time.monotonic() - started_at, ok=response.status_code < 400)
+                if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                    return response
+                delay = backoff_delay(attempt, retry_after_seconds(response))
+                if response.status_code == 429:
+                    bucket.pause(delay)
+                await response.aclose()
+            else:
+                delay = backoff_delay(attempt)
+
+            runner_print(f"LLM request to {model or api_base} failed, retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 1}/{MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def _pool_limits():
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+
+
+_sync_client = None
+_sync_client_lock = threading.Lock()
+# Async connections are bound to the event loop that opened them, so each
+# loop (one per exploration thread) gets its own pooled client
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Process-wide pooled httpx.Client used for synchronous LLM calls"""
+    global _sync_client
+    with _sync_client_lock:
+        if _sync_client is None:
+            _sync_client = httpx.Client(
+                transport=RateLimitedTransport(httpx.HTTPTransport(limits=_pool_limits())),
+                timeout=REQUEST_TIMEOUT,
+            )
+        return _sync_client
+
+
+def get_async_http_client():
+    """Pooled httpx.AsyncClient for the running event loop, or None outside a loop"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            transport=AsyncRateLimitedTransport(httpx.AsyncHTTPTransport(limits=_pool_limits())),
+            timeout=REQUEST_TIMEOUT,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_http_client():
+    """Close the running loop's pooled client (call before the loop shuts down)"""
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def get_llm(model=None, api_base=None, api_key=None, temperature=0.2):
+    """Create an OpenAILike LLM wired to the shared connection pool and rate limiter
+
+    Args:
+        model: Model name (defaults to LLM_MODEL)
+        api_base: OpenAI-compatible endpoint (defaults to LLM_API_BASE)
+        api_key: API key (defaults to API_KEY)
+        temperature: Sampling temperature
+
+    Returns:
+        OpenAILike: LLM whose HTTP traffic goes through the shared client layer
+    """
+    from llama_index.llms.openai_like import OpenAILike
+
+    return OpenAILike(
+        model=model or os.getenv("LLM_MODEL", DEFAULT_MODEL),
+        api_base=api_base or os.getenv("LLM_API_BASE", DEFAULT_API_BASE),
+        api_key=api_key or os.getenv("API_KEY"),
+        temperature=temperature,
+        timeout=REQUEST_TIMEOUT,
+        # Retries are handled by the shared transport so they respect the rate limiter
+        max_retries=0,
+        http_client=get_http_client(),
+        async_http_client=get_async_http_client(),
+    )
@@ -0,0 +1,311 @@
+"""
+Per-stage model routing with latency-aware selection and failover
+
+Each pipeline stage (agent, analysis, json_repair, html, summary) has an ordered list of
+models/endpoints configured through LLM_ROUTE_<STAGE>, e.g.
+
+    LLM_ROUTE_ANALYSIS=google/gemini-2.0-flash-001,mistralai/devstral-2512:free
+    LLM_ROUTE_AGENT=gpt-4o-mini@https://api.openai.com/v1,mistralai/devstral-2512:free
+
+Entries without an ``@api_base`` use LLM_API_BASE. Stages without a route fall
+back to LLM_MODEL. A candidate whose p95 latency or error rate crosses the
+configured threshold is put in cooldown and skipped until it expires.
+
+Stages that make many calls through one LLM object (the DroidRun agent) use
+get_routed_llm(), whose LLM re-runs candidate selection and failover on every call.
+"""
+import os
+import threading
+import time
+from functools import lru_cache
+from dotenv import load_dotenv
+from llm_client import DEFAULT_API_BASE, DEFAULT_MODEL, call_stats, get_llm, stats_snapshot
+from utils import runner_print
+
+load_dotenv()
+
+
+STAGES = ('agent', 'analysis', 'json_repair', 'html', 'summary')
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+P95_THRESHOLD = _env_float("LLM_ROUTE_P95_THRESHOLD", 90.0)
+ERROR_RATE_THRESHOLD = _env_float("LLM_ROUTE_ERROR_RATE_THRESHOLD", 0.5)
+MIN_SAMPLES = int(_env_float("LLM_ROUTE_MIN_SAMPLES", 3))
+COOLDOWN_SECONDS = _env_float("LLM_ROUTE_COOLDOWN", 120.0)
+# 'ordered' keeps the configured priority; 'latency' prefers the fastest healthy model
+STRATEGY = os.getenv("LLM_ROUTE_STRATEGY", "ordered")
+
+# Cooldowns are process-wide so every router instance sees the same health state
+_cooldowns = {}
+_cooldown_lock = threading.Lock()
+
+
+class Candidate:
+    """One model/endpoint option for a stage"""
+
+    def __init__(self, model, api_base):
+        self.model = model
+        self.api_base = api_base
+
+    @property
+    def stats(self):
+        return call_stats(self.api_base, self.model)
+
+    def __repr__(self):
+        return f"{self.model}@{self.api_base}"
+
+
+def parse_route(value, default_api_base):
+    """Parse 'model[@api_base], ...' into a list of Candidates"""
+    candidates = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, api_base = entry.partition('@')
+        candidates.append(Candidate(model.strip(), api_base.strip() or default_api_base))
+    return candidates
+
+
+class ModelRouter:
+    """Chooses which model serves each stage and fails over when one degrades"""
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key or os.getenv("API_KEY")
+        default_model = os.getenv("LLM_MODEL", DEFAULT_MODEL)
+        default_api_base = os.getenv("LLM_API_BASE", DEFAULT_API_BASE)
+
+        self.routes = {}
+        for stage in STAGES:
+            route = os.getenv(f"LLM_ROUTE_{stage.upper()}", '')
+            self.routes[stage] = parse_route(route, default_api_base) or [Candidate(default_model, default_api_base)]
+
+    def is_healthy(self, candidate):
+        """True unless the candidate is cooling down or its recent stats cross a threshold"""
+        with _cooldown_lock:
+            until = _cooldowns.get(repr(candidate))
+            if until is not None:
+                if time.monotonic() < until:
+                    return False
+                # Cooldown over: give it a fresh window so it gets probed again
+                del _cooldowns[repr(candidate)]
+                candidate.stats.reset_window()
+                return True
+
+        stats = candidate.stats
+        if stats.samples < MIN_SAMPLES:
+            return True
+        p95 = stats.percentile(95)
+        degraded = (p95 is not None and p95 > P95_THRESHOLD) or stats.error_rate() > ERROR_RATE_THRESHOLD
+        if degraded:
+            with _cooldown_lock:
+                _cooldowns[repr(candidate)] = time.monotonic() + COOLDOWN_SECONDS
+            runner_print(f"⚠️ Model {candidate} degraded (p95={p95:.1f}s, error rate={stats.error_rate():.0%}), "
+                  f"cooling down for {COOLDOWN_SECONDS:.0f}s")
+        return not degraded
+
+    def candidates(self, stage):
+        """Candidates for a stage in the order they should be tried
+
+        Healthy candidates come first (by configured priority, or by median
+        latency with the 'latency' strategy); degraded ones are kept as a last resort.
+        """
+        route = self.routes[stage]
+        healthy = [c for c in route if self.is_healthy(c)]
+        degraded = [c for c in route if c not in healthy]
+        if STRATEGY == 'latency':
+            # Unmeasured candidates sort first so they get sampled
+            healthy.sort(key=lambda c: c.stats.percentile(50) or 0.0)
+        return healthy + degraded
+
+    def get_llm(self, stage, temperature=0.2):
+        """Build an LLM for the best candidate of a stage
+
+        Returns:
+            tuple: (llm, candidate)
+        """
+        candidate = self.candidates(stage)[0]
+        llm = get_llm(model=candidate.model, api_base=candidate.api_base,
+                      api_key=self.api_key, temperature=temperature)
+        return llm, candidate
+
+    def get_routed_llm(self, stage, temperature=0.2):
+        """LLM for a stage that picks a healthy candidate and fails over on every call
+
+        Unlike get_llm(), a candidate that degrades in the middle of a long run
+        (e.g. the agent loop) is dropped from the next call on.
+        """
+        return _routed_llm_class()(router=self, stage=stage, temperature=temperature)
+
+    def complete(self, stage, prompt, temperature=0.2):
+        """Run a completion for a stage, failing over to the next candidate on error
+
+        Returns:
+            str: Response text of the first candidate that succeeds
+        """
+        last_error = None
+        for candidate in self.candidates(stage):
+            llm = get_llm(model=candidate.model, api_base=candidate.api_base,
+                          api_key=self.api_key, temperature=temperature)
+            try:
+                return llm.complete(prompt).text
+            except Exception as e:
+                last_error = e
+                runner_print(f"⚠️ {stage} call to {candidate} failed: {str(e)}")
+        raise last_error
+
+    def snapshot(self):
+        """Routes, cooldowns and per-model stats as a JSON-serializable dict"""
+        now = time.monotonic()
+        with _cooldown_lock:
+            cooldowns = {key: round(until - now, 1) for key, until in _cooldowns.items() if until > now}
+        return {
+            'routes': {stage: [repr(c) for c in route] for stage, route in self.routes.items()},
+            'cooldowns': cooldowns,
+            'thresholds': {
+                'p95_latency': P95_THRESHOLD,
+                'error_rate': ERROR_RATE_THRESHOLD,
+                'min_samples': MIN_SAMPLES,
+                'cooldown_seconds': COOLDOWN_SECONDS,
+            },
+            'strategy': STRATEGY,
+            'models': stats_snapshot(),
+        }
+
+
+@lru_cache(maxsize=None)
+def _routed_llm_class():
+    """Build the RoutedLLM class on first use (llama_index is slow to import)"""
+    from llama_index.core.llms import LLM
+    from pydantic import PrivateAttr
+
+    class RoutedLLM(LLM):
+        """LLM that sends each call to the router's best candidate and fails over on error
+
+        Streaming calls fail over until the first chunk arrives; after that the
+        stream belongs to the candidate that produced it. Callback events are
+        dispatched by the underlying candidate LLMs, so usage is counted once.
+        """
+
+        _router = PrivateAttr()
+        _stage = PrivateAttr()
+        _temperature = PrivateAttr()
+        _llms = PrivateAttr(default_factory=dict)
+
+        def __init__(self, router, stage, temperature=0.2, **kwargs):
+            super().__init__(**kwargs)
+            self._router = router
+            self._stage = stage
+            self._temperature = temperature
+
+        @classmethod
+        def class_name(cls):
+            return "RoutedLLM"
+
+        def _llm_for(self, candidate):
+            llm = self._llms.get(repr(candidate))
+            if llm is None:
+                llm = self._llms[repr(candidate)] = get_llm(
+                    model=candidate.model, api_base=candidate.api_base,
+                    api_key=self._router.api_key, temperature=self._temperature)
+            return llm
+
+        def _failed(self, candidate, error):
+            runner_print(f"⚠️ {self._stage} call to {candidate} failed: {str(error)}")
+
+        def _call(self, method, *args, **kwargs):
+            last_error = None
+            for candidate in self._router.candidates(self._stage):
+                try:
+                    return getattr(self._llm_for(candidate), method)(*args, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    self._failed(candidate, e)
+            raise last_error
+
+        async def _acall(self, method, *args, **kwargs):
+            last_error = None
+            for candidate in self._router.candidates(self._stage):
+                try:
+                    return await getattr(self._llm_for(candidate), method)(*args, **kwargs)
+                except Exception as e:
+                    last_error = e
+                    self._failed(candidate, e)
+            raise last_error
+
+        def _stream(self, method, *args, **kwargs):
+            last_error = None
+            for candidate in self._router.candidates(self._stage):
+                try:
+                    stream = getattr(self._llm_for(candidate), method)(*args, **kwargs)
+                    first = next(stream, None)
+                except Exception as e:
+                    last_error = e
+                    self._failed(candidate, e)
+                    continue
+
+                def chunks():
+                    if first is not None:
+                        yield first
+                    yield from stream
+                return chunks()
+            raise last_error
+
+        async def _astream(self, method, *args, **kwargs):
+            last_error = None
+            for candidate in self._router.candidates(self._stage):
+                try:
+                    stream = await getattr(self._llm_for(candidate), method)(*args, **kwargs)
+                    try:
+                        first = await stream.__anext__()
+                    except StopAsyncIteration:
+                        first = None
+                except Exception as e:
+                    last_error = e
+                    self._failed(candidate, e)
+                    continue
+
+                async def chunks():
+                    if first is not None:
+                        yield first
+                    async for chunk in stream:
+                        yield chunk
+                return chunks()
+            raise last_error
+
+        @property
+        def metadata(self):
+            return self._llm_for(self._router.candidates(self._stage)[0]).metadata
+
+        def chat(self, messages, **kwargs):
+            return self._call('chat', messages, **kwargs)
+
+        def complete(self, prompt, formatted=False, **kwargs):
+            return self._call('complete', prompt, formatted=formatted, **kwargs)
+
+        def stream_chat(self, messages, **kwargs):
+            return self._stream('stream_chat', messages, **kwargs)
+
+        def stream_complete(self, prompt, formatted=False, **kwargs):
+            return self._stream('stream_complete', prompt, formatted=formatted, **kwargs)
+
+        async def achat(self, messages, **kwargs):
+            return await self._acall('achat', messages, **kwargs)
+
+        async def acomplete(self, prompt, formatted=False, **kwargs):
+            return await self._acall('acomplete', prompt, formatted=formatted, **kwargs)
+
+        async def astream_chat(self, messages, **kwargs):
+            return await self._astream('astream_chat', messages, **kwargs)
+
+        async def astream_complete(self, prompt, formatted=False, **kwargs):
+            return await self._astream('astream_complete', prompt, formatted=formatted, **kwargs)
+
+    return RoutedLLM
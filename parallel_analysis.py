@@ -0,0 +1,218 @@
+"""
+Parallel per-dimension UX analysis
+
+Instead of one long generation for the whole ux_analysis_blocks.json schema, each
+dimension (navigation, feedback, hierarchy, ...) gets a focused prompt. The
+prompts run concurrently with bounded parallelism, so wall-clock time is bounded
+by the slowest section, and only sections that fail are retried.
+
+Dimensions with search terms only get the report blocks that mention them (plus
+every block carrying a metric), so the fan-out does not send the full report nine
+times. The estimated input tokens are logged and checked against the run budget
+before any prompt is sent.
+"""
+import contextvars
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from budget import current_budget
+from report_compactor import estimate_tokens, extract_key_facts
+from ux_analyzer import apply_analysis_defaults
+from utils import load_and_format_prompt, load_prompt
+
+
+def _env_int(name, default):
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Maximum number of section prompts in flight at once
+ANALYSIS_PARALLELISM = _env_int("ANALYSIS_PARALLELISM", 4)
+# Extra attempts for sections that failed
+ANALYSIS_SECTION_RETRIES = _env_int("ANALYSIS_SECTION_RETRIES", 2)
+# A slice at least this large (relative to the report) is not worth it - send the full report
+SLICE_MAX_FRACTION = 0.9
+
+
+# Each dimension: the top-level keys it owns, what to focus on, its JSON schema and,
+# for dimensions that do not need the whole report, the terms that select its blocks
+DIMENSIONS = {
+    'overview': {
+        'keys': ['summary', 'app_metadata', 'exploration_coverage', 'complexity_score'],
+        'focus': 'overall UX maturity, app structure, exploration coverage and complexity',
+        'schema': '''{
+  "summary": "2-3 sentence executive summary: overall UX maturity (strong/moderate/weak), primary risks, improvement potential",
+  "app_metadata": {"screens_discovered": <number>, "total_interactions": <number>, "core_flows": ["flow1", "flow2"]},
+  "exploration_coverage": {"screens_discovered": <number>, "clickable_elements_found": <number>, "successful_actions_pct": <percentage 0-100>, "dead_elements_pct": <percentage 0-100>, "navigation_loops_detected": <boolean>},
+  "complexity_score": <1-10 calculated from depth, hubs, screen count>
+}''',
+    },
+    'navigation_metrics': {
+        'keys': ['navigation_metrics'],
+        'focus': 'navigation depth, backtracking, orphan screens, hubs and label-action match',
+        'terms': r'navigat|depth|back|tab|menu|drawer|screen|hub|orphan|path|label|→|>',
+        'schema': '''{
+  "navigation_metrics": {"avg_depth": <number>, "max_depth": <number>, "backtracking_frequency": "low|medium|high", "orphan_screens": <count>, "label_action_match_score": <1-10>, "hub_screen_count": <number>, "architecture_quality": "clear|moderate|poor"}
+}''',
+    },
+    'interaction_feedback': {
+        'keys': ['interaction_feedback'],
+        'focus': 'visible feedback on interactions, loading states, error message clarity and silent failures',
+        'terms': r'feedback|load|spinner|progress|toast|snackbar|error|fail|respon|tap|click|silent|nothing happen',
+        'schema': '''{
+  "interaction_feedback": {"visible_feedback_rate_pct": <percentage 0-100>, "loading_state_presence_pct": <percentage 0-100>, "error_message_clarity": <1-10>, "silent_failures": <count>, "feedback_quality": "excellent|good|poor"}
+}''',
+    },
+    'visual_hierarchy': {
+        'keys': ['visual_hierarchy'],
+        'focus': 'CTA visibility, tap target sizes, icon/label clarity and hierarchy problems',
+        'terms': r'button|cta|icon|label|target|size|small|visib|hierarch|layout|prominen|contrast|text',
+        'schema': '''{
+  "visual_hierarchy": {"cta_visibility": <1-10>, "tap_target_compliance_pct": <percentage 0-100>, "icon_label_clarity": <1-10>, "hierarchy_issues": <count>, "clarity_rating": "clear|inconsistent|poor"}
+}''',
+    },
+    'consistency': {
+        'keys': ['consistency'],
+        'focus': 'reused UI patterns, label consistency and placement of common actions',
+        'terms': r'consisten|pattern|label|placement|position|style|same|different|reuse|standard',
+        'schema': '''{
+  "consistency": {"reused_patterns": ["pattern1", "pattern2"], "inconsistent_labels": <count>, "action_placement_variance": "low|medium|high", "pattern_violations": <count>}
+}''',
+    },
+    'error_handling': {
+        'keys': ['error_handling'],
+        'focus': 'preventable errors, recovery paths and quality of error explanations',
+        'terms': r'error|fail|invalid|retry|recover|undo|cancel|warning|crash|timeout|message',
+        'schema': '''{
+  "error_handling": {"preventable_errors": <count>, "recovery_paths_available": <boolean>, "error_explanation_quality": <1-10>, "handling_rating": "excellent|good|poor"}
+}''',
+    },
+    'positive': {
+        'keys': ['positive'],
+        'focus': 'UX patterns that work well, with evidence',
+        'schema': '''{
+  "positive": [{"aspect": "Specific positive UX pattern", "location": "Where observed (screen/element)", "description": "Why it works well with evidence"}]
+}''',
+    },
+    'issues': {
+        'keys': ['issues', 'recommendations'],
+        'focus': 'UX issues with severity and impact, and prioritized recommendations that address them',
+        'schema': '''{
+  "issues": [{"category": "Navigation|Feedback|Hierarchy|Consistency|Error Handling", "severity": "High|Medium|Low", "location": "Specific screen + element", "description": "What's wrong with concrete example", "impact": "User impact (task failure, confusion, friction)", "effort": "Low|Medium|High"}],
+  "recommendations": [{"priority": "High|Medium|Low", "recommendation": "Specific UI or flow change", "rationale": "Addresses [problem] by reducing [cognitive load/friction/ambiguity]", "expected_impact": {"task_success_increase_pct": <percentage>, "time_reduction_pct": <percentage>, "error_reduction_pct": <percentage>}, "effort": "Low|Medium|High"}]
+}''',
+    },
+    'ux_confidence_score': {
+        'keys': ['ux_confidence_score'],
+        'focus': 'how reliable the overall UX assessment is given exploration thoroughness, consistency, feedback and recovery',
+        'schema': '''{
+  "ux_confidence_score": {"score": <1-10>, "factors": {"exploration_coverage": <1-10>, "interaction_consistency": <1-10>, "feedback_reliability": <1-10>, "recovery_robustness": <1-10>}}
+}''',
+    },
+}
+
+
+def report_slice(report_content, name):
+    """Blocks of the report relevant to one dimension, or the whole report
+
+    A block is kept if it mentions one of the dimension's terms or carries a
+    metric fact. Dimensions without terms, slices that match no term and slices
+    nearly as large as the report get the whole report.
+    """
+    terms = DIMENSIONS[name].get('terms')
+    if not terms:
+        return report_content
+    pattern = re.compile(terms, re.IGNORECASE)
+    blocks = [block for block in re.split(r'\n\s*\n|\n(?=#{1,6} )', report_content) if block.strip()]
+    matched = [pattern.search(block) is not None for block in blocks]
+    if not any(matched):
+        return report_content
+    kept = [block for block, hit in zip(blocks, matched) if hit or extract_key_facts(block)]
+    sliced = '\n\n'.join(kept)
+    return report_content if len(sliced) >= SLICE_MAX_FRACTION * len(report_content) else sliced
+
+
+def _dimension_prompt(name, report_content, category):
+    dimension = DIMENSIONS[name]
+    return load_and_format_prompt(
+        'analysis_dimension_prompt',
+        category=category,
+        dimension_focus=dimension['focus'],
+        dimension_schema=dimension['schema'],
+        report_content=report_slice(report_content, name)
+    )
+
+
+def analyze_dimension(analyzer, name, report_content, category):
+    """Run the focused prompt for one dimension and return only the keys it owns"""
+    dimension = DIMENSIONS[name]
+    prompt = _dimension_prompt(name, report_content, category)
+    result = analyzer.parse_json_response(analyzer.complete('analysis', prompt))
+    missing = [key for key in dimension['keys'] if key not in result]
+    if missing:
+        raise ValueError(f"response missing {', '.join(missing)}")
+    return {key: result[key] for key in dimension['keys']}
+
+
+def analyze_by_dimension(analyzer, report_content, category, log=None):
+    """Analyze all dimensions concurrently and assemble the full analysis
+
+    Args:
+        analyzer: UXAnalyzer used for routed LLM calls and JSON parsing
+        report_content: (Compacted) exploration report
+        category: App category
+        log: Optional callable(message, log_type)
+
+    Returns:
+        dict: Analysis in the ux_analysis_blocks.json schema, or None if every
+              section failed or the fan-out does not fit in the run budget
+    """
+    log = log or (lambda message, log_type='info': print(message))
+    sections = {}
+    pending = list(DIMENSIONS)
+
+    # Input cost of the fan-out versus one full-report prompt
+    fanout_tokens = sum(estimate_tokens(_dimension_prompt(name, report_content, category)) for name in pending)
+    serial_tokens = estimate_tokens(load_prompt('analysis_prompt_v2')) + estimate_tokens(report_content)
+    log(f"Parallel analysis: {len(pending)} section prompts, ~{fanout_tokens} input tokens "
+        f"({fanout_tokens / max(1, serial_tokens):.1f}x a single full-report prompt)", 'info')
+    budget = current_budget()
+    exceeded = budget.would_exceed(fanout_tokens, len(pending)) if budget is not None else None
+    if exceeded:
+        log(f"💰 Parallel analysis would exceed the {exceeded} - skipping it", 'warning')
+        return None
+
+    with ThreadPoolExecutor(max_workers=max(1, ANALYSIS_PARALLELISM)) as executor:
+        for attempt in range(ANALYSIS_SECTION_RETRIES + 1):
+            if attempt:
+                log(f"Retrying {len(pending)} failed section(s): {', '.join(pending)}", 'warning')
+            # Copy the context per task so LLM usage is charged to this run's budget
+            futures = {
+                name: executor.submit(contextvars.copy_context().run, analyze_dimension,
+                                      analyzer, name, report_content, category)
+                for name in pending
+            }
+            failed = []
+            for name, future in futures.items():
+                try:
+                    sections[name] = future.result()
+                    log(f"✓ Section analyzed: {name}", 'success')
+                except Exception as e:
+                    log(f"Section {name} failed: {str(e)}", 'warning')
+                    failed.append(name)
+            pending = failed
+            if not pending:
+                break
+
+    if not sections:
+        return None
+    if pending:
+        log(f"Using defaults for sections that kept failing: {', '.join(pending)}", 'warning')
+
+    analysis_json = {}
+    for name in DIMENSIONS:
+        analysis_json.update(sections.get(name, {}))
+    return apply_analysis_defaults(analysis_json)
@@ -0,0 +1,218 @@
+"""
+Pipelined UX analysis - analyzes agent output while the exploration is still running
+
+The agent's captured stdout is cut into chunks as it grows. Each chunk is sent to
+the analysis model for focused findings (screens, positives, issues, counters),
+which are folded into a running partial result. When the agent stops only the
+last chunks and one small merge call remain, so the analysis tail after
+exploration shrinks from a full-report analysis to seconds.
+"""
+import asyncio
+import json
+import os
+from report_compactor import compact_report
+from ux_analyzer import apply_analysis_defaults
+from utils import load_and_format_prompt, runner_output
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# Minimum new agent output (characters) before a chunk is analyzed
+PIPELINE_CHUNK_CHARS = int(_env_float("PIPELINE_CHUNK_CHARS", 6000))
+# Seconds between checks for new agent output
+PIPELINE_INTERVAL = _env_float("PIPELINE_INTERVAL", 15.0)
+# How much of the final report is given to the merge call as extra context
+PIPELINE_MERGE_REPORT_CHARS = int(_env_float("PIPELINE_MERGE_REPORT_CHARS", 8000))
+
+# Counters the chunk prompt reports, summed across chunks
+COUNTERS = (
+    'interactions', 'clickable_elements', 'successful_actions', 'dead_elements',
+    'feedback_observed', 'loading_states_observed', 'silent_failures', 'backtracks',
+    'errors_encountered', 'navigation_loops',
+)
+
+
+class PipelinedAnalyzer:
+    """Incrementally analyzes captured agent output and merges it at the end
+
+    Args:
+        analyzer: UXAnalyzer used for routed LLM calls and JSON parsing
+        category: App category, passed to the prompts
+        log: Callable(message, log_type) for progress logs
+    """
+
+    def __init__(self, analyzer, category, log=None):
+        self.analyzer = analyzer
+        self.category = category
+        self.log = log or (lambda message, log_type='info': print(message))
+        self.partial = {
+            'screens': {},
+            'positive': [],
+            'issues': [],
+            'counters': {name: 0 for name in COUNTERS},
+            'max_depth': 0,
+        }
+        self.chunks_analyzed = 0
+        self._source = None
+        self._offset = 0
+        self._task = None
+        self._stopped = False
+
+    def start(self, source):
+        """Start analyzing in the background
+
+        Args:
+            source: Callable returning all agent output captured so far, without
+                    DroidScope's own output (see utils.runner_output)
+        """
+        self._source = source
+        self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while not self._stopped:
+            await asyncio.sleep(PIPELINE_INTERVAL)
+            await self._analyze_pending(final=False)
+
+    async def _analyze_pending(self, final):
+        """Analyze the captured output that is not analyzed yet, one chunk at a time
+
+        Without ``final`` only full chunks are analyzed and the rest waits for the
+        next round; with ``final`` the remainder is analyzed too.
+        """
+        # Everything the pipeline prints (progress, retries, parse warnings) is marked so
+        # the tee keeps it out of the agent output the next chunks are cut from
+        with runner_output():
+            while not self._stopped or final:
+                chunk = self._next_chunk(self._source(), final)
+                if chunk is None:
+                    return
+                await self._analyze_chunk(chunk)
+
+    def _next_chunk(self, text, final):
+        """Take up to PIPELINE_CHUNK_CHARS of pending output, cut at a line end"""
+        pending = text[self._offset:]
+        if not pending.strip():
+            return None
+        if len(pending) > PIPELINE_CHUNK_CHARS:
+            # Only analyze complete lines (unless a single line exceeds the chunk size)
+            cut = pending.rfind('\n', 0, PIPELINE_CHUNK_CHARS) + 1
+            pending = pending[:cut or PIPELINE_CHUNK_CHARS]
+        elif not final:
+            return None
+        self._offset += len(pending)
+        return pending
+
+    async def _analyze_chunk(self, pending):
+        chunk, _ = compact_report(pending)
+        prompt = load_and_format_prompt(
+            'analysis_chunk_prompt',
+            category=self.category,
+            known_screens=', '.join(self.partial['screens']) or 'none yet',
+            chunk=chunk
+        )
+        try:
+            response = await asyncio.to_thread(self.analyzer.complete, 'analysis', prompt)
+            findings = await asyncio.to_thread(self.analyzer.parse_json_response, response)
+            if not isinstance(findings, dict):
+                raise ValueError(f"expected a JSON object, got {type(findings).__name__}")
+            self.fold(findings)
+        except Exception as e:
+            self.log(f"Pipelined analysis skipped a chunk: {str(e)}", 'warning')
+            return
+
+        self.chunks_analyzed += 1
+        self.log(f"📈 Partial analysis updated: chunk {self.chunks_analyzed}, "
+                 f"{len(self.partial['screens'])} screens, {len(self.partial['issues'])} issues so far", 'info')
+
+    def fold(self, findings):
+        """Merge one chunk's findings into the running partial result (malformed entries are ignored)"""
+        screens = findings.get('screens')
+        for screen in screens if isinstance(screens, list) else []:
+            name = screen.get('name') if isinstance(screen, dict) else None
+            if not name:
+                continue
+            known = self.partial['screens'].setdefault(name, {})
+            known.update({key: value for key, value in screen.items() if value not in (None, '', [])})
+            depth = screen.get('depth')
+            if isinstance(depth, (int, float)):
+                self.partial['max_depth'] = max(self.partial['max_depth'], depth)
+
+        for key in ('positive', 'issues'):
+            items = findings.get(key)
+            seen = {json.dumps(item, sort_keys=True) for item in self.partial[key]}
+            for item in items if isinstance(items, list) else []:
+                item_key = json.dumps(item, sort_keys=True)
+                if item_key not in seen:
+                    seen.add(item_key)
+                    self.partial[key].append(item)
+
+        counters = findings.get('counters')
+        for name, value in (counters.items() if isinstance(counters, dict) else ()):
+            if name in self.partial['counters'] and isinstance(value, (int, float)):
+                self.partial['counters'][name] += value
+
+    async def drain(self):
+        """Stop the background loop and analyze whatever output is left"""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._source is not None:
+            await self._analyze_pending(final=True)
+
+    def cancel(self):
+        """Abandon pipelined analysis (e.g. the run was stopped by the user)"""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+
+    def merge(self, report_content):
+        """Produce the final analysis from the partial result with one merge call
+
+        Args:
+            report_content: Final exploration report; a bounded excerpt is
+                            included so the final answer's summary is not lost
+
+        Returns:
+            dict: Analysis in the ux_analysis_blocks.json schema, or None on failure
+        """
+        partial = dict(self.partial, screens=list(self.partial['screens'].values()))
+        return merge_partial_findings(self.analyzer, self.category, partial, report_content)
+
+
+def merge_partial_findings(analyzer, category, partial, report_content):
+    """Turn accumulated partial findings into a full analysis with one merge call
+
+    Args:
+        analyzer: UXAnalyzer used for routed LLM calls and JSON parsing
+        category: App category
+        partial: Dict with screens (list), positive, issues, counters and max_depth
+        report_content: Exploration report; a bounded excerpt is added as context
+
+    Returns:
+        dict: Analysis in the ux_analysis_blocks.json schema, or None on failure
+    """
+    prompt = load_and_format_prompt(
+        'analysis_merge_prompt',
+        category=category,
+        partial_findings=json.dumps(partial, separators=(',', ':'), ensure_ascii=False),
+        report_excerpt=report_content[:PIPELINE_MERGE_REPORT_CHARS]
+    )
+    try:
+        print("🔄 Merging partial analysis findings...")
+        analysis_json = analyzer.parse_json_response(analyzer.complete('analysis', prompt))
+    except json.JSONDecodeError as e:
+        print(f"Error parsing repaired JSON response: {str(e)}")
+        return None
+    except Exception as e:
+        print(f"Error during analysis merge: {str(e)}")
+        return None
+    return apply_analysis_defaults(analysis_json)
@@ -0,0 +1,233 @@
+"""
+Report compaction - shrinks exploration reports before they reach the analysis LLM
+
+The raw agent_result.txt carries pretty-printed JSON, separators, repeated screen
+observations and boilerplate. Compaction removes that overhead while guaranteeing
+that every metric line the analysis prompt relies on (counts, percentages, scores,
+depths) survives: any key fact missing after compaction is restored verbatim.
+"""
+import json
+import re
+
+
+# Separator lines; they delimit sections, so they become blank lines rather than vanishing
+SEPARATOR = re.compile(r'^\s*[-=_*~#]{3,}\s*$')
+
+# Lines that carry no information for the analysis
+BOILERPLATE_PATTERNS = [
+    re.compile(r'^\s*Structured output saved to:', re.IGNORECASE),
+    re.compile(r'^\s*(INFO|DEBUG)\s*[:\]]', re.IGNORECASE),
+    re.compile(r'^\s*[⏳🔄✓]\s'),
+    # DroidScope's own progress logs echoed into the captured agent output
+    re.compile(r'^\s*\[(INFO|SUCCESS|WARNING|ERROR)\]\s'),
+]
+
+# Facts the analysis prompt asks for: "label: number" pairs and "N screens"-style counts
+LABELLED_NUMBER = re.compile(r'"?([A-Za-z][\w \-/]{1,40}?)"?\s*[:=]\s*"?(-?\d+(?:\.\d+)?\s*%?)')
+COUNTED_UNIT = re.compile(
+    r'(-?\d+(?:\.\d+)?)\s*%?\s*(screens?|taps?|clicks?|elements?|interactions?|levels?|steps?|'
+    r'errors?|failures?|loops?|buttons?|tabs?|actions?|transitions?|hubs?|orphans?)\b',
+    re.IGNORECASE
+)
+
+# Sections shorter than this are never summarized
+SUMMARY_MIN_CHARS = 1500
+
+_encoder = None
+
+
+def estimate_tokens(text):
+    """Token count using tiktoken when its encoding is available, else ~4 chars/token"""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return len(text) // 4
+
+
+def _normalize(text):
+    return re.sub(r'[\s_"]+', ' ', text).strip().lower()
+
+
+def extract_key_facts(text):
+    """Map each normalized metric fact in the text to the line it came from"""
+    facts = {}
+    for line in text.splitlines():
+        for label, value in LABELLED_NUMBER.findall(line):
+            facts.setdefault(f"{_normalize(label)}={_normalize(value)}", line.strip())
+        for value, unit in COUNTED_UNIT.findall(line):
+            facts.setdefault(f"{value} {unit.lower().rstrip('s')}", line.strip())
+    return facts
+
+
+def dedupe_json(value, min_length=20):
+    """Collapse repeated objects (and long strings) in JSON arrays to their first copy
+
+    The structured output often lists the same screen several times; kept objects
+    get an "observed" count, like repeated text blocks do in collapse_repeats().
+    """
+    if isinstance(value, dict):
+        return {key: dedupe_json(item, min_length) for key, item in value.items()}
+    if not isinstance(value, list):
+        return value
+
+    counts = {}
+    kept = []
+    for item in value:
+        item = dedupe_json(item, min_length)
+        if isinstance(item, dict) or (isinstance(item, str) and len(item) >= min_length):
+            key = _normalize(json.dumps(item, sort_keys=True, ensure_ascii=False))
+            if key in counts:
+                counts[key] += 1
+                continue
+            counts[key] = 1
+            kept.append((item, key))
+        else:
+            kept.append((item, None))
+
+    result = []
+    for item, key in kept:
+        count = counts.get(key, 1) if key is not None else 1
+        if count > 1:
+            item = dict(item, observed=count) if isinstance(item, dict) else f"{item} [observed {count}x]"
+        result.append(item)
+    return result
+
+
+def minify_embedded_json(text):
+    """Re-serialize multi-line JSON objects/arrays embedded in the report compactly,
+    collapsing repeated array entries"""
+    decoder = json.JSONDecoder()
+    output = []
+    position = 0
+    for match in re.finditer(r'^[ \t]*[\[{]', text, re.MULTILINE):
+        start = match.end() - 1
+        if start < position:
+            continue
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            continue
+        if '\n' not in text[start:end]:
+            continue
+        output.append(text[position:match.start()])
+        output.append(json.dumps(dedupe_json(value), separators=(',', ':'), ensure_ascii=False))
+        position = end
+    output.append(text[position:])
+    return ''.join(output)
+
+
+def drop_boilerplate(text):
+    """Turn separators into blank lines and remove status chatter and blank-line runs"""
+    lines = []
+    for line in text.splitlines():
+        if SEPARATOR.match(line):
+            # Keep the section boundary for collapse_repeats()
+            line = ''
+        elif any(pattern.match(line) for pattern in BOILERPLATE_PATTERNS):
+            continue
+        if not line.strip() and lines and not lines[-1].strip():
+            continue
+        lines.append(line.rstrip())
+    return '\n'.join(lines).strip()
+
+
+def collapse_repeats(text, min_length=20):
+    """Keep the first copy of repeated lines/blocks and note how often blocks recurred
+
+    Blocks are blank-line separated paragraphs or markdown sections, so a screen
+    observed several times collapses to its first description plus a count.
+    """
+    blocks = [block for block in re.split(r'\n\s*\n|\n(?=#{1,6} )', text) if block.strip()]
+    counts = {}
+    seen_lines = set()
+    kept = []
+    for block in blocks:
+        key = _normalize(block)
+        if key in counts:
+            counts[key] += 1
+            continue
+        counts[key] = 1
+
+        lines = []
+        repeated_lines = 0
+        for line in block.split('\n'):
+            line_key = _normalize(line)
+            if len(line_key) >= min_length:
+                if line_key in seen_lines:
+                    repeated_lines += 1
+                    continue
+                seen_lines.add(line_key)
+            lines.append(line)
+        if repeated_lines and not any(len(_normalize(line)) >= min_length for line in lines):
+            # Nothing new beyond short lines such as the heading
+            continue
+        kept.append(('\n'.join(lines), key))
+
+    return '\n\n'.join(
+        block + (f"\n[observed {counts[key]}x]" if counts[key] > 1 else '')
+        for block, key in kept
+    )
+
+
+def summarize_sections(text, summarize):
+    """Replace long sections that carry no metrics with a summary from ``summarize``"""
+    sections = re.split(r'(?m)^(?=#{1,4} )', text)
+    result = []
+    for section in sections:
+        if len(section) >= SUMMARY_MIN_CHARS and not extract_key_facts(section):
+            heading = section.split('\n', 1)[0] if section.startswith('#') else ''
+            try:
+                summary = summarize(section).strip()
+                section = f"{heading}\n{summary}\n" if heading else f"{summary}\n"
+            except Exception as e:
+                print(f"Warning: section summary failed, keeping original: {str(e)}")
+        result.append(section)
+    return ''.join(result)
+
+
+def compact_report(text, summarize=None):
+    """Compact a report for the analysis prompt
+
+    Args:
+        text: Raw report content
+        summarize: Optional callable(section_text) -> summary used for long,
+                   metric-free sections
+
+    Returns:
+        tuple: (compacted_text, stats) where stats holds original/compacted token
+               counts and how many key facts were restored
+    """
+    original_facts = extract_key_facts(text)
+
+    compacted = minify_embedded_json(text)
+    compacted = drop_boilerplate(compacted)
+    compacted = collapse_repeats(compacted)
+    if summarize is not None:
+        compacted = summarize_sections(compacted, summarize)
+
+    # Guarantee: every metric fact in the original is still present
+    remaining = extract_key_facts(compacted)
+    missing = [line for fact, line in original_facts.items() if fact not in remaining]
+    if missing:
+        restored = list(dict.fromkeys(missing))
+        compacted += "\n\nKey Metrics (preserved):\n" + '\n'.join(restored)
+        if any(fact not in extract_key_facts(compacted) for fact in original_facts):
+            # Should not happen, but never trade metrics for tokens
+            compacted = text
+
+    original_tokens = estimate_tokens(text)
+    compacted_tokens = estimate_tokens(compacted)
+    stats = {
+        'original_tokens': original_tokens,
+        'compacted_tokens': compacted_tokens,
+        'saved_pct': round(100 * (1 - compacted_tokens / original_tokens), 1) if original_tokens else 0.0,
+        'key_facts': len(original_facts),
+        'restored_facts': len(missing),
+    }
+    return compacted, stats
@@ -0,0 +1,375 @@
+"""
+Process-based execution backend for exploration runs
+
+Each run executes in a worker process from a bounded pool instead of a thread of
+the web server, so a hung agent, a leaking LLM/agent stack or the stdout
+redirection of a run cannot affect the server or other runs. Logs, progress and
+LLM usage come back over a queue. Workers are killed when they exceed their
+RSS or wall-clock limit, recycled after a number of runs, and a crashed worker
+is reported as a failed run.
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# 'process' runs explorations in worker processes, 'thread' in the server process
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "process")
+# Maximum number of runs executing at once
+RUN_POOL_SIZE = max(1, int(_env_float("RUN_POOL_SIZE", 1)))
+# Runs a worker executes before it is replaced by a fresh process
+RUN_WORKER_MAX_RUNS = max(1, int(_env_float("RUN_WORKER_MAX_RUNS", 5)))
+# Resident memory limit per worker in MB (0 = unlimited)
+RUN_WORKER_MAX_RSS_MB = _env_float("RUN_WORKER_MAX_RSS_MB", 4096)
+# Wall-clock limit per run in seconds (0 = unlimited)
+RUN_WORKER_MAX_SECONDS = _env_float("RUN_WORKER_MAX_SECONDS", 3600)
+# Seconds a worker gets to wind down after a stop request before it is killed
+RUN_WORKER_STOP_GRACE = _env_float("RUN_WORKER_STOP_GRACE", 30)
+
+# How often the parent checks worker health while relaying events
+MONITOR_INTERVAL = 0.5
+# Most events relayed between two health checks
+MONITOR_BATCH = 200
+
+
+class WorkerError(RuntimeError):
+    """A worker process crashed or was killed for exceeding a limit"""
+
+
+def process_rss_mb(pid):
+    """Resident set size of a process in MB, or None if it cannot be read"""
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status", 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class GlobalBudgetFlag:
+    """The server's global budget as seen from a worker: exhausted once the server sets the event"""
+
+    def __init__(self, event):
+        self.event = event
+
+    def exhausted_reason(self):
+        return "global budget exhausted" if self.event.is_set() else None
+
+
+def _worker_main(tasks, events, stop_event, budget_event):
+    """Worker process loop: execute runs from the task queue until told to exit"""
+    # Import the agent stack once per worker so reused workers start runs warm
+    from budget import delegate_global_budget
+    from cancellation import StopSignal
+    from exploration_runner import run_exploration_with_category
+
+    current = {'run_id': None}
+    # Usage is charged to the server's global budget, not to a copy in this process
+    delegate_global_budget(lambda prompt_tokens, completion_tokens: events.put({
+        'kind': 'usage', 'run_id': current['run_id'],
+        'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+    }), GlobalBudgetFlag(budget_event))
+
+    while True:
+        job = tasks.get()
+        if job is None:
+            return
+        run_id = current['run_id'] = job['run_id']
+
+        def log(message, log_type='info'):
+            events.put({'kind': 'log', 'run_id': run_id, 'message': message, 'type': log_type})
+
+        def progress(message, percentage=0):
+            events.put({'kind': 'progress', 'run_id': run_id, 'message': message, 'percentage': percentage})
+
+        # Relay the parent's stop request into the StopSignal the runner watches
+        stop_flag = StopSignal()
+
+        def relay_stop():
+            while not stop_flag.is_set():
+                if stop_event.wait(0.1):
+                    stop_flag.set()
+
+        relay = threading.Thread(target=relay_stop, daemon=True)
+        relay.start()
+
+        try:
+            asyncio.run(run_exploration_with_category(
+                progress_callback=progress, log_callback=log, stop_flag=stop_flag, **job['kwargs']
+            ))
+            events.put({'kind': 'done', 'run_id': run_id, 'status': 'completed'})
+        except KeyboardInterrupt:
+            events.put({'kind': 'done', 'run_id': run_id, 'status': 'stopped'})
+        except Exception as e:
+            events.put({'kind': 'done', 'run_id': run_id, 'status': 'failed', 'error': str(e)})
+        finally:
+            # Ends the relay thread
+            stop_flag.set()
+
+
+class WorkerProcess:
+    """One pooled worker process with its task/event queues and stop event"""
+
+    def __init__(self, context):
+        self.tasks = context.Queue()
+        self.events = context.Queue()
+        self.stop_event = context.Event()
+        # Set by the server when its global budget is exhausted
+        self.budget_event = context.Event()
+        self.process = context.Process(
+            target=_worker_main, args=(self.tasks, self.events, self.stop_event, self.budget_event), daemon=True
+        )
+        self.process.start()
+        self.runs = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def rss_mb(self):
+        return process_rss_mb(self.pid)
+
+    def retire(self):
+        """Ask the worker to exit after its current run, killing it if it does not"""
+        try:
+            self.tasks.put(None)
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        if self.process.is_alive():
+            self.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join(timeout=5)
+
+
+class ProcessRunExecutor:
+    """Bounded pool of worker processes that execute exploration runs
+
+    Args:
+        pool_size: Maximum number of concurrent runs (and live workers)
+        max_runs_per_worker: Runs before a worker is recycled
+        max_rss_mb: RSS limit per worker in MB (0/None = unlimited)
+        max_run_seconds: Wall-clock limit per run (0/None = unlimited)
+    """
+
+    def __init__(self, pool_size=RUN_POOL_SIZE, max_runs_per_worker=RUN_WORKER_MAX_RUNS,
+                 max_rss_mb=RUN_WORKER_MAX_RSS_MB, max_run_seconds=RUN_WORKER_MAX_SECONDS):
+        # Spawned workers do not inherit the server's threads, locks or stdout redirection
+        self.context = multiprocessing.get_context('spawn')
+        self.pool_size = pool_size
+        self.max_runs_per_worker = max_runs_per_worker
+        self.max_rss_mb = max_rss_mb
+        self.max_run_seconds = max_run_seconds
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._busy = {}
+        self.stats = {'runs': 0, 'completed': 0, 'stopped': 0, 'failed': 0,
+                      'crashed': 0, 'killed': 0, 'recycled': 0, 'started_workers': 0}
+
+    def _acquire_worker(self):
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+            self.stats['started_workers'] += 1
+            return WorkerProcess(self.context)
+
+    def _release_worker(self, worker, healthy):
+        with self._lock:
+            if healthy and worker.runs < self.max_runs_per_worker and worker.process.is_alive():
+                self._idle.append(worker)
+                return
+            if healthy:
+                self.stats['recycled'] += 1
+        # Retiring waits for the process to exit, so do it outside the lock
+        if worker.process.is_alive():
+            worker.retire()
+
+    def run(self, run_id, kwargs, stop_flag, log_callback, progress_callback, usage_callback=None,
+            budget_status=None):
+        """Execute one run in a worker and relay its events until it finishes
+
+        Blocks the calling thread, which only relays events; the agent itself runs
+        in the worker process.
+
+        Args:
+            run_id: Identifier attached to every event of this run
+            kwargs: Keyword arguments for run_exploration_with_category (app_name,
+                    category, max_depth, analysis_mode)
+            stop_flag: StopSignal of the server; setting it stops the worker's run
+            log_callback: Callable(message, log_type)
+            progress_callback: Callable(message, percentage)
+            usage_callback: Optional callable(prompt_tokens, completion_tokens)
+            budget_status: Optional budget (exhausted_reason()) the worker's run is
+                           wound down on, e.g. the server's global budget
+
+        Raises:
+            KeyboardInterrupt: The run was stopped by the user
+            WorkerError: The worker crashed or exceeded its RSS/time limit
+            RuntimeError: The run itself failed
+        """
+        if not self._slots.acquire(blocking=False):
+            log_callback(f"⏳ All {self.pool_size} run worker(s) busy - waiting for a free one", 'warning')
+            self._slots.acquire()
+
+        worker = self._acquire_worker()
+        healthy = False
+        with self._lock:
+            self._busy[run_id] = worker
+            self.stats['runs'] += 1
+        try:
+            worker.stop_event.clear()
+            worker.budget_event.clear()
+            worker.runs += 1
+            worker.tasks.put({'run_id': run_id, 'kwargs': kwargs})
+            log_callback(f"🧱 Run {run_id} started in worker process {worker.pid} "
+                         f"(run {worker.runs}/{self.max_runs_per_worker} of this worker)", 'info')
+
+            def check_budget():
+                if budget_status is None or worker.budget_event.is_set():
+                    return
+                exhausted = budget_status.exhausted_reason()
+                if exhausted:
+                    log_callback(f"💰 {exhausted} - winding down run {run_id}", 'warning')
+                    worker.budget_event.set()
+
+            def relay(event):
+                if event['kind'] == 'log':
+                    log_callback(event['message'], event['type'])
+                elif event['kind'] == 'progress':
+                    progress_callback(event['message'], event['percentage'])
+                elif event['kind'] == 'usage':
+                    if usage_callback is not None:
+                        usage_callback(event['prompt_tokens'], event['completion_tokens'])
+                elif event['kind'] == 'done':
+                    return event
+                return None
+
+            started_at = time.monotonic()
+            stop_sent_at = None
+            while True:
+                # Wait for the next event, then drain whatever else is queued so the
+                # health checks below run after every batch, however busy the run is
+                try:
+                    pending = [worker.events.get(timeout=MONITOR_INTERVAL)]
+                except queue.Empty:
+                    pending = []
+                while pending and len(pending) < MONITOR_BATCH:
+                    try:
+                        pending.append(worker.events.get_nowait())
+                    except queue.Empty:
+                        break
+
+                for event in pending:
+                    done = relay(event)
+                    if done is not None:
+                        healthy = True
+                        self.stats[done['status']] += 1
+                        if done['status'] == 'stopped':
+                            raise KeyboardInterrupt("Agent stopped by user request")
+                        if done['status'] == 'failed':
+                            raise RuntimeError(done.get('error') or 'Run failed')
+                        return
+
+                now = time.monotonic()
+                check_budget()
+                if stop_flag is not None and stop_flag.is_set() and stop_sent_at is None:
+                    worker.stop_event.set()
+                    stop_sent_at = now
+
+                if not worker.process.is_alive():
+                    self.stats['crashed'] += 1
+                    raise WorkerError(f"Worker process {worker.pid} crashed (exit code {worker.process.exitcode})")
+
+                limit = None
+                rss = worker.rss_mb() if self.max_rss_mb else None
+                if rss is not None and rss > self.max_rss_mb:
+                    limit = f"memory limit exceeded ({rss:.0f} MB > {self.max_rss_mb:.0f} MB)"
+                elif self.max_run_seconds and now - started_at > self.max_run_seconds:
+                    limit = f"time limit exceeded ({self.max_run_seconds:.0f}s)"
+                elif stop_sent_at is not None and now - stop_sent_at > RUN_WORKER_STOP_GRACE:
+                    limit = f"did not stop within {RUN_WORKER_STOP_GRACE:.0f}s"
+                if limit:
+                    worker.kill()
+                    self.stats['killed'] += 1
+                    if stop_sent_at is not None and limit.startswith('did not stop'):
+                        log_callback(f"Worker process {worker.pid} killed: {limit}", 'warning')
+                        raise KeyboardInterrupt("Agent stopped by user request")
+                    raise WorkerError(f"Worker process {worker.pid} killed: {limit}")
+        finally:
+            with self._lock:
+                self._busy.pop(run_id, None)
+            self._release_worker(worker, healthy)
+            self._slots.release()
+
+    def snapshot(self):
+        """Pool configuration, live workers and run counters as a JSON-serializable dict"""
+        with self._lock:
+            workers = [
+                {'pid': worker.pid, 'state': 'busy', 'run_id': run_id, 'runs': worker.runs}
+                for run_id, worker in self._busy.items()
+            ] + [
+                {'pid': worker.pid, 'state': 'idle', 'run_id': None, 'runs': worker.runs}
+                for worker in self._idle
+            ]
+        for worker in workers:
+            rss = process_rss_mb(worker['pid'])
+            worker['rss_mb'] = round(rss, 1) if rss is not None else None
+        return {
+            'backend': 'process',
+            'pool_size': self.pool_size,
+            'limits': {
+                'max_runs_per_worker': self.max_runs_per_worker,
+                'max_rss_mb': self.max_rss_mb or None,
+                'max_run_seconds': self.max_run_seconds or None,
+                'stop_grace_seconds': RUN_WORKER_STOP_GRACE,
+            },
+            'workers': workers,
+            'stats': dict(self.stats),
+        }
+
+    def shutdown(self):
+        """Retire all idle workers"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.retire()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_run_executor():
+    """Process-wide ProcessRunExecutor, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessRunExecutor()
+        return _executor
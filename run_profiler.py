@@ -0,0 +1,332 @@
+"""
+Opt-in per-run profiling
+
+When enabled for a run (PROFILE_RUNS=1 or "profile": true in /api/run-test) the
+profiler records:
+
+- a sampling profiler on the run's thread, aggregated into folded stacks that
+  flame graph tools read directly
+- RSS per stage, the run's RSS growth, and GC collections and pause times per
+  generation
+- with PROFILE_MEMORY=1, tracemalloc snapshots at each pipeline stage
+  (current/peak traced memory and the allocation sites that grew the most)
+
+Results are written to data/runs/<run_id>/profile.json and profile.folded and
+served by /api/runs/<run_id>/profile. The sampler wakes every
+PROFILE_SAMPLE_INTERVAL seconds, which keeps its overhead low. tracemalloc is off
+by default: it slows down every allocation in the process while it traces, on
+top of the snapshot time that the reported overhead includes.
+"""
+import contextvars
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from utils import get_data_dir
+
+load_dotenv()
+
+
+def _env_float(name, default):
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return float(default)
+
+
+# Profile every run (individual runs can also opt in through the API)
+PROFILE_RUNS = os.getenv("PROFILE_RUNS", "0") == "1"
+# Seconds between stack samples of the run thread
+PROFILE_SAMPLE_INTERVAL = _env_float("PROFILE_SAMPLE_INTERVAL", 0.02)
+# Trace allocations with tracemalloc (off by default: it slows down every allocation while tracing)
+PROFILE_MEMORY = os.getenv("PROFILE_MEMORY", "0") == "1"
+# Frames tracemalloc keeps per allocation (1 is cheapest)
+PROFILE_TRACEMALLOC_FRAMES = int(_env_float("PROFILE_TRACEMALLOC_FRAMES", 1))
+# Allocation sites reported per stage
+PROFILE_TOP_ALLOCATIONS = 10
+# Deepest stack kept by the sampler
+MAX_STACK_DEPTH = 64
+# Allocation sites that are import machinery or the profiler's own bookkeeping
+IGNORED_ALLOCATION_SITES = ('<frozen importlib', '<unknown>', tracemalloc.__file__)
+
+_current_profiler = contextvars.ContextVar('droidscope_run_profiler', default=None)
+
+# tracemalloc is process-wide: it is started by the first profiler that needs it
+# and stopped when the last one finishes, so concurrent runs do not cut each other off
+_tracemalloc_users = 0
+_tracemalloc_started = False
+_tracemalloc_lock = threading.Lock()
+
+
+def _acquire_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def _release_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def current_rss_mb():
+    """RSS of this process in MB, or None if it cannot be read"""
+    # Import here to avoid a circular import through the executor
+    from run_executor import process_rss_mb
+    return process_rss_mb(os.getpid())
+
+
+def process_peak_rss_mb():
+    """Peak RSS of this process over its whole lifetime in MB (None where the resource module is unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StackSampler:
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.cpu_seconds = 0.0
+        # Set while the profiler does its own bookkeeping so it does not sample itself
+        self.paused = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='droidscope-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=2)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if self.paused:
+                continue
+            started = time.thread_time()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+            self.cpu_seconds += time.thread_time() - started
+
+    def folded(self):
+        """Stacks in the folded format used by flamegraph.pl / speedscope"""
+        return '\n'.join(f"{stack} {count}" for stack, count in
+                         sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def top_functions(self, limit=15):
+        """Functions by share of samples where they were on top of the stack"""
+        leaf_counts = {}
+        for stack, count in self.stacks.items():
+            leaf = stack.rsplit(';', 1)[-1]
+            leaf_counts[leaf] = leaf_counts.get(leaf, 0) + count
+        return [
+            {'function': leaf, 'samples': count, 'pct': round(100 * count / self.samples, 1)}
+            for leaf, count in sorted(leaf_counts.items(), key=lambda item: -item[1])[:limit]
+        ] if self.samples else []
+
+
+class RunProfiler:
+    """Collects stage, memory, GC and CPU profile data for one run
+
+    Args:
+        run_id: Run whose artifacts directory receives the profile
+        thread_id: Thread to sample (default: the calling thread)
+        trace_memory: Snapshot allocations with tracemalloc at stage boundaries
+    """
+
+    def __init__(self, run_id, thread_id=None, trace_memory=PROFILE_MEMORY):
+        self.run_id = run_id
+        self.trace_memory = trace_memory
+        self.stages = []
+        self.sampler = StackSampler(thread_id or threading.get_ident())
+        self.gc_stats = {generation: {'collections': 0, 'collected': 0, 'pause_seconds': 0.0, 'max_pause_seconds': 0.0}
+                         for generation in range(3)}
+        self._gc_started = None
+        self._tracing = False
+        self._snapshot = None
+        self.rss_start_mb = None
+        self.snapshot_seconds = 0.0
+        self.started_at = None
+        self.finished_at = None
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            pause = time.perf_counter() - self._gc_started
+            stats = self.gc_stats[info['generation']]
+            stats['collections'] += 1
+            stats['collected'] += info.get('collected', 0)
+            stats['pause_seconds'] += pause
+            stats['max_pause_seconds'] = max(stats['max_pause_seconds'], pause)
+            self._gc_started = None
+
+    def start(self):
+        self.started_at = time.time()
+        self.rss_start_mb = current_rss_mb()
+        if self.trace_memory:
+            _acquire_tracemalloc()
+            self._tracing = True
+            self._snapshot = tracemalloc.take_snapshot()
+        gc.callbacks.append(self._on_gc)
+        self.sampler.start()
+        return self
+
+    @contextmanager
+    def stage(self, name):
+        """Record duration, memory growth and top allocation sites of a pipeline stage"""
+        if self._tracing and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            cpu = time.process_time() - cpu_started
+            rss = current_rss_mb()
+            record = {
+                'stage': name,
+                'duration_seconds': round(duration, 3),
+                'cpu_seconds': round(cpu, 3),
+                'rss_mb': round(rss, 1) if rss is not None else None,
+            }
+            if self._tracing:
+                record.update(self._memory_stats())
+            self.stages.append(record)
+
+    def _memory_stats(self):
+        """Traced memory of the stage that just ended and its biggest allocation sites"""
+        if not tracemalloc.is_tracing():
+            # Something outside the profiler stopped tracing
+            return {'traced_current_mb': None, 'traced_peak_mb': None, 'top_allocations': []}
+        current, peak = tracemalloc.get_traced_memory()
+        self.sampler.paused = True
+        snapshot_started = time.perf_counter()
+        snapshot = tracemalloc.take_snapshot()
+        # Filtering the grouped statistics is much cheaper than filtering every trace
+        top = [stat for stat in snapshot.compare_to(self._snapshot, 'lineno')
+               if not stat.traceback[0].filename.startswith(IGNORED_ALLOCATION_SITES)][:PROFILE_TOP_ALLOCATIONS]
+        self._snapshot = snapshot
+        self.snapshot_seconds += time.perf_counter() - snapshot_started
+        self.sampler.paused = False
+        return {
+            'traced_current_mb': round(current / (1024 * 1024), 2),
+            'traced_peak_mb': round(peak / (1024 * 1024), 2),
+            'top_allocations': [
+                {'site': str(stat.traceback), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                 'count_diff': stat.count_diff}
+                for stat in top
+            ],
+        }
+
+    def stop(self):
+        """Stop collecting and write the profile to the run's artifacts
+
+        Returns:
+            dict: The profile (also saved as profile.json)
+        """
+        self.finished_at = time.time()
+        self.sampler.stop()
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+        tracemalloc_mb = None
+        if self._tracing:
+            if tracemalloc.is_tracing():
+                tracemalloc_mb = tracemalloc.get_tracemalloc_memory() / (1024 * 1024)
+            _release_tracemalloc()
+            self._tracing = False
+        self._snapshot = None
+
+        wall = self.finished_at - self.started_at
+        rss_end = current_rss_mb()
+        process_peak = process_peak_rss_mb()
+        stage_rss = [stage['rss_mb'] for stage in self.stages if stage['rss_mb'] is not None]
+        profile = {
+            'run_id': self.run_id,
+            'started_at': self.started_at,
+            'wall_seconds': round(wall, 2),
+            'rss': {
+                'start_mb': round(self.rss_start_mb, 1) if self.rss_start_mb is not None else None,
+                'end_mb': round(rss_end, 1) if rss_end is not None else None,
+                # Growth over the run and the highest RSS seen at a stage boundary
+                'delta_mb': (round(rss_end - self.rss_start_mb, 1)
+                             if rss_end is not None and self.rss_start_mb is not None else None),
+                'max_stage_mb': max(stage_rss) if stage_rss else None,
+                # Lifetime peak of the whole process, which may predate this run
+                'process_peak_mb': round(process_peak, 1) if process_peak is not None else None,
+            },
+            'stages': self.stages,
+            'gc': {str(generation): dict(stats, pause_seconds=round(stats['pause_seconds'], 4),
+                                         max_pause_seconds=round(stats['max_pause_seconds'], 4))
+                   for generation, stats in self.gc_stats.items()},
+            'sampling': {
+                'interval_seconds': self.sampler.interval,
+                'samples': self.sampler.samples,
+                'top_functions': self.sampler.top_functions(),
+            },
+            'tracemalloc': {
+                'enabled': self.trace_memory,
+                # Time spent taking and diffing snapshots at stage boundaries
+                'snapshot_seconds': round(self.snapshot_seconds, 3),
+                'memory_mb': round(tracemalloc_mb, 2) if tracemalloc_mb is not None else None,
+            },
+            # Sampler CPU plus snapshot time relative to the run's wall time. The
+            # slowdown tracemalloc adds to every allocation is not measurable from
+            # inside the run and comes on top when PROFILE_MEMORY=1.
+            'overhead_pct': (round(100 * (self.sampler.cpu_seconds + self.snapshot_seconds) / wall, 3)
+                             if wall else 0.0),
+        }
+
+        run_dir = get_data_dir('runs', self.run_id)
+        with open(run_dir / 'profile.json', 'w', encoding='utf-8') as f:
+            json.dump(profile, f, indent=2)
+        with open(run_dir / 'profile.folded', 'w', encoding='utf-8') as f:
+            f.write(self.sampler.folded())
+        return profile
+
+
+def activate_profiler(profiler):
+    """Make stage() calls in the current context (and tasks it spawns) record into this profiler"""
+    _current_profiler.set(profiler)
+
+
+@contextmanager
+def profile_stage(name):
+    """Record a pipeline stage in the active run profiler; a no-op when profiling is off"""
+    profiler = _current_profiler.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name):
+        yield
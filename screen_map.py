@@ -0,0 +1,283 @@
+"""
+Per-app screen/transition maps for warm-start exploration
+
+Completed runs are parsed into a map of screens (depth, path, content
+fingerprint) and transitions, stored per app under data/apps/<slug>/. When the
+same app is tested again the map is handed to the agent as a prioritized
+frontier, so known screens are only verified and the step budget goes to new or
+changed areas.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from utils import get_data_dir, load_and_format_prompt, slugify
+
+
+# Warm-start new runs from the stored map (set WARM_START=0 to always run cold)
+WARM_START = os.getenv("WARM_START", "1") != "0"
+
+# Runs kept in the per-app history
+HISTORY_LIMIT = 20
+# Screens and transitions kept per app (the most recently and most often seen)
+SCREEN_LIMIT = 200
+TRANSITION_LIMIT = 400
+# Screens listed in the warm-start goal, known and frontier (the most often seen)
+WARM_START_SCREENS = 40
+WARM_START_FRONTIER = 15
+
+HEADING = re.compile(r'^(#{2,6})\s+(.+?)\s*$')
+SCREEN_FIELD = re.compile(r'^\s*[-*]?\s*\**\s*screen(?:\s*name)?\s*\**\s*[:\-–]\s*\**\s*(.+?)\s*\**\s*$', re.IGNORECASE)
+DEPTH_FIELD = re.compile(r'\bdepth\b[^:\d\n]{0,20}[:\-–]?\s*\**\s*(\d+)', re.IGNORECASE)
+PATH_FIELD = re.compile(r'^\s*[-*]?\s*\**\s*(?:navigation\s*)?path\s*\**\s*[:\-–]\s*\**\s*(.+?)\s*$', re.IGNORECASE)
+TRANSITION = re.compile(
+    r'([A-Z][\w &/\'-]{1,40}?)\s*(?:→|->|=>)\s*([A-Z][\w &/\'-]{1,40}?)\s*(?:[(:\-–]\s*(.+?)\)?)?\s*$'
+)
+SCREEN_MAP_SECTION = re.compile(r'screen[- ]by[- ]screen|navigation map|screen map|screens\s*$', re.IGNORECASE)
+
+
+def _clean_name(text):
+    text = re.sub(r'[*`_]+', '', text).strip()
+    text = re.sub(r'^(?:\d+[.)]\s*)?(?:screen\s*\d*\s*[:\-–.]\s*)?', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\s+screen$', '', text, flags=re.IGNORECASE)
+    return text.strip(' :-–')
+
+
+def fingerprint(text):
+    """Content hash of a screen description, insensitive to whitespace and case"""
+    normalized = re.sub(r'\s+', ' ', text).strip().lower()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def split_screens(report_content):
+    """Split a report into per-screen sections
+
+    Screens are recognized from markdown headings that name a screen (or sit under
+    a screen-by-screen / navigation map section) and from 'Screen: X' fields.
+
+    Returns:
+        list: dicts with name, depth, path and body (the screen's description)
+    """
+    screens = []
+    current = None
+    map_level = None
+
+    def close():
+        if current is not None and current['name']:
+            current['body'] = '\n'.join(current['lines']).strip()
+            del current['lines']
+            screens.append(current)
+
+    for line in report_content.splitlines():
+        heading = HEADING.match(line)
+        if heading:
+            level, text = len(heading.group(1)), heading.group(2)
+            if map_level is not None and level <= map_level:
+                map_level = None
+            if SCREEN_MAP_SECTION.search(text):
+                close()
+                current = None
+                map_level = level
+                continue
+            if 'screen' in text.lower() or map_level is not None:
+                close()
+                current = {'name': _clean_name(text), 'depth': None, 'path': None, 'lines': []}
+                continue
+            close()
+            current = None
+            continue
+
+        field = SCREEN_FIELD.match(line)
+        if field:
+            name = _clean_name(field.group(1))
+            if current is not None and not current['lines']:
+                current['name'] = name
+            else:
+                close()
+                current = {'name': name, 'depth': None, 'path': None, 'lines': []}
+            continue
+
+        if current is None:
+            continue
+        current['lines'].append(line)
+        if current['depth'] is None:
+            depth = DEPTH_FIELD.search(line)
+            if depth:
+                current['depth'] = int(depth.group(1))
+        if current['path'] is None:
+            path = PATH_FIELD.match(line)
+            if path:
+                current['path'] = path.group(1).strip('* ')
+    close()
+
+    # Merge repeated descriptions of the same screen
+    merged = {}
+    for screen in screens:
+        known = merged.get(screen['name'].lower())
+        if known is None:
+            merged[screen['name'].lower()] = screen
+        else:
+            known['body'] = f"{known['body']}\n{screen['body']}".strip()
+            known['depth'] = known['depth'] if known['depth'] is not None else screen['depth']
+            known['path'] = known['path'] or screen['path']
+    return list(merged.values())
+
+
+def extract_transitions(report_content, screens=()):
+    """Find 'A → B (action)' transitions and consecutive steps of 'A > B > C' paths"""
+    transitions = []
+    for line in report_content.splitlines():
+        text = re.sub(r'[*`]+', '', line).strip(' -')
+        match = TRANSITION.search(text)
+        if match:
+            transitions.append((match.group(1).strip(), match.group(2).strip(), (match.group(3) or '').strip()))
+    for screen in screens:
+        steps = [step.strip() for step in re.split(r'\s*>\s*', screen.get('path') or '') if step.strip()]
+        for source, target in zip(steps, steps[1:]):
+            transitions.append((source, target, ''))
+    return transitions
+
+
+class ScreenMapStore:
+    """Stored screen/transition map for one app"""
+
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.path = get_data_dir('apps', slugify(app_name)) / 'screen_map.json'
+
+    def load(self):
+        """Return the stored map, or None if the app has not been explored yet"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Warning: could not read screen map {self.path}: {str(e)}")
+            return None
+
+    def save(self, screen_map):
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(screen_map, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def update(self, report_content, category, steps=None, tokens=None, warm=False):
+        """Merge a completed run into the map and compare it with the cold baseline
+
+        Args:
+            report_content: The run's agent_result.txt content
+            category: App category
+            steps: Agent steps used by the run
+            tokens: Tokens used by the exploration
+            warm: Whether the run was warm-started from this map
+
+        Returns:
+            dict: Run record with new/changed screen counts and, for warm runs,
+                  steps_saved / tokens_saved against the cold baseline
+        """
+        now = datetime.now().isoformat(timespec='seconds')
+        screen_map = self.load() or {
+            'app': self.app_name, 'category': category, 'runs': 0,
+            'screens': {}, 'transitions': [], 'cold_baseline': None, 'history': [],
+        }
+
+        screens = split_screens(report_content)
+        new_screens, changed_screens = [], []
+        for screen in screens:
+            digest = fingerprint(screen['body'])
+            known = screen_map['screens'].get(screen['name'])
+            if known is None:
+                new_screens.append(screen['name'])
+                known = screen_map['screens'][screen['name']] = {'first_seen': now, 'times_seen': 0}
+            elif known.get('fingerprint') != digest:
+                changed_screens.append(screen['name'])
+            known.update(fingerprint=digest, last_seen=now, times_seen=known['times_seen'] + 1)
+            if screen['depth'] is not None:
+                known['depth'] = screen['depth']
+            if screen['path']:
+                known['path'] = screen['path']
+
+        known_transitions = {(t['from'], t['to']): t for t in screen_map['transitions']}
+        for source, target, action in extract_transitions(report_content, screens):
+            transition = known_transitions.get((source, target))
+            if transition is None:
+                transition = known_transitions[(source, target)] = {'from': source, 'to': target, 'action': action, 'times_seen': 0}
+                screen_map['transitions'].append(transition)
+            transition['times_seen'] += 1
+            transition['action'] = transition['action'] or action
+
+        record = {
+            'timestamp': now, 'warm': warm, 'steps': steps, 'tokens': tokens,
+            'screens': len(screens), 'new_screens': len(new_screens), 'changed_screens': len(changed_screens),
+        }
+        baseline = screen_map.get('cold_baseline')
+        if warm and baseline:
+            if steps is not None and baseline.get('steps') is not None:
+                record['steps_saved'] = baseline['steps'] - steps
+            if tokens is not None and baseline.get('tokens') is not None:
+                record['tokens_saved'] = baseline['tokens'] - tokens
+        elif not warm:
+            screen_map['cold_baseline'] = {'timestamp': now, 'steps': steps, 'tokens': tokens}
+
+        self._prune(screen_map)
+        screen_map['category'] = category
+        screen_map['runs'] += 1
+        screen_map['updated_at'] = now
+        screen_map['history'] = (screen_map['history'] + [record])[-HISTORY_LIMIT:]
+        self.save(screen_map)
+        return record
+
+    @staticmethod
+    def _prune(screen_map):
+        """Keep the map bounded: drop the screens and transitions seen least recently and least often"""
+        screens = screen_map['screens']
+        if len(screens) > SCREEN_LIMIT:
+            kept = sorted(screens.items(), key=lambda item: (item[1].get('last_seen') or '', item[1]['times_seen']),
+                          reverse=True)[:SCREEN_LIMIT]
+            screen_map['screens'] = dict(kept)
+        if len(screen_map['transitions']) > TRANSITION_LIMIT:
+            screen_map['transitions'] = sorted(screen_map['transitions'], key=lambda t: -t['times_seen'])[:TRANSITION_LIMIT]
+
+
+def build_warm_start_goal(screen_map, max_depth):
+    """Agent goal section that turns a stored map into a prioritized frontier
+
+    Known screens are listed shallowest first for quick verification; screens
+    with no recorded outgoing transitions (below max depth) form the frontier
+    the agent should expand first. Only the WARM_START_SCREENS most often seen
+    screens (and WARM_START_FRONTIER frontier screens) are listed, so the goal
+    stays the same size however often the app is explored.
+    """
+    def by_visits(item):
+        return (-item[1].get('times_seen', 0), item[0])
+
+    def by_depth(item):
+        return (item[1].get('depth') if item[1].get('depth') is not None else max_depth, item[0])
+
+    all_screens = sorted(screen_map['screens'].items(), key=by_visits)
+    screens = sorted(all_screens[:WARM_START_SCREENS], key=by_depth)
+    sources = {t['from'] for t in screen_map['transitions']}
+    frontier = [
+        name for name, info in all_screens
+        if name not in sources and (info.get('depth') is None or info['depth'] < max_depth)
+    ][:WARM_START_FRONTIER]
+
+    def describe(name, info):
+        parts = [f"depth {info['depth']}" if info.get('depth') is not None else None,
+                 f"path: {info['path']}" if info.get('path') else None]
+        details = ', '.join(part for part in parts if part)
+        return f"- {name} ({details})" if details else f"- {name}"
+
+    known_screens = '\n'.join(describe(name, info) for name, info in screens)
+    if len(all_screens) > len(screens):
+        known_screens += f"\n- ... and {len(all_screens) - len(screens)} less visited screens"
+
+    return load_and_format_prompt(
+        'warm_start_prompt',
+        runs=screen_map['runs'],
+        screen_count=len(all_screens),
+        known_screens=known_screens,
+        frontier='\n'.join(f"- {name}" for name in frontier) or '- (none recorded - look for unexplored entry points)'
+    )
@@ -0,0 +1,90 @@
+"""
+Startup benchmark for DroidScope
+
+Measures, in fresh interpreters, how long the server and the heavy stacks take
+to import and how long it takes until /healthz answers. Run before and after
+changes that touch module-level imports:
+
+    python startup_benchmark.py [--runs 5] [--top 10]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+# Modules timed in isolation: the server, its entry points and the heavy stacks it avoids
+MODULES = [
+    'app',
+    'verify_setup',
+    'exploration_runner',
+    'ux_analyzer',
+    'llama_index.llms.openai_like',
+    'droidrun',
+]
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+
+HEALTHZ_SNIPPET = """
+import time
+t = time.perf_counter()
+from app import app
+response = app.test_client().get('/healthz')
+assert response.status_code == 200
+print(time.perf_counter() - t)
+"""
+
+
+def time_snippet(snippet, runs):
+    """Run a snippet in fresh interpreters and return its printed timings (seconds)"""
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', snippet], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed'
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings, None
+
+
+def slowest_imports(module, top):
+    """Parse -X importtime output for a module and return its slowest cumulative imports"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((int(cumulative_us), name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure DroidScope import and startup time")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument('--top', type=int, default=10, help="Slowest imports of app to list (0 to skip)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"DroidScope Startup Benchmark ({args.runs} runs each)")
+    print("=" * 60)
+    print(f"{'Measurement':<40} {'median':>8} {'min':>8}")
+    print("-" * 60)
+
+    measurements = [(f"import {module}", IMPORT_SNIPPET.format(module=module)) for module in MODULES]
+    measurements.append(("import app + first /healthz", HEALTHZ_SNIPPET))
+    for label, snippet in measurements:
+        timings, error = time_snippet(snippet, args.runs)
+        if timings is None:
+            print(f"{label:<40} {'n/a':>8} {'n/a':>8}  ({error})")
+        else:
+            print(f"{label:<40} {statistics.median(timings):>7.3f}s {min(timings):>7.3f}s")
+
+    if args.top:
+        print("\nSlowest imports when starting app (cumulative):")
+        for cumulative_us, name in slowest_imports('app', args.top):
+            print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,42 +3,155 @@ document.getElementById('maxDepth').addEventListener('input', function(e) {
     document.getElementById('depthValue').textContent = e.target.value;
 });
 
+// Terminal log viewer. Lines are kept in a capped in-memory buffer and only
+// the rows in view are rendered, so hour-long runs stay responsive; the full
+// log can be downloaded from the run's artifacts.
+const LOG_BUFFER_LIMIT = 5000;
+const LOG_ROW_HEIGHT = 22;  // px, matches .log-entry
+const LOG_OVERSCAN = 10;
+
+const terminal = {
+    lines: [],
+    dropped: 0,
+    query: '',
+    followTail: true,
+    renderScheduled: false
+};
+
+let logStartTime = null;
+let currentRunId = null;
+
 // Clear logs function
 function clearLogs() {
-    const terminalOutput = document.getElementById('terminalOutput');
-    terminalOutput.innerHTML = '<div class="log-entry log-info"><span class="log-timestamp">[00:00:00]</span><span class="log-message">Logs cleared</span></div>';
+    terminal.lines = [];
+    terminal.dropped = 0;
+    terminal.followTail = true;
+    terminal.lines.push({ timestamp: '[00:00:00]', message: 'Logs cleared', type: 'info' });
+    scheduleTerminalRender();
 }
 
-// Append log to terminal
-let logStartTime = null;
-
-function appendLog(message, type = 'info') {
+function formatElapsed() {
     if (!logStartTime) {
         logStartTime = Date.now();
     }
-    
-    const terminalOutput = document.getElementById('terminalOutput');
-    const elapsed = Date.now() - logStartTime;
-    const seconds = Math.floor(elapsed / 1000);
+    const seconds = Math.floor((Date.now() - logStartTime) / 1000);
     const minutes = Math.floor(seconds / 60);
     const hours = Math.floor(minutes / 60);
-    
-    const timestamp = `[${String(hours).padStart(2, '0')}:${String(minutes % 60).padStart(2, '0')}:${String(seconds % 60).padStart(2, '0')}]`;
-    
-    // Handle multi-line messages - split and display each line with same timestamp
-    const lines = message.split('\n');
-    lines.forEach(line => {
+    return `[${String(hours).padStart(2, '0')}:${String(minutes % 60).padStart(2, '0')}:${String(seconds % 60).padStart(2, '0')}]`;
+}
+
+// Add a message to the buffer without rendering
+function bufferLog(message, type = 'info') {
+    const timestamp = formatElapsed();
+    // Handle multi-line messages - each line gets the same timestamp
+    String(message).split('\n').forEach(line => {
         if (line.trim()) {  // Only display non-empty lines
-            const logEntry = document.createElement('div');
-            logEntry.className = `log-entry log-${type}`;
-            logEntry.innerHTML = `<span class="log-timestamp">${timestamp}</span><span class="log-message">${line}</span>`;
-            terminalOutput.appendChild(logEntry);
+            terminal.lines.push({ timestamp, message: line, type });
         }
     });
-    
-    terminalOutput.scrollTop = terminalOutput.scrollHeight;
+    // Trim in chunks so the buffer is not shifted on every line
+    const overflow = terminal.lines.length - LOG_BUFFER_LIMIT;
+    if (overflow > LOG_BUFFER_LIMIT / 10) {
+        terminal.lines.splice(0, overflow);
+        terminal.dropped += overflow;
+    }
+}
+
+// Append log to terminal
+function appendLog(message, type = 'info') {
+    bufferLog(message, type);
+    scheduleTerminalRender();
+}
+
+function scheduleTerminalRender() {
+    if (terminal.renderScheduled) return;
+    terminal.renderScheduled = true;
+    requestAnimationFrame(() => {
+        terminal.renderScheduled = false;
+        renderTerminal();
+    });
+}
+
+function createLogRow(line) {
+    const row = document.createElement('div');
+    row.className = `log-entry log-${line.type}`;
+    const timestamp = document.createElement('span');
+    timestamp.className = 'log-timestamp';
+    timestamp.textContent = line.timestamp;
+    const message = document.createElement('span');
+    message.className = 'log-message';
+    const matchAt = terminal.query ? line.message.toLowerCase().indexOf(terminal.query) : -1;
+    if (matchAt >= 0) {
+        const mark = document.createElement('mark');
+        mark.textContent = line.message.slice(matchAt, matchAt + terminal.query.length);
+        message.append(line.message.slice(0, matchAt), mark, line.message.slice(matchAt + terminal.query.length));
+    } else {
+        message.textContent = line.message;
+    }
+    row.append(timestamp, message);
+    return row;
+}
+
+// Render only the rows inside the viewport (plus a small overscan)
+function renderTerminal() {
+    const viewport = document.getElementById('terminalOutput');
+    const lines = terminal.query
+        ? terminal.lines.filter(line => line.message.toLowerCase().includes(terminal.query))
+        : terminal.lines;
+
+    document.getElementById('terminalSpacer').style.height = `${lines.length * LOG_ROW_HEIGHT}px`;
+    if (terminal.followTail) {
+        viewport.scrollTop = viewport.scrollHeight;
+    }
+
+    const first = Math.max(0, Math.floor(viewport.scrollTop / LOG_ROW_HEIGHT) - LOG_OVERSCAN);
+    const last = Math.min(lines.length, Math.ceil((viewport.scrollTop + viewport.clientHeight) / LOG_ROW_HEIGHT) + LOG_OVERSCAN);
+    const rows = document.getElementById('terminalRows');
+    rows.style.transform = `translateY(${first * LOG_ROW_HEIGHT}px)`;
+    const fragment = document.createDocumentFragment();
+    for (let i = first; i < last; i++) {
+        fragment.appendChild(createLogRow(lines[i]));
+    }
+    rows.replaceChildren(fragment);
+
+    let status = terminal.query
+        ? `${lines.length.toLocaleString()} of ${terminal.lines.length.toLocaleString()} lines match`
+        : `${terminal.lines.length.toLocaleString()} lines`;
+    if (terminal.dropped) {
+        status += ` (${terminal.dropped.toLocaleString()} earlier lines only in the downloaded log)`;
+    }
+    document.getElementById('logStatus').textContent = status;
+}
+
+// Show the full-log download link for a run
+function setLogDownload(runId) {
+    const link = document.getElementById('downloadLogLink');
+    if (runId) {
+        link.href = `/api/runs/${encodeURIComponent(runId)}/log`;
+        link.classList.remove('hidden');
+    } else {
+        link.removeAttribute('href');
+        link.classList.add('hidden');
+    }
 }
 
+document.getElementById('terminalOutput').addEventListener('scroll', function(e) {
+    const viewport = e.target;
+    // Keep following new lines only while scrolled to the bottom
+    terminal.followTail = viewport.scrollTop + viewport.clientHeight >= viewport.scrollHeight - LOG_ROW_HEIGHT;
+    scheduleTerminalRender();
+});
+
+document.getElementById('logSearch').addEventListener('input', function(e) {
+    terminal.query = e.target.value.trim().toLowerCase();
+    terminal.followTail = !terminal.query;
+    document.getElementById('terminalOutput').scrollTop = 0;
+    scheduleTerminalRender();
+});
+
+appendLog('Waiting for test to start...', 'info');
+logStartTime = null;
+
 // Start test
 async function startTest() {
     const appName = document.getElementById('appName').value.trim();
@@ -87,6 +200,8 @@ async function startTest() {
         const data = await response.json();
         console.log('Test started:', data);
         appendLog(`Test initiated for ${appName}`, 'success');
+        currentRunId = data.run_id;
+        setLogDownload(data.run_id);
         
         // Listen for progress updates and logs
         listenForProgress();
@@ -110,8 +225,10 @@ function listenForLogs() {
         // Skip keepalive messages
         if (data.keepalive) return;
         
-        // Display log message
-        appendLog(data.message, data.type || 'info');
+        // The server coalesces log events into batches; render once per batch
+        const logs = data.batch || [data];
+        logs.forEach(log => bufferLog(log.message, log.type || 'info'));
+        scheduleTerminalRender();
     };
     
     logSource.onerror = function(error) {
@@ -166,7 +283,7 @@ function updateProgress(message, percentage) {
 // Load and display results
 async function loadResults() {
     try {
-        const response = await fetch('/api/results');
+        const response = await fetch(resultsUrl());
         const data = await response.json();
         
         if (data.error) {
@@ -183,7 +300,7 @@ async function loadResults() {
         displaySummary(data.summary);
         displayMetrics(data); // Pass entire data object with nested metrics
         displayPositive(data.positive);
-        displayIssues(data.issues);
+        displayIssues(data.issues, data.run_id);
         displayRecommendations(data.recommendations || data.suggestions); // Handle both old and new field names
         
     } catch (error) {
@@ -372,8 +489,28 @@ function displayMetrics(data) {
     document.getElementById('additionalStats').innerHTML = additionalStatsHtml;
 }
 
+// Screenshot thumbnails for evidence IDs (loaded lazily, cached by the browser)
+function renderEvidence(evidence, runId) {
+    const screenshots = (evidence || []).filter(id => id.startsWith('img-'));
+    if (!runId || screenshots.length === 0) {
+        return '';
+    }
+    return `
+        <div class="result-card-evidence">
+            ${screenshots.map(id => {
+                const url = `/api/runs/${encodeURIComponent(runId)}/evidence/${encodeURIComponent(id)}`;
+                return `
+                <a href="${url}" target="_blank">
+                    <img src="${url}" loading="lazy" decoding="async" alt="Evidence screenshot">
+                </a>
+            `;
+            }).join('')}
+        </div>
+    `;
+}
+
 // Display issues
-function displayIssues(issues) {
+function displayIssues(issues, runId) {
     const issuesContent = document.getElementById('issuesContent');
     
     if (!issues || issues.length === 0) {
@@ -475,6 +612,7 @@ function displayIssues(issues) {
                         ${issue.effort ? `<div class="result-card-meta-item"><strong>Effort to Fix:</strong> ${issue.effort}</div>` : ''}
                     </div>
                 ` : ''}
+                ${renderEvidence(issue.evidence, runId)}
             </div>
         `;
     }).join('');
@@ -523,9 +661,14 @@ function displayRecommendations(recommendations) {
     suggestionsContent.innerHTML = html;
 }
 
+// Results of the run started from this page (the latest run otherwise)
+function resultsUrl() {
+    return currentRunId ? `/api/results?run_id=${encodeURIComponent(currentRunId)}` : '/api/results';
+}
+
 // Download report
 function downloadReport() {
-    fetch('/api/results')
+    fetch(resultsUrl())
         .then(res => res.json())
         .then(data => {
             const blob = new Blob([JSON.stringify(data, null, 2)], { type: 'application/json' });
@@ -587,4 +730,6 @@ function resetTest() {
     // Reset logs
     logStartTime = null;
     clearLogs();
+    currentRunId = null;
+    setLogDownload(null);
 }
@@ -0,0 +1,47 @@
+"""
+Tests for cross-run issue clustering (run with: python -m pytest tests)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import issue_clusters
+from issue_clusters import IssueClusterIndex, minhash, normalize
+
+
+def test_paraphrased_issues_share_a_cluster(tmp_path, monkeypatch):
+    monkeypatch.setenv('DROIDSCOPE_DATA_DIR', str(tmp_path))
+    index = IssueClusterIndex()
+    first = index.add_issue({'description': "Unclear error message on login"}, 'run-1', 0, {})
+    second = index.add_issue({'description': "Login error message is unclear and vague"}, 'run-2', 0, {})
+    other = index.add_issue({'description': "Checkout button hidden below the fold"}, 'run-2', 1, {})
+    assert first == second
+    assert other != first
+
+
+def test_minhash_estimates_jaccard_similarity():
+    words = [f"word{i}" for i in range(30)]
+    a, b = set(words[:20]), set(words[10:])
+    # True Jaccard similarity is 10/30; 64 permutations estimate it within a few standard errors
+    estimate = (minhash(a) == minhash(b)).mean()
+    assert abs(estimate - 1 / 3) < 0.2
+    assert (minhash(a) == minhash(set(a))).all()
+
+
+def test_mulmod_matches_integer_arithmetic():
+    prime = issue_clusters._MERSENNE_PRIME
+    rng = np.random.default_rng(7)
+    a = rng.integers(0, prime, size=1000, dtype=np.uint64)
+    x = rng.integers(0, prime, size=1000, dtype=np.uint64)
+    a[0] = x[0] = prime - 1
+    result = issue_clusters._mulmod(a, x)
+    assert [int(value) for value in result] == [int(i) * int(j) % prime for i, j in zip(a, x)]
+
+
+def test_bands_reach_recall_at_threshold():
+    rows, bands = issue_clusters.CLUSTER_BAND_ROWS, issue_clusters.CLUSTER_BANDS
+    similarity = issue_clusters.CLUSTER_SIMILARITY
+    assert 1 - (1 - similarity ** rows) ** bands >= issue_clusters.CLUSTER_RECALL
+    assert normalize("Login error message is unclear and vague") >= normalize("Unclear error message on login")
@@ -1,7 +1,40 @@
 """Utility functions for DroidRun UX Explorer"""
+import contextvars
 import os
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 
+# Set while DroidScope itself (not the agent) prints, see runner_output()
+_runner_output = contextvars.ContextVar('droidscope_runner_output', default=False)
+
+
+@contextmanager
+def runner_output():
+    """Mark output printed in this context (and tasks/threads started in it) as DroidScope's own
+
+    The exploration tee keeps marked output out of the agent transcript that
+    pipelined analysis and partial results read.
+    """
+    token = _runner_output.set(True)
+    try:
+        yield
+    finally:
+        _runner_output.reset(token)
+
+
+def is_runner_output():
+    """True if output printed now is DroidScope's own rather than the agent's"""
+    return _runner_output.get()
+
+
+def runner_print(*args, **kwargs):
+    """print() marked as DroidScope's own output"""
+    with runner_output():
+        print(*args, **kwargs)
+
 
 def get_project_root():
     """Get the project root directory"""
@@ -59,3 +92,44 @@ def load_and_format_prompt(prompt_name, **kwargs):
     """
     template = load_prompt(prompt_name)
     return format_prompt(template, **kwargs)
+
+
+def get_data_dir(*parts):
+    """Get a directory under the persistent data folder, creating it if needed
+    
+    Args:
+        *parts: Sub-directory names below the data folder
+    
+    Returns:
+        Path: Directory path (DROIDSCOPE_DATA_DIR or <project root>/data)
+    """
+    root = Path(os.getenv('DROIDSCOPE_DATA_DIR') or get_project_root() / 'data')
+    path = root.joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def slugify(name):
+    """Turn an app name into a filesystem-safe identifier
+    
+    Args:
+        name: App display name
+    
+    Returns:
+        str: Lowercase slug such as 'google-maps'
+    """
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-') or 'app'
+
+
+def new_run_id():
+    """Create a sortable, unique run identifier
+    
+    Returns:
+        str: ID such as '20250101-120000-a1b2c3'
+    """
+    return f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def is_valid_run_id(run_id):
+    """Check that a run ID from a request is safe to use in a path"""
+    return bool(re.fullmatch(r'[\w-]{1,64}', run_id or ''))
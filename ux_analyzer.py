@@ -1,27 +1,172 @@
 import os
 import json
 from datetime import datetime
-from llama_index.llms.openai_like import OpenAILike
+from pathlib import Path
 from dotenv import load_dotenv
-from utils import load_and_format_prompt
+from budget import install_usage_tracking
+from model_router import ModelRouter
+from report_compactor import compact_report
+from run_profiler import profile_stage
+from utils import get_data_dir, load_and_format_prompt
 
 load_dotenv()
 
+# Compact reports before analysis (set REPORT_COMPACTION=0 to send the raw report)
+REPORT_COMPACTION = os.getenv("REPORT_COMPACTION", "1") != "0"
+# Additionally summarize long sections that carry no metrics (costs extra LLM calls)
+REPORT_SUMMARIZE_SECTIONS = os.getenv("REPORT_SUMMARIZE_SECTIONS", "0") == "1"
+
+
+def strip_code_fences(text, language='json'):
+    """Remove markdown code blocks if present"""
+    text = text.strip()
+    if text.startswith(f"```{language}"):
+        return text.split(f"```{language}")[1].split("```")[0].strip()
+    if text.startswith("```"):
+        return text.split("```")[1].split("```")[0].strip()
+    return text
+
+
+def apply_analysis_defaults(analysis_json):
+    """Ensure all required fields exist with comprehensive defaults to prevent undefined errors"""
+    if 'summary' not in analysis_json:
+        analysis_json['summary'] = 'UX analysis completed.'
+    if 'positive' not in analysis_json:
+        analysis_json['positive'] = []
+    if 'issues' not in analysis_json:
+        analysis_json['issues'] = []
+    if 'recommendations' not in analysis_json:
+        analysis_json['recommendations'] = []
+    
+    # App metadata with all nested properties
+    if 'app_metadata' not in analysis_json:
+        analysis_json['app_metadata'] = {}
+    analysis_json['app_metadata'].setdefault('screens_discovered', 0)
+    analysis_json['app_metadata'].setdefault('total_interactions', 0)
+    analysis_json['app_metadata'].setdefault('core_flows', [])
+    
+    # Exploration coverage with all nested properties
+    if 'exploration_coverage' not in analysis_json:
+        analysis_json['exploration_coverage'] = {}
+    analysis_json['exploration_coverage'].setdefault('screens_discovered', 0)
+    analysis_json['exploration_coverage'].setdefault('clickable_elements_found', 0)
+    analysis_json['exploration_coverage'].setdefault('successful_actions_pct', 0)
+    analysis_json['exploration_coverage'].setdefault('dead_elements_pct', 0)
+    analysis_json['exploration_coverage'].setdefault('navigation_loops_detected', False)
+    
+    # Navigation metrics with all nested properties
+    if 'navigation_metrics' not in analysis_json:
+        analysis_json['navigation_metrics'] = {}
+    analysis_json['navigation_metrics'].setdefault('avg_depth', 0)
+    analysis_json['navigation_metrics'].setdefault('max_depth', 0)
+    analysis_json['navigation_metrics'].setdefault('backtracking_frequency', 'low')
+    analysis_json['navigation_metrics'].setdefault('orphan_screens', 0)
+    analysis_json['navigation_metrics'].setdefault('label_action_match_score', 5)
+    analysis_json['navigation_metrics'].setdefault('hub_screen_count', 0)
+    analysis_json['navigation_metrics'].setdefault('architecture_quality', 'moderate')
+    
+    # Interaction feedback with all nested properties
+    if 'interaction_feedback' not in analysis_json:
+        analysis_json['interaction_feedback'] = {}
+    analysis_json['interaction_feedback'].setdefault('visible_feedback_rate_pct', 0)
+    analysis_json['interaction_feedback'].setdefault('loading_state_presence_pct', 0)
+    analysis_json['interaction_feedback'].setdefault('error_message_clarity', 5)
+    analysis_json['interaction_feedback'].setdefault('silent_failures', 0)
+    analysis_json['interaction_feedback'].setdefault('feedback_quality', 'moderate')
+    
+    # Visual hierarchy with all nested properties
+    if 'visual_hierarchy' not in analysis_json:
+        analysis_json['visual_hierarchy'] = {}
+    analysis_json['visual_hierarchy'].setdefault('cta_visibility', 5)
+    analysis_json['visual_hierarchy'].setdefault('tap_target_compliance_pct', 0)
+    analysis_json['visual_hierarchy'].setdefault('icon_label_clarity', 5)
+    analysis_json['visual_hierarchy'].setdefault('hierarchy_issues', 0)
+    analysis_json['visual_hierarchy'].setdefault('clarity_rating', 'moderate')
+    
+    # Consistency with all nested properties
+    if 'consistency' not in analysis_json:
+        analysis_json['consistency'] = {}
+    analysis_json['consistency'].setdefault('reused_patterns', [])
+    analysis_json['consistency'].setdefault('inconsistent_labels', 0)
+    analysis_json['consistency'].setdefault('action_placement_variance', 'low')
+    analysis_json['consistency'].setdefault('pattern_violations', 0)
+    
+    # Error handling with all nested properties
+    if 'error_handling' not in analysis_json:
+        analysis_json['error_handling'] = {}
+    analysis_json['error_handling'].setdefault('preventable_errors', 0)
+    analysis_json['error_handling'].setdefault('recovery_paths_available', False)
+    analysis_json['error_handling'].setdefault('error_explanation_quality', 5)
+    analysis_json['error_handling'].setdefault('handling_rating', 'moderate')
+    
+    # UX confidence score with all nested properties
+    if 'ux_confidence_score' not in analysis_json:
+        analysis_json['ux_confidence_score'] = {}
+    analysis_json['ux_confidence_score'].setdefault('score', 5)
+    if 'factors' not in analysis_json['ux_confidence_score']:
+        analysis_json['ux_confidence_score']['factors'] = {}
+    analysis_json['ux_confidence_score']['factors'].setdefault('exploration_coverage', 5)
+    analysis_json['ux_confidence_score']['factors'].setdefault('interaction_consistency', 5)
+    analysis_json['ux_confidence_score']['factors'].setdefault('feedback_reliability', 5)
+    analysis_json['ux_confidence_score']['factors'].setdefault('recovery_robustness', 5)
+    
+    # Complexity score
+    if 'complexity_score' not in analysis_json:
+        analysis_json['complexity_score'] = 5
+    
+    return analysis_json
+
+
+def run_output_path(run_id, filename):
+    """Path of a run's output file: data/runs/<run_id>/<filename>, or the working directory without a run_id"""
+    if run_id:
+        return get_data_dir('runs', run_id) / filename
+    return Path(filename)
+
+
+def save_run_analysis(run_id, analysis_data, **metadata):
+    """Keep a run's analysis and metadata (app, category, mode) in data/runs/<run_id>/
+
+    Both files are replaced atomically and run.json is written last, so a run
+    with a complete run.json (with completed_at) is finished.
+    """
+    run_dir = get_data_dir('runs', run_id)
+    metadata = dict(metadata, run_id=run_id, completed_at=datetime.now().isoformat(timespec='seconds'))
+    for name, data in (('ux_analysis_blocks.json', analysis_data), ('run.json', metadata)):
+        tmp_path = run_dir / (name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, run_dir / name)
+
 
 class UXAnalyzer:
     def __init__(self, api_key=None):
         """Initialize the UX Analyzer with OpenRouter LLM"""
         self.api_key = api_key or os.getenv("API_KEY")
-        model = os.getenv("LLM_MODEL", "mistralai/devstral-2512:free")
-        api_base = os.getenv("LLM_API_BASE", "https://openrouter.ai/api/v1")
         
-        # Use a free model from OpenRouter for analysis
-        self.llm = OpenAILike(
-            model=model,
-            api_base=api_base,
-            api_key=self.api_key,
-            temperature=0.3
-        )
+        # Models are picked per stage (analysis, json_repair, html) with failover
+        self.router = ModelRouter(api_key=self.api_key)
+        install_usage_tracking()
+    
+    def complete(self, stage, prompt, temperature=0.3):
+        """Run a completion on the model routed for this stage"""
+        return self.router.complete(stage, prompt, temperature=temperature)
+    
+    def repair_json(self, broken_json):
+        """Ask the JSON repair model to turn a malformed response into valid JSON"""
+        repair_prompt = load_and_format_prompt('json_repair_prompt', broken_json=broken_json)
+        print("🔧 Repairing malformed JSON response...")
+        return strip_code_fences(self.complete('json_repair', repair_prompt, temperature=0.0))
+    
+    def parse_json_response(self, response_text):
+        """Parse an LLM JSON response, falling back to the repair model once"""
+        analysis_text = strip_code_fences(response_text)
+        try:
+            return json.loads(analysis_text)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON response: {str(e)}")
+            print(f"Raw response: {analysis_text[:500]}")
+            return json.loads(self.repair_json(analysis_text))
     
     def read_report(self, report_path="agent_result.txt"):
         """Read the generated UX exploration report"""
@@ -39,6 +184,22 @@ class UXAnalyzer:
             print(f"Error reading report: {str(e)}")
             return None
     
+    def compact(self, report_content, log=print):
+        """Shrink the report before analysis, logging before/after token counts"""
+        if not REPORT_COMPACTION:
+            return report_content
+        
+        summarize = None
+        if REPORT_SUMMARIZE_SECTIONS:
+            summarize = lambda section: self.complete(
+                'summary', load_and_format_prompt('section_summary_prompt', section=section), temperature=0.0
+            )
+        
+        compacted, stats = compact_report(report_content, summarize=summarize)
+        log(f"Report compacted: {stats['original_tokens']} → {stats['compacted_tokens']} tokens "
+            f"(-{stats['saved_pct']}%, {stats['key_facts']} key metrics preserved)")
+        return compacted
+    
     def analyze_ux(self, report_content):
         """Send report to LLM for UX analysis"""
         # Load analysis prompt from prompts folder
@@ -46,21 +207,11 @@ class UXAnalyzer:
 
         try:
             print("🔄 Analyzing UX with LLM...")
-            response = self.llm.complete(analysis_prompt)
-            analysis_text = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if analysis_text.startswith("```json"):
-                analysis_text = analysis_text.split("```json")[1].split("```")[0].strip()
-            elif analysis_text.startswith("```"):
-                analysis_text = analysis_text.split("```")[1].split("```")[0].strip()
-            
-            analysis_json = json.loads(analysis_text)
+            analysis_json = self.parse_json_response(self.complete('analysis', analysis_prompt))
             print("✓ UX analysis completed")
             return analysis_json
         except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response: {str(e)}")
-            print(f"Raw response: {analysis_text[:500]}")
+            print(f"Error parsing repaired JSON response: {str(e)}")
             return None
         except Exception as e:
             print(f"Error during analysis: {str(e)}")
@@ -77,14 +228,7 @@ class UXAnalyzer:
 
         try:
             print("🔄 Generating HTML report with LLM...")
-            response = self.llm.complete(html_generation_prompt)
-            html_content = response.text.strip()
-            
-            # Remove markdown code blocks if present
-            if html_content.startswith("```html"):
-                html_content = html_content.split("```html")[1].split("```")[0].strip()
-            elif html_content.startswith("```"):
-                html_content = html_content.split("```")[1].split("```")[0].strip()
+            html_content = strip_code_fences(self.complete('html', html_generation_prompt), 'html')
             
             print("✓ HTML report generated")
             return html_content
@@ -114,6 +258,7 @@ class UXAnalyzer:
         if not report_content:
             print("❌ Analysis aborted: No report content")
             return False
+        report_content = self.compact(report_content)
         
         # Step 2: Analyze UX
         analysis_data = self.analyze_ux(report_content)
@@ -146,8 +291,19 @@ class UXAnalyzer:
         
         return success
     
-    def run_analysis_for_web(self, report_path="agent_result.txt", category="General", progress_callback=None, log_callback=None):
-        """Analysis pipeline for web interface - generates JSON blocks instead of full HTML"""
+    def run_analysis_for_web(self, report_path="agent_result.txt", category="General", progress_callback=None, log_callback=None, pipeline=None, analysis_mode='standard', app_name=None, evidence_store=None, run_id=None):
+        """Analysis pipeline for web interface - generates JSON blocks instead of full HTML
+        
+        If a drained PipelinedAnalyzer is given, its partial findings are merged
+        instead of analyzing the whole report in one call. analysis_mode 'parallel'
+        splits the analysis into concurrent per-dimension prompts; 'incremental'
+        only re-analyzes screens that changed since the app's previous run and
+        adds a "what changed" delta (requires app_name). With an EvidenceStore,
+        issues and positive patterns get the IDs of matching screenshots/UI trees.
+        With a run_id the analysis, delta and run metadata are written to
+        data/runs/<run_id>/ instead of the working directory, so concurrent runs
+        never overwrite each other's results.
+        """
         
         def log(message, log_type='info'):
             """Helper to send log if callback provided"""
@@ -155,12 +311,15 @@ class UXAnalyzer:
                 log_callback(message, log_type)
             print(f"[{log_type.upper()}] {message}")
         
+        run_id = run_id or (evidence_store.run_id if evidence_store is not None else None)
+        
         if progress_callback:
             progress_callback("Reading exploration report...", 75)
         log("Loading exploration report for analysis", 'info')
         
         # Step 1: Read report
-        report_content = self.read_report(report_path)
+        with profile_stage('read_report'):
+            report_content = self.read_report(report_path)
         if not report_content:
             log("No report content found", 'error')
             if progress_callback:
@@ -168,12 +327,47 @@ class UXAnalyzer:
             return False
         
         log(f"Report loaded: {len(report_content)} characters", 'success')
+        raw_report = report_content
+        with profile_stage('compact'):
+            report_content = self.compact(report_content, log)
         if progress_callback:
             progress_callback("Analyzing UX patterns...", 80)
         
-        log(f"Starting LLM-based UX analysis for {category} category", 'info')
-        # Step 2: Analyze UX with enhanced prompt for positive findings
-        analysis_data = self.analyze_ux_with_positive(report_content, category)
+        if pipeline is not None:
+            log(f"Merging pipelined analysis ({pipeline.chunks_analyzed} chunks analyzed during exploration)", 'info')
+            with profile_stage('pipeline.merge'):
+                analysis_data = pipeline.merge(report_content)
+        elif analysis_mode == 'parallel':
+            # Import here to avoid circular imports
+            from parallel_analysis import analyze_by_dimension
+            log(f"Starting parallel per-dimension UX analysis for {category} category", 'info')
+            with profile_stage('analyze_by_dimension'):
+                analysis_data = analyze_by_dimension(self, report_content, category, log)
+            if analysis_data is None:
+                log("Falling back to full UX analysis", 'warning')
+                with profile_stage('analyze_ux_with_positive'):
+                    analysis_data = self.analyze_ux_with_positive(report_content, category)
+        elif analysis_mode == 'incremental' and app_name:
+            # Import here to avoid circular imports
+            from incremental_analysis import analyze_incrementally
+            log(f"Starting incremental UX analysis against the previous {app_name} run", 'info')
+            with profile_stage('analyze_incrementally'):
+                analysis_data, delta = analyze_incrementally(self, raw_report, app_name, category, log)
+            if analysis_data is None:
+                log("Falling back to full UX analysis", 'warning')
+                with profile_stage('analyze_ux_with_positive'):
+                    analysis_data = self.analyze_ux_with_positive(report_content, category)
+            else:
+                analysis_data['changes'] = delta
+                delta_path = run_output_path(run_id, "ux_analysis_delta.json")
+                with open(delta_path, "w", encoding="utf-8") as f:
+                    json.dump(delta, f, indent=2)
+                log(f"What-changed delta saved: {delta_path}", 'success')
+        else:
+            log(f"Starting LLM-based UX analysis for {category} category", 'info')
+            # Step 2: Analyze UX with enhanced prompt for positive findings
+            with profile_stage('analyze_ux_with_positive'):
+                analysis_data = self.analyze_ux_with_positive(report_content, category)
         if not analysis_data:
             log("UX analysis failed to produce results", 'error')
             if progress_callback:
@@ -184,11 +378,24 @@ class UXAnalyzer:
         if progress_callback:
             progress_callback("Generating insights...", 90)
         
+        if run_id:
+            analysis_data['run_id'] = run_id
+        if evidence_store is not None:
+            # Import here to avoid circular imports
+            from evidence_store import link_findings_to_evidence
+            linked = link_findings_to_evidence(analysis_data, evidence_store)
+            log(f"Linked evidence to {linked} finding(s)", 'info')
+        
         # Save analysis blocks as JSON for web frontend
         try:
-            log("Saving analysis to ux_analysis_blocks.json", 'info')
-            with open("ux_analysis_blocks.json", "w", encoding="utf-8") as f:
-                json.dump(analysis_data, f, indent=2)
+            log(f"Saving analysis to {run_output_path(run_id, 'ux_analysis_blocks.json')}", 'info')
+            with profile_stage('json.dump'):
+                if run_id:
+                    save_run_analysis(run_id, analysis_data, app_name=app_name, category=category,
+                                      analysis_mode=analysis_mode)
+                else:
+                    with open("ux_analysis_blocks.json", "w", encoding="utf-8") as f:
+                        json.dump(analysis_data, f, indent=2)
             log("Analysis blocks saved successfully", 'success')
         except Exception as e:
             log(f"Error saving analysis: {str(e)}", 'error')
@@ -209,108 +416,14 @@ class UXAnalyzer:
 
         try:
             print("🔄 Analyzing UX with comprehensive metrics...")
-            response = self.llm.complete(analysis_prompt)
-            analysis_text = response.text.strip()
+            analysis_json = self.parse_json_response(self.complete('analysis', analysis_prompt))
             
-            # Remove markdown code blocks if present
-            if analysis_text.startswith("```json"):
-                analysis_text = analysis_text.split("```json")[1].split("```")[0].strip()
-            elif analysis_text.startswith("```"):
-                analysis_text = analysis_text.split("```")[1].split("```")[0].strip()
-            
-            analysis_json = json.loads(analysis_text)
-            
-            # Ensure all required fields exist with comprehensive defaults to prevent undefined errors
-            if 'summary' not in analysis_json:
-                analysis_json['summary'] = 'UX analysis completed.'
-            if 'positive' not in analysis_json:
-                analysis_json['positive'] = []
-            if 'issues' not in analysis_json:
-                analysis_json['issues'] = []
-            if 'recommendations' not in analysis_json:
-                analysis_json['recommendations'] = []
-            
-            # App metadata with all nested properties
-            if 'app_metadata' not in analysis_json:
-                analysis_json['app_metadata'] = {}
-            analysis_json['app_metadata'].setdefault('screens_discovered', 0)
-            analysis_json['app_metadata'].setdefault('total_interactions', 0)
-            analysis_json['app_metadata'].setdefault('core_flows', [])
-            
-            # Exploration coverage with all nested properties
-            if 'exploration_coverage' not in analysis_json:
-                analysis_json['exploration_coverage'] = {}
-            analysis_json['exploration_coverage'].setdefault('screens_discovered', 0)
-            analysis_json['exploration_coverage'].setdefault('clickable_elements_found', 0)
-            analysis_json['exploration_coverage'].setdefault('successful_actions_pct', 0)
-            analysis_json['exploration_coverage'].setdefault('dead_elements_pct', 0)
-            analysis_json['exploration_coverage'].setdefault('navigation_loops_detected', False)
-            
-            # Navigation metrics with all nested properties
-            if 'navigation_metrics' not in analysis_json:
-                analysis_json['navigation_metrics'] = {}
-            analysis_json['navigation_metrics'].setdefault('avg_depth', 0)
-            analysis_json['navigation_metrics'].setdefault('max_depth', 0)
-            analysis_json['navigation_metrics'].setdefault('backtracking_frequency', 'low')
-            analysis_json['navigation_metrics'].setdefault('orphan_screens', 0)
-            analysis_json['navigation_metrics'].setdefault('label_action_match_score', 5)
-            analysis_json['navigation_metrics'].setdefault('hub_screen_count', 0)
-            analysis_json['navigation_metrics'].setdefault('architecture_quality', 'moderate')
-            
-            # Interaction feedback with all nested properties
-            if 'interaction_feedback' not in analysis_json:
-                analysis_json['interaction_feedback'] = {}
-            analysis_json['interaction_feedback'].setdefault('visible_feedback_rate_pct', 0)
-            analysis_json['interaction_feedback'].setdefault('loading_state_presence_pct', 0)
-            analysis_json['interaction_feedback'].setdefault('error_message_clarity', 5)
-            analysis_json['interaction_feedback'].setdefault('silent_failures', 0)
-            analysis_json['interaction_feedback'].setdefault('feedback_quality', 'moderate')
-            
-            # Visual hierarchy with all nested properties
-            if 'visual_hierarchy' not in analysis_json:
-                analysis_json['visual_hierarchy'] = {}
-            analysis_json['visual_hierarchy'].setdefault('cta_visibility', 5)
-            analysis_json['visual_hierarchy'].setdefault('tap_target_compliance_pct', 0)
-            analysis_json['visual_hierarchy'].setdefault('icon_label_clarity', 5)
-            analysis_json['visual_hierarchy'].setdefault('hierarchy_issues', 0)
-            analysis_json['visual_hierarchy'].setdefault('clarity_rating', 'moderate')
-            
-            # Consistency with all nested properties
-            if 'consistency' not in analysis_json:
-                analysis_json['consistency'] = {}
-            analysis_json['consistency'].setdefault('reused_patterns', [])
-            analysis_json['consistency'].setdefault('inconsistent_labels', 0)
-            analysis_json['consistency'].setdefault('action_placement_variance', 'low')
-            analysis_json['consistency'].setdefault('pattern_violations', 0)
-            
-            # Error handling with all nested properties
-            if 'error_handling' not in analysis_json:
-                analysis_json['error_handling'] = {}
-            analysis_json['error_handling'].setdefault('preventable_errors', 0)
-            analysis_json['error_handling'].setdefault('recovery_paths_available', False)
-            analysis_json['error_handling'].setdefault('error_explanation_quality', 5)
-            analysis_json['error_handling'].setdefault('handling_rating', 'moderate')
-            
-            # UX confidence score with all nested properties
-            if 'ux_confidence_score' not in analysis_json:
-                analysis_json['ux_confidence_score'] = {}
-            analysis_json['ux_confidence_score'].setdefault('score', 5)
-            if 'factors' not in analysis_json['ux_confidence_score']:
-                analysis_json['ux_confidence_score']['factors'] = {}
-            analysis_json['ux_confidence_score']['factors'].setdefault('exploration_coverage', 5)
-            analysis_json['ux_confidence_score']['factors'].setdefault('interaction_consistency', 5)
-            analysis_json['ux_confidence_score']['factors'].setdefault('feedback_reliability', 5)
-            analysis_json['ux_confidence_score']['factors'].setdefault('recovery_robustness', 5)
-            
-            # Complexity score
-            if 'complexity_score' not in analysis_json:
-                analysis_json['complexity_score'] = 5
+            apply_analysis_defaults(analysis_json)
             
             print("✓ UX analysis completed with comprehensive metrics")
             return analysis_json
         except json.JSONDecodeError as e:
-            print(f"Error parsing JSON response: {str(e)}")
-            print(f"Raw response: {analysis_text[:500]}")
+            print(f"Error parsing repaired JSON response: {str(e)}")
             return None
         except Exception as e:
             print(f"Error during analysis: {str(e)}")
@@ -1,16 +1,36 @@
 """
 Startup verification script for DroidRun UX Tester
 Run this before starting the app to check configuration
+
+Checks run concurrently and passed results are cached for PREFLIGHT_CACHE_TTL
+seconds (in memory and under data/cache/), so restarts do not repeat the slow
+device ping.
 """
+import functools
+import importlib.util
+import io
+import json
 import os
 import sys
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-def check_droidrun_connection():
+# Seconds a passed check result is reused (0 disables the cache)
+try:
+    PREFLIGHT_CACHE_TTL = float(os.getenv("PREFLIGHT_CACHE_TTL", 60))
+except ValueError:
+    PREFLIGHT_CACHE_TTL = 60.0
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def check_droidrun_connection(out=print):
     """Check if DroidRun can connect to device"""
     try:
-        print("Checking device connection...")
+        out("Checking device connection...")
         result = subprocess.run(
             ['droidrun', 'ping'],
             capture_output=True,
@@ -19,42 +39,42 @@ def check_droidrun_connection():
         )
         
         if result.returncode == 0:
-            print("✅ Device connected and responsive")
+            out("✅ Device connected and responsive")
             return True
         else:
-            print("❌ Device not connected or not responding!")
-            print(f"   Error: {result.stderr}")
+            out("❌ Device not connected or not responding!")
+            out(f"   Error: {result.stderr}")
             return False
     except subprocess.TimeoutExpired:
-        print("❌ Device connection timeout!")
-        print("   Device is not responding")
+        out("❌ Device connection timeout!")
+        out("   Device is not responding")
         return False
     except FileNotFoundError:
-        print("❌ DroidRun command not found!")
-        print("   Is DroidRun installed?")
+        out("❌ DroidRun command not found!")
+        out("   Is DroidRun installed?")
         return False
     except Exception as e:
-        print(f"❌ Error checking device: {str(e)}")
+        out(f"❌ Error checking device: {str(e)}")
         return False
 
-def check_env_file():
+def check_env_file(out=print):
     """Check if .env file exists and has API key"""
     env_path = Path('.env')
     if not env_path.exists():
-        print("❌ .env file not found!")
-        print("   Create a .env file with: API_KEY=your_openrouter_key")
+        out("❌ .env file not found!")
+        out("   Create a .env file with: API_KEY=your_openrouter_key")
         return False
     
     with open(env_path, 'r') as f:
         content = f.read()
         if 'API_KEY' not in content:
-            print("❌ API_KEY not found in .env file!")
+            out("❌ API_KEY not found in .env file!")
             return False
     
-    print("✅ .env file configured")
+    out("✅ .env file configured")
     return True
 
-def check_directories():
+def check_directories(out=print):
     """Check if required directories exist"""
     dirs = ['templates', 'static', 'prompts']
     all_exist = True
@@ -62,14 +82,14 @@ def check_directories():
     for dirname in dirs:
         dir_path = Path(dirname)
         if not dir_path.exists():
-            print(f"❌ Directory missing: {dirname}")
+            out(f"❌ Directory missing: {dirname}")
             all_exist = False
         else:
-            print(f"✅ Directory exists: {dirname}")
+            out(f"✅ Directory exists: {dirname}")
     
     return all_exist
 
-def check_prompt_files():
+def check_prompt_files(out=print):
     """Check if prompt files exist"""
     prompts = ['agent_goal.txt', 'analysis_prompt_v2.txt', 'html_generation_prompt.txt']
     all_exist = True
@@ -77,14 +97,14 @@ def check_prompt_files():
     for prompt in prompts:
         prompt_path = Path('prompts') / prompt
         if not prompt_path.exists():
-            print(f"❌ Prompt file missing: {prompt}")
+            out(f"❌ Prompt file missing: {prompt}")
             all_exist = False
         else:
-            print(f"✅ Prompt file exists: {prompt}")
+            out(f"✅ Prompt file exists: {prompt}")
     
     return all_exist
 
-def check_template_files():
+def check_template_files(out=print):
     """Check if template files exist"""
     files = {
         'templates/index.html': 'Frontend template',
@@ -95,14 +115,14 @@ def check_template_files():
     for filepath, desc in files.items():
         file_path = Path(filepath)
         if not file_path.exists():
-            print(f"❌ File missing: {filepath} ({desc})")
+            out(f"❌ File missing: {filepath} ({desc})")
             all_exist = False
         else:
-            print(f"✅ File exists: {filepath}")
+            out(f"✅ File exists: {filepath}")
     
     return all_exist
 
-def check_imports():
+def check_imports(out=print):
     """Check if required packages are installed"""
     packages = {
         'flask': 'Flask',
@@ -113,40 +133,123 @@ def check_imports():
     all_installed = True
     
     for module, package in packages.items():
-        try:
-            __import__(module)
-            print(f"✅ Package installed: {package}")
-        except ImportError:
-            print(f"❌ Package missing: {package}")
-            print(f"   Install with: pip install {package}")
+        # Locate the package without importing it - the agent/LLM stacks are slow to import
+        if importlib.util.find_spec(module) is not None:
+            out(f"✅ Package installed: {package}")
+        else:
+            out(f"❌ Package missing: {package}")
+            out(f"   Install with: pip install {package}")
             all_installed = False
     
     return all_installed
 
-def main():
+CHECKS = [
+    ("Device Connection", check_droidrun_connection),
+    ("Environment Configuration", check_env_file),
+    ("Directory Structure", check_directories),
+    ("Prompt Files", check_prompt_files),
+    ("Template Files", check_template_files),
+    ("Python Packages", check_imports)
+]
+
+# Checks that only look at local files and packages - fast enough to block startup on
+LOCAL_CHECKS = [check for check in CHECKS if check[1] is not check_droidrun_connection]
+
+
+def _cache_path():
+    # Import here so the CLI works even if utils cannot be imported
+    from utils import get_data_dir
+    return get_data_dir('cache') / 'preflight.json'
+
+
+def _load_cache():
+    try:
+        with open(_cache_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_cache(cache):
+    try:
+        with open(_cache_path(), 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2)
+    except Exception as e:
+        print(f"Warning: could not save pre-flight cache: {str(e)}")
+
+
+def run_checks(checks=CHECKS, use_cache=True):
+    """Run pre-flight checks concurrently, reusing recent passed results
+    
+    Args:
+        checks: List of (name, check_function) tuples; each function takes an
+                output callable used like print()
+        use_cache: Reuse passed results younger than PREFLIGHT_CACHE_TTL
+    
+    Returns:
+        list: One dict per check (in order) with name, passed, output,
+              duration and cached
+    """
+    now = time.time()
+    with _cache_lock:
+        if use_cache and PREFLIGHT_CACHE_TTL > 0 and not _cache:
+            _cache.update(_load_cache())
+        cached = {
+            name: result for name, result in _cache.items()
+            if use_cache and PREFLIGHT_CACHE_TTL > 0 and now - result['checked_at'] < PREFLIGHT_CACHE_TTL
+        }
+    
+    def run(check):
+        name, check_func = check
+        if name in cached:
+            return dict(cached[name], cached=True)
+        # Each check prints into its own buffer; sys.stdout is left alone because
+        # other threads (e.g. a running exploration's log tee) may own it
+        buffer = io.StringIO()
+        out = functools.partial(print, file=buffer)
+        started = time.monotonic()
+        try:
+            passed = bool(check_func(out))
+        except Exception as e:
+            out(f"❌ Check failed with error: {str(e)}")
+            passed = False
+        output = buffer.getvalue()
+        return {'name': name, 'passed': passed, 'output': output,
+                'duration': round(time.monotonic() - started, 3), 'checked_at': time.time(), 'cached': False}
+    
+    with ThreadPoolExecutor(max_workers=len(checks) or 1) as executor:
+        results = list(executor.map(run, checks))
+    
+    fresh = {result['name']: result for result in results if result['passed'] and not result['cached']}
+    if fresh and PREFLIGHT_CACHE_TTL > 0:
+        with _cache_lock:
+            _cache.update({name: {k: v for k, v in result.items() if k != 'cached'} for name, result in fresh.items()})
+            _save_cache(_cache)
+    return results
+
+
+def print_results(results):
+    """Print each check's output in order; returns True if all passed"""
+    for result in results:
+        print(f"\n{result['name']}:")
+        print("-" * 40)
+        print(result['output'].rstrip('\n'))
+        if result['cached']:
+            print("   (cached result)")
+    return all(result['passed'] for result in results)
+
+
+def main(checks=CHECKS):
     """Run all checks"""
     print("=" * 60)
     print("DroidRun UX Tester - Startup Verification")
     print("=" * 60 + "\n")
     
-    checks = [
-        ("Device Connection", check_droidrun_connection),
-        ("Environment Configuration", check_env_file),
-        ("Directory Structure", check_directories),
-        ("Prompt Files", check_prompt_files),
-        ("Template Files", check_template_files),
-        ("Python Packages", check_imports)
-    ]
-    
-    all_passed = True
-    
-    for check_name, check_func in checks:
-        print(f"\n{check_name}:")
-        print("-" * 40)
-        if not check_func():
-            all_passed = False
+    started = time.monotonic()
+    all_passed = print_results(run_checks(checks))
     
     print("\n" + "=" * 60)
+    print(f"Checks finished in {time.monotonic() - started:.2f}s")
     if all_passed:
         print("✅ ALL CHECKS PASSED!")
         print("\nYou're ready to start the app:")